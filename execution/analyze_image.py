@@ -18,20 +18,20 @@ except ImportError:
     print(json.dumps({"status": "error", "message": "Faltan librerías. Ejecuta: pip install google-generativeai pillow"}))
     sys.exit(1)
 
-def main():
+def build_parser():
     parser = argparse.ArgumentParser(description="Analizar una imagen usando IA (Vision).")
     parser.add_argument("--image", required=True, help="Ruta local a la imagen.")
     parser.add_argument("--prompt", default="Describe esta imagen técnicamente.", help="Pregunta sobre la imagen.")
-    args = parser.parse_args()
+    return parser
 
+def run(args):
+    """Analiza la imagen con Gemini Vision y devuelve el resultado como diccionario."""
     api_key = os.getenv("GOOGLE_API_KEY")
     if not api_key:
-        print(json.dumps({"status": "error", "message": "Falta GOOGLE_API_KEY en .env"}))
-        sys.exit(1)
+        return {"status": "error", "message": "Falta GOOGLE_API_KEY en .env"}
 
     if not os.path.exists(args.image):
-        print(json.dumps({"status": "error", "message": f"Imagen no encontrada: {args.image}"}))
-        sys.exit(1)
+        return {"status": "error", "message": f"Imagen no encontrada: {args.image}"}
 
     try:
         genai.configure(api_key=api_key)
@@ -47,16 +47,22 @@ def main():
 
         response = model.generate_content([full_prompt, img])
         
-        print(json.dumps({
+        return {
             "status": "success",
             "description": response.text
-        }))
+        }
 
     except Exception as e:
-        print(json.dumps({
+        return {
             "status": "error",
             "message": str(e)
-        }))
+        }
+
+def main():
+    result = run(build_parser().parse_args())
+    print(json.dumps(result))
+    if result["status"] == "error":
+        sys.exit(1)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
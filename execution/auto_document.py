@@ -16,23 +16,24 @@ except ImportError:
     sys.exit(1)
 
 
-def main():
+def build_parser():
     parser = argparse.ArgumentParser(description="Añadir docstrings automáticamente a código Python.")
     parser.add_argument("--file", required=True, help="Ruta del archivo a documentar.")
-    args = parser.parse_args()
+    return parser
+
 
+def run(args):
+    """Añade docstrings a las funciones y clases que no los tienen y devuelve el resultado como diccionario."""
     file_path = args.file
 
     if not os.path.exists(file_path):
-        print(json.dumps({"status": "error", "message": f"Archivo no encontrado: {file_path}"}))
-        sys.exit(1)
+        return {"status": "error", "message": f"Archivo no encontrado: {file_path}"}
 
     try:
         with open(file_path, 'r', encoding='utf-8') as f:
             original_code = f.read()
     except Exception as e:
-        print(json.dumps({"status": "error", "message": f"Error leyendo archivo: {e}"}))
-        sys.exit(1)
+        return {"status": "error", "message": f"Error leyendo archivo: {e}"}
 
     # 1. Análisis previo para ahorrar tokens
     try:
@@ -44,12 +45,10 @@ def main():
                     missing_docs.append(node.name)
 
         if not missing_docs:
-            print(json.dumps({"status": "success", "message": "El archivo ya está completamente documentado."}))
-            sys.exit(0)
+            return {"status": "success", "message": "El archivo ya está completamente documentado."}
 
     except SyntaxError:
-        print(json.dumps({"status": "error", "message": "El archivo tiene errores de sintaxis y no se puede procesar."}))
-        sys.exit(1)
+        return {"status": "error", "message": "El archivo tiene errores de sintaxis y no se puede procesar."}
 
     # 2. Generación con LLM
     prompt = f"""Actúa como un Ingeniero de Software Senior experto en Python.
@@ -75,12 +74,10 @@ CÓDIGO A DOCUMENTAR ({file_path}):
     elif os.getenv("GOOGLE_API_KEY"):
         response = chat_gemini(messages)
     else:
-        print(json.dumps({"status": "error", "message": "No se encontraron API Keys configuradas en .env"}))
-        sys.exit(1)
+        return {"status": "error", "message": "No se encontraron API Keys configuradas en .env"}
 
     if "error" in response:
-        print(json.dumps({"status": "error", "message": response["error"]}))
-        sys.exit(1)
+        return {"status": "error", "message": response["error"]}
 
     new_code = response.get("content", "")
 
@@ -98,17 +95,22 @@ CÓDIGO A DOCUMENTAR ({file_path}):
     try:
         ast.parse(new_code)
     except SyntaxError as e:
-        print(json.dumps({"status": "error", "message": f"El código generado tiene errores de sintaxis: {e}"}))
-        sys.exit(1)
+        return {"status": "error", "message": f"El código generado tiene errores de sintaxis: {e}"}
 
     # 4. Guardado
     try:
         with open(file_path, 'w', encoding='utf-8') as f:
             f.write(new_code)
-        print(json.dumps({"status": "success",
-              "message": f"Se añadieron docstrings a {len(missing_docs)} elementos en {file_path}."}))
+        return {"status": "success",
+                "message": f"Se añadieron docstrings a {len(missing_docs)} elementos en {file_path}."}
     except Exception as e:
-        print(json.dumps({"status": "error", "message": f"Error escribiendo archivo: {e}"}))
+        return {"status": "error", "message": f"Error escribiendo archivo: {e}"}
+
+
+def main():
+    result = run(build_parser().parse_args())
+    print(json.dumps(result))
+    if result.get("status") == "error":
         sys.exit(1)
 
 
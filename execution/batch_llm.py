@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+"""
+Lotes de prompts o de tareas sobre archivos, en paralelo y reanudables.
+
+`generate_tests.py`, `auto_document.py`, `refactor_code.py`, `explain_code.py` y
+`translate_text.py` atienden un archivo por ejecución: documentar todo
+`execution/` eran 50 llamadas seguidas al CLI. Aquí un JSONL de entrada describe
+los elementos y se procesan `--concurrency` a la vez (`LLM_BATCH_CONCURRENCY`,
+con prioridad de fondo en el limitador de cada API key, ver rate_limiter.py):
+
+- `{"id": "...", "prompt": "...", "system": "...", "provider": "groq"}`: una
+  llamada con la cadena de proveedores de chat_with_llm (hedging incluido).
+- `{"id": "...", "task": "document", "file": "ruta.py"}`: ejecuta la herramienta
+  de la tarea (`TASKS`) sobre el archivo; `lang` (translate) e `issues`
+  (refactor) se pasan como sus argumentos.
+
+Cada resultado se añade como una línea a `--output` con la latencia, los tokens
+y el coste estimado (llm_usage.py). El archivo de salida es también el punto de
+control: al repetir el lote se saltan los elementos que ya terminaron bien.
+
+Uso:
+    python execution/batch_llm.py --input prompts.jsonl --output resultados.jsonl
+    python execution/batch_llm.py --task document --path execution/
+    python execution/batch_llm.py --task translate --path docs/ --lang Inglés
+"""
+import argparse
+import fnmatch
+import importlib
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Añadir el directorio actual al path para importar las herramientas
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from llm_usage import meter
+from rate_limiter import priority, BACKGROUND
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BATCH_DIR = os.path.join(PROJECT_ROOT, ".tmp", "batch")
+
+BATCH_CONCURRENCY = int(os.getenv("LLM_BATCH_CONCURRENCY", "4"))
+
+# tarea: (módulo de execution/, campos del elemento que se pasan como argumentos, patrón por defecto)
+TASKS = {
+    "document": ("auto_document", (), "*.py"),
+    "tests": ("generate_tests", (), "*.py"),
+    "refactor": ("refactor_code", ("issues",), "*.py"),
+    "explain": ("explain_code", (), "*.py"),
+    "translate": ("translate_text", ("lang",), "*.md"),
+}
+
+
+def load_items(path):
+    """Elementos del JSONL de entrada, con `id` (por defecto `tarea:archivo` o el número de línea)."""
+    items, seen = [], set()
+    with open(path, 'r', encoding='utf-8') as f:
+        for number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                item = json.loads(line)
+            except ValueError as e:
+                raise ValueError(f"Línea {number} no es JSON válido: {e}")
+            if "task" in item:
+                if item["task"] not in TASKS or not item.get("file"):
+                    raise ValueError(f"Línea {number}: la tarea debe ser una de {sorted(TASKS)} y llevar 'file'.")
+                default_id = f"{item['task']}:{item['file']}"
+            elif "prompt" in item:
+                default_id = str(number)
+            else:
+                raise ValueError(f"Línea {number}: falta 'prompt' o 'task'.")
+            item["id"] = str(item.get("id") or default_id)
+            if item["id"] in seen:
+                raise ValueError(f"Línea {number}: id repetido '{item['id']}'.")
+            seen.add(item["id"])
+            items.append(item)
+    return items
+
+
+def items_for_path(task, path, pattern=None, **extra):
+    """Un elemento por archivo de `path` (archivo o carpeta, recursiva) que encaje con `pattern`."""
+    pattern = pattern or TASKS[task][2]
+    if os.path.isfile(path):
+        files = [path]
+    else:
+        files = []
+        for root, dirs, names in os.walk(path):
+            dirs[:] = sorted(d for d in dirs if not d.startswith(".") and d != "__pycache__")
+            files += [os.path.join(root, name) for name in sorted(names) if fnmatch.fnmatch(name, pattern)]
+
+    if task == "tests":
+        # No generar tests de los propios tests
+        files = [f for f in files if not os.path.basename(f).startswith("test_")]
+    if task == "translate" and extra.get("lang"):
+        # Ni volver a traducir las salidas de una pasada anterior (<nombre>_<idioma>.<ext>)
+        suffix = "_" + extra["lang"].lower().split()[0]
+        files = [f for f in files if not os.path.splitext(f)[0].endswith(suffix)]
+
+    return [dict(extra, id=f"{task}:{f}", task=task, file=f) for f in files]
+
+
+def load_checkpoint(output_path):
+    """Ids que ya terminaron bien en una pasada anterior."""
+    done = set()
+    try:
+        with open(output_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue  # línea a medio escribir cuando se cortó el proceso
+                if record.get("status") == "success":
+                    done.add(record.get("id"))
+    except FileNotFoundError:
+        pass
+    return done
+
+
+def execute_item(item):
+    """Resuelve un elemento y devuelve el diccionario de la herramienta (con `status`)."""
+    if "task" in item:
+        module_name, fields, _ = TASKS[item["task"]]
+        module = importlib.import_module(module_name)
+        argv = ["--file", item["file"]]
+        for field in fields:
+            if item.get(field) is not None:
+                argv += [f"--{field}", str(item[field])]
+        try:
+            args = module.build_parser().parse_args(argv)
+        except SystemExit:
+            return {"status": "error", "message": f"Argumentos inválidos para {module_name}: {argv}"}
+        return module.run(args)
+
+    from chat_with_llm import complete, provider_keys
+    result = complete(item["prompt"], item.get("system"), provider_keys(item.get("provider")))
+    if "content" not in result:
+        return {"status": "error", "message": result.get("error", "sin respuesta")}
+    return {"status": "success", "content": result["content"],
+            "provider": result.get("provider"), "model": result.get("model")}
+
+
+def _percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(int(q * len(values)), len(values) - 1)]
+
+
+def run_batch(items, output_path, concurrency=BATCH_CONCURRENCY, execute=execute_item):
+    """
+    Procesa `items` en paralelo y añade un registro por elemento a `output_path`.
+    Devuelve el resumen del lote (elementos, latencias, tokens y coste).
+    """
+    done = load_checkpoint(output_path)
+    pending = [item for item in items if item["id"] not in done]
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    lock = threading.Lock()
+    records = []
+
+    def work(item):
+        start = time.perf_counter()
+        # Trabajo por lotes: cede el turno al chat interactivo en el limitador de cada API key
+        with priority(BACKGROUND), meter() as usage:
+            try:
+                result = execute(item)
+            except Exception as e:
+                result = {"status": "error", "message": str(e)}
+        totals = usage.totals()
+        record = dict(result or {"status": "error", "message": "sin resultado"}, id=item["id"],
+                      latency_s=round(time.perf_counter() - start, 3), cost_usd=totals.pop("cost_usd"), usage=totals)
+        with lock:
+            records.append(record)
+            with open(output_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        mark = "✅" if record.get("status") == "success" else "❌"
+        print(f"{mark} [BATCH] {len(records)}/{len(pending)} {item['id']} ({record['latency_s']}s)", file=sys.stderr)
+
+    start = time.perf_counter()
+    if pending:
+        with ThreadPoolExecutor(max_workers=max(min(concurrency, len(pending)), 1)) as pool:
+            list(pool.map(work, pending))
+
+    failed = [r["id"] for r in records if r.get("status") != "success"]
+    latencies = [r["latency_s"] for r in records]
+    costs = [r["cost_usd"] for r in records if r["cost_usd"] is not None]
+    summary = {
+        "status": "error" if failed else "success",
+        "output": output_path,
+        "total": len(items),
+        "ok": len(records) - len(failed),
+        "failed": len(failed),
+        "skipped": len(items) - len(pending),
+        "seconds": round(time.perf_counter() - start, 2),
+        "latency_p50_s": _percentile(latencies, 0.5),
+        "latency_p90_s": _percentile(latencies, 0.9),
+        "input_tokens": sum(r["usage"]["input_tokens"] for r in records),
+        "output_tokens": sum(r["usage"]["output_tokens"] for r in records),
+        "cost_usd": round(sum(costs), 6) if costs else None,
+    }
+    if failed:
+        summary["failed_ids"] = failed
+        summary["message"] = f"Fallaron {len(failed)} elementos; repite el comando para reintentar solo esos."
+    return summary
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Ejecutar en lote prompts o tareas sobre archivos (en paralelo y reanudable).")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--input", help="JSONL con un elemento por línea ('prompt' o 'task' + 'file').")
+    source.add_argument("--task", choices=sorted(TASKS), help="Tarea a aplicar a cada archivo de --path.")
+    parser.add_argument("--path", help="Archivo o carpeta (recursiva) para --task.")
+    parser.add_argument("--glob", help="Patrón de nombres de archivo para --task (por defecto *.py, o *.md en translate).")
+    parser.add_argument("--lang", help="Idioma destino (tarea translate).")
+    parser.add_argument("--issues", help="Problemas a corregir (tarea refactor).")
+    parser.add_argument("--output", help="JSONL de resultados y punto de control (por defecto .tmp/batch/<nombre>.jsonl).")
+    parser.add_argument("--concurrency", type=int, default=BATCH_CONCURRENCY, help="Elementos en paralelo.")
+    return parser
+
+
+def run(args):
+    if args.task:
+        if not args.path or not os.path.exists(args.path):
+            return {"status": "error", "message": f"--task necesita un --path existente (recibido: {args.path})."}
+        if args.task == "translate" and not args.lang:
+            return {"status": "error", "message": "La tarea translate necesita --lang."}
+        if args.task == "refactor" and not args.issues:
+            return {"status": "error", "message": "La tarea refactor necesita --issues."}
+        extra = {k: v for k, v in (("lang", args.lang), ("issues", args.issues)) if v}
+        items = items_for_path(args.task, args.path, args.glob, **extra)
+        name = args.task
+    else:
+        if not os.path.exists(args.input):
+            return {"status": "error", "message": f"Archivo no encontrado: {args.input}"}
+        try:
+            items = load_items(args.input)
+        except ValueError as e:
+            return {"status": "error", "message": str(e)}
+        name = os.path.splitext(os.path.basename(args.input))[0]
+
+    if not items:
+        return {"status": "error", "message": "No hay elementos que procesar."}
+    output_path = args.output or os.path.join(BATCH_DIR, f"{name}.jsonl")
+    return run_batch(items, output_path, args.concurrency)
+
+
+def main():
+    result = run(build_parser().parse_args())
+    print(json.dumps(result, indent=2, ensure_ascii=False))
+    if result.get("status") == "error":
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
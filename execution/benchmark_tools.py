@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+import argparse
+import os
+import statistics
+import sys
+import time
+
+# Añadir el directorio actual al path para importar tool_registry
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from tool_registry import ToolRegistry
+
+# Turno representativo del listener que no necesita red ni credenciales:
+# lectura OBD, consulta de memoria (RAG), biblioteca y segunda lectura OBD.
+DEFAULT_TURN = [
+    ("simulate_obd.py", ["--query", "dtc", "--no-delay"]),
+    ("chat_with_llm.py", ["--prompt", "P0340 siena", "--memory-only"]),
+    ("list_documents.py", []),
+    ("chat_with_llm.py", ["--prompt", "mantenimiento servicio 60000 km", "--memory-only"]),
+    ("simulate_obd.py", ["--query", "rpm", "--no-delay"]),
+]
+
+
+def measure_turns(registry, turns):
+    """Ejecuta `turns` turnos completos y devuelve la duración de cada uno (s)."""
+    durations = []
+    for _ in range(turns):
+        start = time.perf_counter()
+        for script, args in DEFAULT_TURN:
+            registry.run(script, args)
+        durations.append(time.perf_counter() - start)
+    return durations
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Comparar la latencia por turno del listener: herramientas en proceso vs. subprocesos.")
+    parser.add_argument("--turns", type=int, default=5, help="Número de turnos a medir por modo.")
+    args = parser.parse_args()
+
+    print("\n🏎️  BENCHMARK DE HERRAMIENTAS DEL LISTENER")
+    print("========================================")
+    print(f"Turno: {len(DEFAULT_TURN)} llamadas ({', '.join(s for s, _ in DEFAULT_TURN)})\n")
+
+    results = {}
+    for label, isolated in (("Subproceso (aislado)", True), ("En proceso", False)):
+        print(f"⏳ Midiendo {label}...", end="", flush=True)
+        registry = ToolRegistry(isolated=isolated)
+        # El primer turno incluye los imports (arranque en frío) y se reporta aparte
+        cold = measure_turns(registry, 1)[0]
+        warm = measure_turns(registry, args.turns)
+        results[label] = (cold, warm)
+        print(f" ✅ {statistics.mean(warm):.3f}s/turno")
+
+    print("\n📊 RESULTADOS POR TURNO (Menor es mejor)")
+    print("----------------------------------------")
+    print(f"{'Modo':<22} | {'Frío':>8} | {'Media':>8} | {'Mediana':>8} | {'Máx':>8}")
+    for label, (cold, warm) in results.items():
+        print(f"{label:<22} | {cold:>7.3f}s | {statistics.mean(warm):>7.3f}s | {statistics.median(warm):>7.3f}s | {max(warm):>7.3f}s")
+
+    isolated_mean = statistics.mean(results["Subproceso (aislado)"][1])
+    in_process_mean = statistics.mean(results["En proceso"][1])
+    if in_process_mean > 0:
+        print(f"\n⚡ Aceleración en régimen: x{isolated_mean / in_process_mean:.1f}")
+
+
+if __name__ == "__main__":
+    main()
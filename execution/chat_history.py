@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+"""
+Historial de conversación por chat.
+
+Antes todos los usuarios de Telegram compartían `.tmp/chat_history.json`, se
+recortaba a los últimos 10 mensajes sin mirar su tamaño y el archivo entero se
+reescribía en cada turno. Ahora:
+
+- Cada chat tiene su archivo `.tmp/chat_history/<chat_id>.jsonl`; cada turno se
+  añade como una línea (append), sin reescribir lo anterior.
+- `window()` elige los turnos recientes que caben en el presupuesto de tokens del
+  proveedor (`HISTORY_TOKENS`, ajustable con `LLM_HISTORY_TOKENS_<PROVEEDOR>`).
+  Los tokens se cuentan con `prompt_budget.count_tokens`, igual que el límite de
+  entrada que comprueba chat_with_llm.py: lo que cabe aquí cabe allí.
+- Cuando lo guardado supera `COMPACT_AT_TOKENS`, los turnos antiguos se resumen
+  (`compact`) en un resumen acumulado que encabeza el contexto; el archivo se
+  reescribe de forma atómica (tmp + rename).
+"""
+import json
+import os
+import re
+import sys
+import threading
+import time
+
+from prompt_budget import count_tokens
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HISTORY_DIR = os.path.join(PROJECT_ROOT, ".tmp", "chat_history")
+# Historial global anterior; se migra al chat "default" la primera vez
+LEGACY_HISTORY_FILE = os.path.join(PROJECT_ROOT, ".tmp", "chat_history.json")
+DEFAULT_CHAT_ID = "default"
+
+# Tokens de historial por proveedor (el límite real lo marca el TPM del plan, no la ventana del modelo)
+HISTORY_TOKENS = {
+    "groq": 3000,
+    "gemini": 8000,
+    "openai": 6000,
+    "anthropic": 6000,
+}
+DEFAULT_HISTORY_TOKENS = 4000
+COMPACT_AT_TOKENS = int(os.getenv("LLM_HISTORY_COMPACT_TOKENS", "3000"))
+# Tras compactar se conservan literalmente los turnos más recientes hasta este tamaño
+KEEP_RECENT_TOKENS = int(os.getenv("LLM_HISTORY_KEEP_TOKENS", "1200"))
+
+_LOCKS = {}
+_LOCKS_LOCK = threading.Lock()
+
+
+def history_budget(provider):
+    """Tokens de historial permitidos para `provider`."""
+    env = os.getenv(f"LLM_HISTORY_TOKENS_{(provider or '').upper()}")
+    if env:
+        return int(env)
+    return HISTORY_TOKENS.get(provider, DEFAULT_HISTORY_TOKENS)
+
+
+def turn_tokens(turn):
+    return count_tokens(turn["content"]) + 4  # rol y separadores
+
+
+def _chat_lock(path):
+    with _LOCKS_LOCK:
+        return _LOCKS.setdefault(path, threading.Lock())
+
+
+class ChatHistory:
+    """Historial de un chat: resumen acumulado + turnos recientes en un JSONL."""
+
+    def __init__(self, chat_id=None, root=HISTORY_DIR):
+        self.chat_id = str(chat_id or DEFAULT_CHAT_ID)
+        safe_id = re.sub(r"[^\w.-]", "_", self.chat_id)
+        self.path = os.path.join(root, f"{safe_id}.jsonl")
+        self._lock = _chat_lock(self.path)
+
+    def _migrate_legacy(self):
+        if self.chat_id != DEFAULT_CHAT_ID or os.path.exists(self.path) or not os.path.exists(LEGACY_HISTORY_FILE):
+            return
+        try:
+            with open(LEGACY_HISTORY_FILE, 'r', encoding='utf-8') as f:
+                legacy = json.load(f)
+        except (OSError, ValueError):
+            return
+        self._write(None, [{"role": m.get("role", "user"), "content": str(m.get("content", ""))} for m in legacy])
+
+    def load(self):
+        """Devuelve `(resumen, turnos)`; el resumen es None si aún no se compactó."""
+        with self._lock:
+            self._migrate_legacy()
+            return self._read()
+
+    def _read(self):
+        summary, turns = None, []
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue  # línea a medio escribir (corte de luz): se ignora
+                    if record.get("type") == "summary":
+                        summary = record["content"]
+                    else:
+                        turns.append({"role": record["role"], "content": record["content"]})
+        except FileNotFoundError:
+            pass
+        return summary, turns
+
+    def append(self, *turns):
+        """Añade turnos al final, en una sola escritura."""
+        lines = "".join(
+            json.dumps({"role": t["role"], "content": t["content"], "ts": time.time()}, ensure_ascii=False) + "\n"
+            for t in turns
+        )
+        with self._lock:
+            self._migrate_legacy()
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(lines)
+
+    def _write(self, summary, turns):
+        """Reescritura atómica completa (solo al compactar o migrar)."""
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            if summary:
+                f.write(json.dumps({"type": "summary", "content": summary}, ensure_ascii=False) + "\n")
+            for t in turns:
+                f.write(json.dumps({"role": t["role"], "content": t["content"]}, ensure_ascii=False) + "\n")
+        os.replace(tmp_path, self.path)
+
+    def clear(self):
+        with self._lock:
+            for path in (self.path, LEGACY_HISTORY_FILE if self.chat_id == DEFAULT_CHAT_ID else None):
+                if path and os.path.exists(path):
+                    os.remove(path)
+
+    def needs_compaction(self, turns):
+        return sum(turn_tokens(t) for t in turns) > COMPACT_AT_TOKENS
+
+    def compact(self, summarize):
+        """
+        Resume los turnos antiguos con `summarize(resumen_anterior, turnos) -> str`
+        y conserva literalmente los recientes. La llamada al LLM se hace sin bloquear
+        el chat; los turnos añadidos mientras tanto se mantienen. Devuelve True si compactó.
+        """
+        summary, turns = self.load()
+        if not self.needs_compaction(turns):
+            return False
+        keep = split_recent(turns, KEEP_RECENT_TOKENS)
+        old = turns[:len(turns) - len(keep)]
+        if not old:
+            return False
+
+        try:
+            new_summary = summarize(summary, old)
+        except Exception as e:
+            print(f"⚠️  [HISTORY] No se pudo resumir el historial de {self.chat_id}: {e}", file=sys.stderr)
+            new_summary = None
+        if not new_summary:
+            return False
+
+        with self._lock:
+            current_summary, current = self._read()
+            if current_summary != summary or current[:len(old)] != old:
+                return False  # otro proceso compactó a la vez; se reintentará en el próximo turno
+            self._write(new_summary.strip(), current[len(old):])
+        return True
+
+
+def split_recent(turns, budget):
+    """Turnos más recientes que caben en `budget` tokens, empezando por un mensaje del usuario."""
+    kept, used = [], 0
+    for turn in reversed(turns):
+        cost = turn_tokens(turn)
+        if kept and used + cost > budget:
+            break
+        kept.append(turn)
+        used += cost
+    kept.reverse()
+    # Anthropic y Gemini exigen que el historial empiece por el usuario
+    while kept and kept[0]["role"] != "user":
+        kept.pop(0)
+    return kept
+
+
+def window(summary, turns, budget):
+    """
+    Mensajes de historial para un proveedor: los turnos recientes que caben en
+    `budget` junto al resumen, que se antepone al primer mensaje (así no rompe la
+    alternancia usuario/asistente que exigen algunos proveedores).
+    """
+    summary_cost = count_tokens(summary) if summary else 0
+    messages = [dict(t) for t in split_recent(turns, max(budget - summary_cost, 0))]
+    if summary:
+        header = f"[Resumen de la conversación anterior]\n{summary}"
+        if messages:
+            messages[0]["content"] = f"{header}\n\n---\n{messages[0]['content']}"
+        else:
+            messages = [{"role": "user", "content": header}, {"role": "assistant", "content": "Entendido."}]
+    return messages
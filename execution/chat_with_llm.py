@@ -3,7 +3,8 @@ import os
 import sys
 import json
 import argparse
-import requests
+import inspect
+import threading
 import warnings
 
 # Suppress warnings to ensure clean JSON output
@@ -21,6 +22,17 @@ try:
 except ImportError:
     chromadb = None
 
+from memory_service import get_service, parse_types
+from reranker import retrieve
+from llm_transport import get_transport, base_url, iter_sse
+from provider_hedging import hedged_call
+from provider_health import get_health
+from response_cache import get_response_cache, scope_key
+from chat_history import ChatHistory, history_budget, turn_tokens, window
+from prompt_budget import count_tokens, input_limit
+from rate_limiter import get_limiter, request_tokens, priority, BACKGROUND, INTERACTIVE
+from llm_usage import record
+
 # Intentar cargar variables de entorno si python-dotenv está instalado
 try:
     from dotenv import load_dotenv, find_dotenv
@@ -28,29 +40,23 @@ try:
 except ImportError:
     pass
 
-HISTORY_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".tmp", "chat_history.json")
-
-
-def load_history():
-    if os.path.exists(HISTORY_FILE):
-        try:
-            with open(HISTORY_FILE, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except Exception:
-            return []
-    return []
-
+# Instrucción para compactar el historial antiguo en un resumen
+SUMMARY_SYSTEM = (
+    "Resume la conversación para que un asistente pueda continuarla. Conserva datos concretos "
+    "(vehículo, códigos, medidas, decisiones y preguntas pendientes). Máximo 200 palabras, en español."
+)
 
-def save_history(history):
-    os.makedirs(os.path.dirname(HISTORY_FILE), exist_ok=True)
-    with open(HISTORY_FILE, 'w', encoding='utf-8') as f:
-        json.dump(history, f, indent=2, ensure_ascii=False)
 
-def get_memory_context(query):
-    """Busca contexto relevante en la memoria vectorial (ChromaDB)."""
+def get_memory_context(query, types=None):
+    """
+    Busca contexto relevante en la memoria (ChromaDB + índice léxico BM25), solo
+    entre los recuerdos de `types` (note, manual, fact) si se indican.
+    `query` puede ser una lista de consultas: se buscan en un solo lote.
+    Devuelve `(contexto o None, informe del recuperador o None)`.
+    """
     if not chromadb:
         print("⚠️  [RAG] ChromaDB no instalado o no importado.", file=sys.stderr)
-        return None
+        return None, None
         
     try:
         # Ruta a la base de datos (mismo path que save_memory.py)
@@ -58,36 +64,78 @@ def get_memory_context(query):
         
         if not os.path.exists(db_path):
             print(f"⚠️  [RAG] No se encontró base de datos en: {db_path}", file=sys.stderr)
-            return None
+            return None, None
 
-        client = chromadb.PersistentClient(path=db_path)
-        collection = client.get_or_create_collection(name='agent_memory')
+        # Cliente, colección y embeddings de consultas repetidas se reutilizan (ver memory_service.py).
+        # Dos etapas: búsqueda híbrida (vectorial + BM25) de RAG_CANDIDATES candidatos y
+        # re-puntuación con umbral y presupuesto de tokens (ver reranker.py)
+        items, report = retrieve(get_service(db_path), query, types=types)
         
-        results = collection.query(
-            query_texts=[query],
-            n_results=3 # Recuperar los 3 recuerdos más relevantes
-        )
-        
-        documents = results.get('documents', [[]])[0]
-        if documents:
-            # Deduplicar resultados preservando el orden
-            seen = set()
-            unique_docs = []
-            for doc in documents:
-                if doc not in seen:
-                    unique_docs.append(doc)
-                    seen.add(doc)
-            
-            preview = unique_docs[0][:60] + "..." if len(unique_docs[0]) > 60 else unique_docs[0]
-            print(f"🧠 [RAG] Contexto inyectado ({len(unique_docs)} items): '{preview}'", file=sys.stderr)
-            return "\n".join([f"- {doc}" for doc in unique_docs])
+        if items:
+            preview = items[0]["document"][:60] + "..." if len(items[0]["document"]) > 60 else items[0]["document"]
+            print(f"🧠 [RAG] Contexto inyectado ({report['kept']}/{report['candidates']} items, "
+                  f"{report['context_tokens']} tokens, {report['timings_ms']['total_ms']}ms): '{preview}'", file=sys.stderr)
+            return "\n".join([f"- {item['document']}" for item in items]), report
         else:
-            print("🧠 [RAG] No se encontraron recuerdos relevantes para esta consulta.", file=sys.stderr)
+            print(f"🧠 [RAG] No se encontraron recuerdos relevantes para esta consulta "
+                  f"({report['below_cutoff']} candidatos bajo el umbral).", file=sys.stderr)
+            return None, report
     except Exception as e:
         print(f"❌ [RAG] Error al consultar memoria: {e}", file=sys.stderr)
-    return None
-
-def chat_openai(messages, model="gpt-4o-mini", system_instruction=None):
+    return None, None
+
+def _collect_stream(deltas, on_delta, cancel=None, resp=None):
+    """
+    Pasa cada fragmento de texto a `on_delta` según llega y devuelve la respuesta completa.
+    Si `cancel` se activa (otro proveedor ya respondió) corta el stream y cierra la conexión.
+    """
+    parts = []
+    try:
+        for delta in deltas:
+            if cancel is not None and cancel.is_set():
+                raise RuntimeError("Cancelado: otro proveedor respondió antes.")
+            if delta:
+                parts.append(delta)
+                on_delta(delta)
+    finally:
+        if resp is not None:
+            resp.close()
+    return "".join(parts)
+
+
+def _openai_deltas(resp):
+    """Fragmentos de texto de un stream SSE de OpenAI (también Groq)."""
+    for _, data in iter_sse(resp):
+        if not isinstance(data, dict):
+            continue
+        if "error" in data:
+            raise RuntimeError(data["error"].get("message", str(data["error"])))
+        for choice in data.get("choices", []):
+            yield (choice.get("delta") or {}).get("content")
+
+
+def _anthropic_deltas(resp):
+    """Fragmentos de texto de un stream SSE de Anthropic (eventos content_block_delta)."""
+    for _, data in iter_sse(resp):
+        if not isinstance(data, dict):
+            continue
+        if data.get("type") == "error":
+            raise RuntimeError(data.get("error", {}).get("message", "Error en el stream"))
+        if data.get("type") == "content_block_delta":
+            yield data.get("delta", {}).get("text")
+
+
+def _record_usage(provider, model, request_messages, content, input_tokens=None, output_tokens=None):
+    """Anota los tokens de la llamada (llm_usage.py); si el proveedor no los da (streaming), se estiman."""
+    estimated = input_tokens is None or output_tokens is None
+    if input_tokens is None:
+        input_tokens = request_tokens(request_messages, output_tokens=0)
+    if output_tokens is None:
+        output_tokens = count_tokens(content)
+    record(provider, model, input_tokens, output_tokens, estimated)
+
+
+def chat_openai(messages, model="gpt-4o-mini", system_instruction=None, on_delta=None, cancel=None):
     api_key = os.getenv("OPENAI_API_KEY")
     if not api_key:
         return {"error": "Falta OPENAI_API_KEY en .env"}
@@ -104,17 +152,27 @@ def chat_openai(messages, model="gpt-4o-mini", system_instruction=None):
         ] + messages,
         "temperature": 0.7
     }
+    if on_delta:
+        data["stream"] = True
 
     try:
-        resp = requests.post("https://api.openai.com/v1/chat/completions", headers=headers, json=data, timeout=30)
+        resp = get_transport().post(f"{base_url('openai')}/chat/completions", headers=headers, json=data, stream=bool(on_delta), cancel=cancel,
+                                    limiter=get_limiter("openai", api_key), tokens=request_tokens(data["messages"]))
         resp.raise_for_status()
+        if on_delta:
+            content = _collect_stream(_openai_deltas(resp), on_delta, cancel, resp)
+            _record_usage("openai", model, data["messages"], content)
+            return {"content": content}
         result = resp.json()
-        return {"content": result['choices'][0]['message']['content']}
+        usage = result.get("usage") or {}
+        content = result['choices'][0]['message']['content']
+        _record_usage("openai", model, data["messages"], content, usage.get("prompt_tokens"), usage.get("completion_tokens"))
+        return {"content": content}
     except Exception as e:
         return {"error": str(e)}
 
 
-def chat_anthropic(messages, model="claude-3-5-sonnet-20240620", system_instruction=None):
+def chat_anthropic(messages, model="claude-3-5-sonnet-20240620", system_instruction=None, on_delta=None, cancel=None):
     api_key = os.getenv("ANTHROPIC_API_KEY")
     if not api_key:
         return {"error": "Falta ANTHROPIC_API_KEY en .env"}
@@ -131,16 +189,27 @@ def chat_anthropic(messages, model="claude-3-5-sonnet-20240620", system_instruct
         "messages": messages,
         "system": sys_msg
     }
+    if on_delta:
+        data["stream"] = True
 
     try:
-        resp = requests.post("https://api.anthropic.com/v1/messages", headers=headers, json=data, timeout=30)
+        resp = get_transport().post(f"{base_url('anthropic')}/messages", headers=headers, json=data, stream=bool(on_delta), cancel=cancel,
+                                    limiter=get_limiter("anthropic", api_key), tokens=request_tokens(messages, sys_msg, data["max_tokens"]))
         resp.raise_for_status()
+        request_messages = [{"content": sys_msg}] + messages
+        if on_delta:
+            content = _collect_stream(_anthropic_deltas(resp), on_delta, cancel, resp)
+            _record_usage("anthropic", model, request_messages, content)
+            return {"content": content}
         result = resp.json()
-        return {"content": result['content'][0]['text']}
+        usage = result.get("usage") or {}
+        content = result['content'][0]['text']
+        _record_usage("anthropic", model, request_messages, content, usage.get("input_tokens"), usage.get("output_tokens"))
+        return {"content": content}
     except Exception as e:
         return {"error": str(e)}
 
-def chat_groq(messages, model="llama-3.3-70b-versatile", system_instruction=None):
+def chat_groq(messages, model="llama-3.3-70b-versatile", system_instruction=None, on_delta=None, cancel=None):
     api_key = os.getenv("GROQ_API_KEY")
     if not api_key:
         return {"error": "Falta GROQ_API_KEY en .env"}
@@ -167,19 +236,40 @@ def chat_groq(messages, model="llama-3.3-70b-versatile", system_instruction=None
         ] + clean_messages,
         "temperature": 0.7
     }
+    if on_delta:
+        data["stream"] = True
 
     try:
-        resp = requests.post("https://api.groq.com/openai/v1/chat/completions", headers=headers, json=data, timeout=30)
+        resp = get_transport().post(f"{base_url('groq')}/chat/completions", headers=headers, json=data, stream=bool(on_delta), cancel=cancel,
+                                    limiter=get_limiter("groq", api_key), tokens=request_tokens(data["messages"]))
         
         if not resp.ok:
             return {"error": f"Groq API Error ({resp.status_code}): {resp.text}"}
-            
+
+        if on_delta:
+            content = _collect_stream(_openai_deltas(resp), on_delta, cancel, resp)
+            _record_usage("groq", model, data["messages"], content)
+            return {"content": content}
         result = resp.json()
-        return {"content": result['choices'][0]['message']['content']}
+        usage = result.get("usage") or {}
+        content = result['choices'][0]['message']['content']
+        _record_usage("groq", model, data["messages"], content, usage.get("prompt_tokens"), usage.get("completion_tokens"))
+        return {"content": content}
     except Exception as e:
         return {"error": str(e)}
 
-def chat_gemini(messages, model="gemini-flash-latest", system_instruction=None):
+def _gemini_deltas(response, emitted):
+    """Fragmentos de texto de `send_message(..., stream=True)`; los anota en `emitted`."""
+    for chunk in response:
+        try:
+            text = chunk.text
+        except ValueError:
+            continue  # fragmento sin texto (p. ej. solo metadatos de seguridad)
+        emitted.append(text)
+        yield text
+
+
+def chat_gemini(messages, model="gemini-flash-latest", system_instruction=None, on_delta=None, cancel=None):
     if not genai:
         return {"error": "Librería 'google-generativeai' no instalada. Ejecuta: pip install -r requirements.txt"}
 
@@ -216,14 +306,32 @@ def chat_gemini(messages, model="gemini-flash-latest", system_instruction=None):
             if fb != model:
                 models_to_try.append(fb)
 
+        # El SDK no expone las cabeceras de límite: solo se espera turno en la cubeta
+        get_limiter("gemini", api_key).acquire(request_tokens(messages, sys_msg), cancel=cancel)
+
         last_error = None
+        emitted = []
         for target_model in models_to_try:
+            if cancel is not None and cancel.is_set():
+                return {"error": "Cancelado: otro proveedor respondió antes."}
             try:
                 model_instance = genai.GenerativeModel(model_name=target_model, system_instruction=sys_msg)
                 chat = model_instance.start_chat(history=history)
+                if on_delta:
+                    response = chat.send_message(last_message["parts"][0], stream=True)
+                    content = _collect_stream(_gemini_deltas(response, emitted), on_delta, cancel)
+                    _record_usage("gemini", target_model, [{"content": sys_msg}] + messages, content)
+                    return {"content": content}
                 response = chat.send_message(last_message["parts"][0])
+                usage = getattr(response, "usage_metadata", None)
+                _record_usage("gemini", target_model, [{"content": sys_msg}] + messages, response.text,
+                              getattr(usage, "prompt_token_count", None), getattr(usage, "candidates_token_count", None))
                 return {"content": response.text}
             except Exception as e:
+                if on_delta and emitted:
+                    # El modelo falló a mitad de respuesta: descartar lo ya mostrado
+                    on_delta(None)
+                    emitted.clear()
                 print(f"⚠️  Advertencia: Falló {target_model} ({e}). Intentando siguiente...", file=sys.stderr)
                 last_error = e
                 continue
@@ -234,57 +342,109 @@ def chat_gemini(messages, model="gemini-flash-latest", system_instruction=None):
         return {"error": str(e)}
 
 
-def main():
+PROVIDERS = {
+    "openai": chat_openai,
+    "anthropic": chat_anthropic,
+    "groq": chat_groq,
+    "gemini": chat_gemini,
+}
+DEFAULT_MODELS = {name: inspect.signature(fn).parameters["model"].default for name, fn in PROVIDERS.items()}
+
+
+def build_parser():
     parser = argparse.ArgumentParser(description="Enviar un prompt a un LLM (OpenAI/Anthropic).")
     parser.add_argument("--prompt", required=True, help="El mensaje para el LLM.")
     parser.add_argument("--provider", choices=["openai", "anthropic", "gemini", "groq"], help="Proveedor de IA.")
-    parser.add_argument("--memory-query", help="Texto específico para buscar en memoria (si es diferente al prompt).")
+    parser.add_argument("--memory-query", action="append",
+                        help="Texto específico para buscar en memoria (si es diferente al prompt). Repetible: "
+                             "varias consultas (p. ej. un código DTC cada una) se buscan en un solo lote.")
     parser.add_argument("--memory-only", action="store_true", help="Solo consulta la memoria y devuelve el resultado directo sin llamar al LLM.")
+    parser.add_argument("--memory-types", type=parse_types,
+                        help="Tipos de recuerdo a consultar, separados por comas (note, manual, fact). Por defecto, todos.")
     parser.add_argument("--system", help="Instrucción del sistema (personalidad).")
-    args = parser.parse_args()
+    parser.add_argument("--no-hedge", action="store_true", help="Probar los proveedores de uno en uno, sin lanzar el siguiente en paralelo al vencer el p90.")
+    parser.add_argument("--no-cache", action="store_true", help="No usar la caché de respuestas (ni leer ni guardar).")
+    parser.add_argument("--priority", choices=["interactive", "background"], default="interactive",
+                        help="Prioridad en la cola del limitador de peticiones (background para lotes y tareas de fondo).")
+    parser.add_argument("--chat-id", help="Conversación a la que pertenece el mensaje (historial independiente por chat).")
+    parser.add_argument("--stream", action="store_true", help="Muestra la respuesta en stderr a medida que llega (stdout sigue siendo el JSON final).")
+    return parser
+
+
+def _print_delta(delta):
+    """Salida de --stream: los fragmentos van a stderr para no ensuciar el JSON de stdout."""
+    if delta is None:
+        sys.stderr.write("\n[reintentando con otro proveedor]\n")
+    else:
+        sys.stderr.write(delta)
+    sys.stderr.flush()
+
+
+def run(args, on_delta=None):
+    """
+    Resuelve un prompt (memoria + LLM) y devuelve el resultado como diccionario.
+
+    Con `on_delta` la respuesta se pide en streaming y cada fragmento de texto se
+    pasa a `on_delta(texto)` según llega. Si el proveedor que estaba escribiendo
+    falla se llama `on_delta(None)`: lo mostrado hasta entonces se descarta y la
+    respuesta vuelve a empezar con el siguiente proveedor.
+    """
+    if on_delta is None and getattr(args, "stream", False):
+        on_delta = _print_delta
 
     # --- MODO MEMORY-ONLY ---
     if args.memory_only:
-        memory_context = get_memory_context(args.prompt)
+        memory_context, rag_report = get_memory_context(args.prompt, getattr(args, "memory_types", None))
         if memory_context:
             # Si se encuentra algo, se devuelve directamente formateado.
             result = {"content": f"🧠 Según mi memoria:\n\n{memory_context}"}
         else:
             # Si no, se devuelve un error especial para que el orquestador sepa que debe continuar.
             result = {"error": "no_memory_found"}
-        print(json.dumps(result))
-        return
+        if rag_report:
+            result["rag"] = rag_report
+        return result
 
-    # Gestión de historial
+    # Gestión de historial (uno por chat; el recorte se hace por tokens al armar cada petición)
+    store = ChatHistory(getattr(args, "chat_id", None))
     if args.prompt.strip().lower() == "/clear":
-        if os.path.exists(HISTORY_FILE):
-            os.remove(HISTORY_FILE)
-        print(json.dumps({"content": "Historial de conversación borrado."}))
-        return
-
-    history = load_history()
-    # Mantener contexto corto (últimos 10 mensajes) para evitar errores de tokens
-    if len(history) > 10:
-        history = history[-10:]
-
-    history.append({"role": "user", "content": args.prompt})
+        store.clear()
+        return {"content": "Historial de conversación borrado."}
+
+    summary, turns = store.load()
+    user_turn = {"role": "user", "content": args.prompt}
+
+    # --- Caché de respuestas: una pregunta repetida no llama al proveedor ---
+    cache = None
+    if not getattr(args, "no_cache", False) and os.getenv("LLM_CACHE", "1") != "0":
+        cache = get_response_cache()
+        # El historial entra en el ámbito: un seguimiento solo reutiliza respuestas de la misma conversación
+        scope = scope_key(args.system, args.provider, (summary, turns), getattr(args, "memory_types", None))
+        hit = cache.get(args.prompt, scope)
+        if hit:
+            content, tier = hit
+            print(f"⚡ [CACHE] Respuesta servida desde la caché ({tier}).", file=sys.stderr)
+            if on_delta:
+                on_delta(content)
+            store.append(user_turn, {"role": "assistant", "content": content})
+            return {"content": content, "cached": tier}
 
     # --- RAG: Inyección de Memoria ---
     # Si se proporciona --memory-query, usarla para la búsqueda. Si no, usar el prompt completo.
     query_for_memory = args.memory_query if args.memory_query else args.prompt
+    if isinstance(query_for_memory, list) and len(query_for_memory) == 1:
+        query_for_memory = query_for_memory[0]
     
     if args.memory_query:
         print(f"🧠 [RAG] Usando query optimizada: '{query_for_memory}'", file=sys.stderr)
 
-    # Creamos una copia de los mensajes para enviar al LLM con el contexto inyectado,
-    # pero SIN ensuciar el historial guardado en disco.
-    messages_for_llm = [dict(msg) for msg in history] # Deep copy simple
-    
-    memory_context = get_memory_context(query_for_memory)
+    # El contexto se inyecta solo en el mensaje que se envía al LLM,
+    # SIN ensuciar el historial guardado en disco.
+    prompt_for_llm = args.prompt
+
+    memory_context, rag_report = get_memory_context(query_for_memory, getattr(args, "memory_types", None))
     if memory_context:
-        # Inyectamos el contexto en el último mensaje del usuario
-        last_msg = messages_for_llm[-1]
-        last_msg['content'] = f"""Usa el siguiente CONTEXTO DE MEMORIA solo si es directamente relevante para la PREGUNTA DEL USUARIO. Si no es relevante, ignóralo por completo.
+        prompt_for_llm = f"""Usa el siguiente CONTEXTO DE MEMORIA solo si es directamente relevante para la PREGUNTA DEL USUARIO. Si no es relevante, ignóralo por completo.
 
 CONTEXTO DE MEMORIA (Recuerdos relevantes):
 {memory_context}
@@ -293,55 +453,132 @@ CONTEXTO DE MEMORIA (Recuerdos relevantes):
 PREGUNTA DEL USUARIO:
 {args.prompt}"""
 
-    # Definir lista de proveedores a intentar en orden de prioridad
-    providers_to_try = []
-    
-    if args.provider:
-        # Si el usuario fuerza uno, solo intentamos ese
-        providers_to_try.append(args.provider)
-    else:
-        # Orden de preferencia: Groq (Rápido) -> Gemini (Backup robusto) -> Otros
-        if os.getenv("GROQ_API_KEY") and os.getenv("GROQ_API_KEY").strip():
-            providers_to_try.append("groq")
-        if os.getenv("GOOGLE_API_KEY") and os.getenv("GOOGLE_API_KEY").strip():
-            providers_to_try.append("gemini")
-        if os.getenv("OPENAI_API_KEY") and os.getenv("OPENAI_API_KEY").strip():
-            providers_to_try.append("openai")
-        if os.getenv("ANTHROPIC_API_KEY") and os.getenv("ANTHROPIC_API_KEY").strip():
-            providers_to_try.append("anthropic")
-            
-    if not providers_to_try:
-        print(json.dumps({"error": "No hay API Keys configuradas en .env"}))
-        return
-
-    result = {}
-    for provider in providers_to_try:
-        try:
-            if provider == "openai":
-                result = chat_openai(messages_for_llm, system_instruction=args.system)
-            elif provider == "anthropic":
-                result = chat_anthropic(messages_for_llm, system_instruction=args.system)
-            elif provider == "groq":
-                result = chat_groq(messages_for_llm, system_instruction=args.system)
-            elif provider == "gemini":
-                result = chat_gemini(messages_for_llm, system_instruction=args.system)
-            
-            # Si tuvimos éxito (hay contenido y no error), salimos del bucle
-            if "content" in result and "error" not in result:
-                break
-            
-            # Si falló, logueamos en stderr (para no ensuciar el JSON de stdout) y seguimos
-            error_msg = result.get("error", "Error desconocido")
-            print(f"⚠️ Proveedor '{provider}' falló: {error_msg}. Intentando siguiente...", file=sys.stderr)
-            
-        except Exception as e:
-            print(f"⚠️ Excepción crítica en '{provider}': {e}. Intentando siguiente...", file=sys.stderr)
-            result = {"error": str(e)}
+    # Proveedores a intentar, como "proveedor/modelo", en orden de prioridad
+    keys = provider_keys(args.provider)
+    if not keys:
+        return {"error": "No hay API Keys configuradas en .env"}
+
+    # Hedging: si el primero no responde dentro de su p90, el siguiente arranca en paralelo
+    hedge = not args.provider and not getattr(args, "no_hedge", False) and os.getenv("LLM_HEDGE", "1") != "0"
+
+    # Cada proveedor recibe tantos turnos recientes como quepan en su presupuesto de tokens
+    # y en lo que deja libre el prompt (con su contexto de memoria) dentro de su límite de
+    # entrada; los que no admitirían el prompt completo se descartan sin llamarlos
+    requests_by_key, budgets = {}, {}
+    prompt_tokens = count_tokens(args.prompt)
+    with_memory_tokens = count_tokens(prompt_for_llm)
+    system_tokens = count_tokens(args.system)
+    for key in keys:
+        provider, model = key.split("/", 1)
+        limit = input_limit(provider, model)
+        # El prompt no gasta presupuesto de historial: un documento largo no deja al chat sin contexto
+        current = {"role": "user", "content": prompt_for_llm}
+        history_room = min(history_budget(provider), limit - system_tokens - with_memory_tokens)
+        messages = window(summary, turns + [current], history_room + turn_tokens(current))
+        usage = {
+            "system": system_tokens,
+            "memory": with_memory_tokens - prompt_tokens,
+            "history": sum(count_tokens(m["content"]) for m in messages) - with_memory_tokens,
+            "prompt": prompt_tokens,
+        }
+        budgets[key] = budget = {"usage": usage, "total": sum(usage.values()), "limit": limit}
+        if budget["total"] > budget["limit"]:
+            print(f"📏 [BUDGET] {key} omitido: el prompt ocupa {budget['total']} tokens y admite {budget['limit']}.", file=sys.stderr)
+            continue
+        requests_by_key[key] = messages
+
+    if not requests_by_key:
+        return {"error": f"El prompt ({prompt_tokens} tokens) supera el límite de todos los proveedores disponibles.",
+                "budget": budgets}
+
+    def call(key, provider_on_delta, cancel):
+        provider, model = key.split("/", 1)
+        return PROVIDERS[provider](requests_by_key[key], model=model, system_instruction=args.system,
+                                   on_delta=provider_on_delta, cancel=cancel)
+
+    # Cola del limitador por API key: el chat interactivo pasa delante de lotes y tareas de fondo
+    with priority(BACKGROUND if getattr(args, "priority", None) == "background" else INTERACTIVE):
+        result = hedged_call(list(requests_by_key), call, on_delta=on_delta, hedge=hedge, stats=get_health())
+    if rag_report:
+        result["rag"] = rag_report
+    if "provider" in result:
+        result["budget"] = budgets[result["provider"]]
+        result["provider"], result["model"] = result["provider"].split("/", 1)
 
     if "content" in result:
-        history.append({"role": "assistant", "content": result["content"]})
-        save_history(history)
+        assistant_turn = {"role": "assistant", "content": result["content"]}
+        store.append(user_turn, assistant_turn)
+        if cache:
+            cache.put(args.prompt, scope, result["content"])
+        if store.needs_compaction(turns + [user_turn, assistant_turn]):
+            # El resumen se genera después de responder, sin hacer esperar al usuario
+            threading.Thread(target=store.compact, args=(make_summarizer(keys),),
+                             name=f"compact-{store.chat_id}").start()
+
+    return result
+
+
+def provider_keys(forced=None):
+    """
+    Claves "proveedor/modelo" a intentar. Con `forced` solo ese proveedor; si no, los
+    que tienen API key, en el orden base (Groq -> Gemini -> OpenAI -> Anthropic)
+    reordenado por el registro de salud (primero los sanos y rápidos; los de
+    circuito abierto quedan fuera).
+    """
+    if forced:
+        return [f"{forced}/{DEFAULT_MODELS[forced]}"]
+    providers_to_try = []
+    if os.getenv("GROQ_API_KEY") and os.getenv("GROQ_API_KEY").strip():
+        providers_to_try.append("groq")
+    if os.getenv("GOOGLE_API_KEY") and os.getenv("GOOGLE_API_KEY").strip():
+        providers_to_try.append("gemini")
+    if os.getenv("OPENAI_API_KEY") and os.getenv("OPENAI_API_KEY").strip():
+        providers_to_try.append("openai")
+    if os.getenv("ANTHROPIC_API_KEY") and os.getenv("ANTHROPIC_API_KEY").strip():
+        providers_to_try.append("anthropic")
+    return get_health().order([f"{provider}/{DEFAULT_MODELS[provider]}" for provider in providers_to_try])
+
+
+def complete(prompt, system_instruction=None, keys=None):
+    """
+    Llamada suelta al LLM, sin historial, memoria ni caché (resúmenes internos,
+    fragmentos de map-reduce...). Usa la misma cadena de proveedores con hedging.
+    """
+    keys = keys or provider_keys()
+    if not keys:
+        return {"error": "No hay API Keys configuradas en .env"}
+
+    def call(key, provider_on_delta, cancel):
+        provider, model = key.split("/", 1)
+        return PROVIDERS[provider]([{"role": "user", "content": prompt}], model=model,
+                                   system_instruction=system_instruction, cancel=cancel)
+
+    result = hedged_call(keys, call, stats=get_health())
+    if "provider" in result:
+        result["provider"], result["model"] = result["provider"].split("/", 1)
+    return result
+
+
+def make_summarizer(keys):
+    """`summarize(resumen_anterior, turnos)` para `ChatHistory.compact`, con los mismos proveedores y hedging."""
+    def summarize(previous, old_turns):
+        transcript = "\n".join(
+            f"{'Usuario' if t['role'] == 'user' else 'Asistente'}: {t['content']}" for t in old_turns
+        )
+        prompt = f"CONVERSACIÓN:\n{transcript}"
+        if previous:
+            prompt = f"RESUMEN PREVIO:\n{previous}\n\n{prompt}"
+
+        with priority(BACKGROUND):
+            result = complete(prompt, SUMMARY_SYSTEM, keys)
+        if "content" not in result:
+            raise RuntimeError(result.get("error", "sin respuesta"))
+        return result["content"]
+    return summarize
 
+
+def main():
+    result = run(build_parser().parse_args())
     # Salida en JSON para que el orquestador la consuma
     print(json.dumps(result))
 
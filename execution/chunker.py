@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+Fragmentador por estructura para la ingesta de manuales.
+
+Las ventanas fijas de 1000 caracteres cortaban tablas de torques y procedimientos
+de DTC por la mitad, y el 20% de solapamiento inflaba el índice. Aquí cada página
+se divide en bloques (títulos, párrafos y tablas) y los bloques se agrupan en
+fragmentos de hasta `max_tokens` sin cruzar un cambio de sección. Un bloque solo
+se parte si por sí solo no cabe en el presupuesto (las tablas por filas, los
+párrafos por frases).
+"""
+import math
+import re
+
+# Cambiar al modificar las reglas: invalida los hashes de página de ingest_manual
+VERSION = 1
+MAX_TOKENS = 300
+# Final de la página anterior que se antepone si la página terminó a mitad de frase
+CARRY_CHARS = 200
+
+NUMBERED_HEADING_RE = re.compile(r"^\d+(?:\.\d+)+\.?\s+\S")
+KEYWORD_HEADING_RE = re.compile(r"^(?:CAP[IÍ]TULO|SECCI[OÓ]N|CHAPTER|SECTION)\b", re.IGNORECASE)
+CELL_SPLIT_RE = re.compile(r"\s{2,}|\t|\|")
+DOT_LEADER_RE = re.compile(r"\S\s*\.{3,}\s*\S")
+
+
+def estimate_tokens(text):
+    """Estimación rápida (~4 caracteres por token) para no depender de un tokenizador."""
+    return math.ceil(len(text) / 4)
+
+
+def is_heading(line):
+    s = line.strip()
+    if not s or len(s) > 80 or s.endswith((".", ",", ";")):
+        return False
+    if NUMBERED_HEADING_RE.match(s) or KEYWORD_HEADING_RE.match(s):
+        return len(s.split()) <= 10
+    letters = [c for c in s if c.isalpha()]
+    return len(letters) >= 4 and all(c.isupper() for c in letters)
+
+
+def is_table_row(line):
+    s = line.strip()
+    if DOT_LEADER_RE.search(s):
+        return True  # "Torque culata ....... 25 Nm"
+    cells = [c for c in CELL_SPLIT_RE.split(s) if c.strip()]
+    return len(cells) >= 3 or (len(cells) == 2 and any(ch.isdigit() for ch in s))
+
+
+def split_blocks(text):
+    """Devuelve bloques (tipo, inicio, fin) con tipo 'heading', 'table' o 'paragraph'."""
+    blocks = []
+    current = None  # [tipo, inicio, fin]
+    offset = 0
+    for line in text.splitlines(keepends=True):
+        start, end = offset, offset + len(line.rstrip("\r\n"))
+        offset += len(line)
+        if not line.strip():
+            current = None
+            continue
+        if is_heading(line):
+            blocks.append(["heading", start, end])
+            current = None
+            continue
+        kind = "table" if is_table_row(line) else "paragraph"
+        if current is not None and current[0] == kind:
+            current[2] = end
+        else:
+            current = [kind, start, end]
+            blocks.append(current)
+    return [tuple(b) for b in blocks]
+
+
+def _split_oversized(text, kind, start, end, max_tokens):
+    """Parte un bloque demasiado grande: tablas por filas, párrafos por frases (o palabras)."""
+    if kind == "table":
+        pieces = re.finditer(r"[^\n]+", text[start:end])
+    else:
+        pieces = re.finditer(r"\S(?:.*?)(?:[.!?](?=\s)|$)", text[start:end], re.DOTALL)
+    spans = []
+    for match in pieces:
+        s, e = start + match.start(), start + match.end()
+        if estimate_tokens(text[s:e]) <= max_tokens:
+            spans.append((s, e))
+            continue
+        # Frase (o fila) gigante: cortar por palabras
+        cursor = s
+        for word in re.finditer(r"\S+", text[s:e]):
+            w_end = s + word.end()
+            if estimate_tokens(text[cursor:w_end]) > max_tokens and cursor < s + word.start():
+                spans.append((cursor, s + word.start()))
+                cursor = s + word.start()
+        spans.append((cursor, e))
+
+    # Reagrupar piezas consecutivas mientras quepan
+    grouped = []
+    for s, e in spans:
+        if grouped and estimate_tokens(text[grouped[-1][0]:e]) <= max_tokens:
+            grouped[-1] = (grouped[-1][0], e)
+        else:
+            grouped.append((s, e))
+    return grouped
+
+
+def chunk_page(text, section="", carry="", max_tokens=MAX_TOKENS):
+    """
+    Fragmenta el texto de una página.
+
+    `section` es el último título visto (viene de páginas anteriores) y `carry` el
+    final de la página anterior si terminó a mitad de frase. Devuelve
+    `(fragmentos, sección, carry)`, donde cada fragmento es un dict con `text`,
+    `section` y `char_span` (posición en el texto de la página), y los dos últimos
+    valores alimentan la página siguiente.
+    """
+    chunks = []
+    span = None  # (inicio, fin) del fragmento en construcción
+
+    def flush():
+        nonlocal span, carry
+        if span is None:
+            return
+        body = text[span[0]:span[1]].strip()
+        parts = [section] if section else []
+        if carry.strip():
+            parts.append(carry.strip())
+            carry = ""
+        parts.append(body)
+        chunks.append({"text": "\n".join(parts), "section": section, "char_span": span})
+        span = None
+
+    for kind, start, end in split_blocks(text):
+        if kind == "heading":
+            flush()
+            section = text[start:end].strip()
+            continue
+        if span is not None and estimate_tokens(text[span[0]:end]) <= max_tokens:
+            span = (span[0], end)
+            continue
+        flush()
+        if estimate_tokens(text[start:end]) <= max_tokens:
+            span = (start, end)
+        else:
+            for piece in _split_oversized(text, kind, start, end, max_tokens):
+                span = piece
+                flush()
+    flush()
+
+    return chunks, section, open_tail(text)
+
+
+def open_tail(text):
+    """Frase sin terminar al final de la página (hasta CARRY_CHARS), o "" si terminó limpia."""
+    blocks = split_blocks(text)
+    if not blocks or blocks[-1][0] != "paragraph":
+        return ""
+    _, start, end = blocks[-1]
+    tail = text[start:end].rstrip()
+    if tail.endswith((".", "!", "?", ":")):
+        return ""
+    window = tail[-CARRY_CHARS:]
+    # Empezar después del último final de frase (sin contar "1." o "2." de una lista)
+    cut = max([m.end() for m in re.finditer(r"(?<!\d)[.!?:]\s", window)], default=0)
+    return window[cut:].strip()
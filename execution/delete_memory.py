@@ -9,48 +9,52 @@ except ImportError:
     print("Error: Missing 'chromadb'.", file=sys.stderr)
     sys.exit(10)
 
-def main():
+from memory_service import get_service
+
+def build_parser():
     parser = argparse.ArgumentParser(description="Eliminar un recuerdo por ID.")
     parser.add_argument("--id", help="ID del recuerdo a eliminar.")
-    parser.add_argument("--text", help="Texto contenido en el recuerdo a eliminar (borra coincidencias).")
+    parser.add_argument("--text", help="Texto contenido en el recuerdo a eliminar, desde el inicio de una palabra (borra coincidencias).")
     parser.add_argument("--db-path", default=".tmp/chroma_db", help="Ruta a ChromaDB.")
-    args = parser.parse_args()
+    return parser
 
+def run(args):
+    """Elimina recuerdos por ID o por texto y devuelve el resultado como diccionario."""
     if not args.id and not args.text:
-        print(json.dumps({"status": "error", "message": "Debes proporcionar --id o --text."}))
-        sys.exit(1)
+        return {"status": "error", "message": "Debes proporcionar --id o --text."}
 
     try:
-        client = chromadb.PersistentClient(path=args.db_path)
-        collection = client.get_or_create_collection(name="agent_memory")
+        service = get_service(args.db_path)
+        service.collection()
         
         if args.id:
-            collection.delete(ids=[args.id])
-            print(json.dumps({
+            service.delete(ids=[args.id])
+            return {
                 "status": "success", 
                 "message": f"Recuerdo {args.id} eliminado correctamente."
-            }))
-        elif args.text:
-            # Buscar IDs por texto
-            results = collection.get()
-            ids_to_delete = []
-            if results['ids']:
-                for i, doc in enumerate(results['documents']):
-                    if args.text.lower() in doc.lower():
-                        ids_to_delete.append(results['ids'][i])
+            }
+        else:
+            # Buscar IDs por texto: el índice da los candidatos y solo esos se leen de ChromaDB
+            ids_to_delete = service.find_text(args.text)
             
             if ids_to_delete:
-                collection.delete(ids=ids_to_delete)
-                print(json.dumps({
+                service.delete(ids=ids_to_delete)
+                return {
                     "status": "success", 
                     "message": f"Se eliminaron {len(ids_to_delete)} recuerdos que contenían '{args.text}'."
-                }))
-            else:
-                print(json.dumps({"status": "error", "message": f"No se encontraron recuerdos con: {args.text}"}))
+                }
+            # Sin coincidencias no es un fallo del script: se informa sin código de salida de error
+            return {"status": "error", "message": f"No se encontraron recuerdos con: {args.text}", "exit_code": 0}
         
     except Exception as e:
-        print(json.dumps({"status": "error", "message": str(e)}))
-        sys.exit(1)
+        return {"status": "error", "message": str(e)}
+
+def main():
+    result = run(build_parser().parse_args())
+    exit_code = result.pop("exit_code", 1)
+    print(json.dumps(result))
+    if result["status"] == "error" and exit_code:
+        sys.exit(exit_code)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+Caché de embeddings para consultas RAG e ingesta de manuales.
+
+Las mismas consultas ("ruido motor ...", "P0340 siena", "mantenimiento servicio
+60000 km") y los mismos fragmentos de un manual re-ingestado se volvían a
+embeber en cada llamada. La caché guarda cada vector bajo
+sha256(modelo + texto) en dos niveles: un LRU en memoria y un SQLite en disco
+que sobrevive entre ejecuciones. El disco también tiene tope
+(`EMBEDDING_CACHE_MAX_DISK_ITEMS`): al superarlo se borran las filas usadas
+hace más tiempo (el uso se registra al guardar y al leer de disco).
+"""
+import array
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_CACHE_PATH = os.path.join(PROJECT_ROOT, ".tmp", "embedding_cache.sqlite")
+# Filas en disco (~1,5 KB cada una con vectores de 384 dimensiones)
+DEFAULT_MAX_DISK_ITEMS = int(os.getenv("EMBEDDING_CACHE_MAX_DISK_ITEMS", "50000"))
+
+
+def model_name(embedding_function):
+    """Identificador estable del modelo de una función de embeddings de Chroma."""
+    name = type(embedding_function).__name__
+    try:
+        name = embedding_function.name()
+    except Exception:
+        pass
+    model = getattr(embedding_function, "model_name", None)
+    return f"{name}:{model}" if model else name
+
+
+def cache_key(model, text):
+    return hashlib.sha256(f"{model}\0{text}".encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """LRU en memoria respaldado por SQLite. Seguro entre hilos."""
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_items=2048, max_disk_items=DEFAULT_MAX_DISK_ITEMS, clock=time.time):
+        self.path = path
+        self.max_items = max_items
+        self.max_disk_items = max_disk_items
+        self.clock = clock
+        self.evicted = 0
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        self.counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0}
+
+    def _connection(self):
+        if self._db is None:
+            if os.path.dirname(self.path):
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            self._db.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL, "
+                             "last_used REAL NOT NULL DEFAULT 0)")
+            columns = {row[1] for row in self._db.execute("PRAGMA table_info(embeddings)")}
+            if "last_used" not in columns:
+                # Caché creada antes del tope en disco: sus filas cuentan como las más antiguas
+                self._db.execute("ALTER TABLE embeddings ADD COLUMN last_used REAL NOT NULL DEFAULT 0")
+            self._db.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+        return self._db
+
+    def _remember(self, key, vector):
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_items:
+            self._memory.popitem(last=False)
+
+    def get_many(self, keys):
+        """Devuelve {clave: vector} para las claves en caché y actualiza los contadores."""
+        found = {}
+        with self._lock:
+            missing = []
+            for key in keys:
+                if key in self._memory:
+                    self._memory.move_to_end(key)
+                    found[key] = self._memory[key]
+                    self.counters["memory_hits"] += 1
+                else:
+                    missing.append(key)
+
+            disk_hits = 0
+            now = self.clock()
+            # SQLite limita el número de parámetros por consulta
+            for i in range(0, len(missing), 500):
+                batch = missing[i:i + 500]
+                rows = self._connection().execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(batch))})", batch
+                ).fetchall()
+                for key, blob in rows:
+                    vector = array.array("f", blob).tolist()
+                    found[key] = vector
+                    self._remember(key, vector)
+                    disk_hits += 1
+                if rows:
+                    self._connection().executemany("UPDATE embeddings SET last_used = ? WHERE key = ?",
+                                                   [(now, key) for key, _ in rows])
+            if disk_hits:
+                self._connection().commit()
+
+            self.counters["disk_hits"] += disk_hits
+            self.counters["misses"] += len(missing) - disk_hits
+        return found
+
+    def put_many(self, items):
+        """Guarda `{clave: vector}` en memoria y en disco."""
+        with self._lock:
+            rows = []
+            now = self.clock()
+            for key, vector in items.items():
+                vector = [float(x) for x in vector]
+                self._remember(key, vector)
+                rows.append((key, array.array("f", vector).tobytes(), now))
+            db = self._connection()
+            db.executemany("INSERT OR REPLACE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)", rows)
+            # Tope en disco: fuera las filas usadas hace más tiempo
+            overflow = db.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0] - self.max_disk_items
+            if overflow > 0:
+                db.execute("DELETE FROM embeddings WHERE key IN "
+                           "(SELECT key FROM embeddings ORDER BY last_used LIMIT ?)", (overflow,))
+                self.evicted += overflow
+            db.commit()
+
+    def embed(self, embedding_function, texts):
+        """
+        Devuelve los embeddings de `texts` (en orden), llamando a `embedding_function`
+        solo para los textos que no están en caché.
+        """
+        model = model_name(embedding_function)
+        keys = [cache_key(model, text) for text in texts]
+        found = self.get_many(keys)
+
+        pending = {}
+        for key, text in zip(keys, texts):
+            if key not in found:
+                pending.setdefault(key, text)
+        if pending:
+            vectors = embedding_function(list(pending.values()))
+            computed = dict(zip(pending.keys(), ([float(x) for x in v] for v in vectors)))
+            self.put_many(computed)
+            found.update(computed)
+
+        return [found[key] for key in keys]
+
+    def stats(self):
+        with self._lock:
+            lookups = sum(self.counters.values())
+            hits = self.counters["memory_hits"] + self.counters["disk_hits"]
+            return dict(self.counters, items_in_memory=len(self._memory), evicted_from_disk=self.evicted,
+                        hit_rate=round(hits / lookups, 3) if lookups else 0.0)
+
+
+_CACHE = None
+_CACHE_LOCK = threading.Lock()
+
+
+def get_cache():
+    """Caché compartida del proceso."""
+    global _CACHE
+    with _CACHE_LOCK:
+        if _CACHE is None:
+            _CACHE = EmbeddingCache()
+        return _CACHE
@@ -7,6 +7,8 @@ import json
 # Añadir el directorio actual al path para importar chat_with_llm
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
+from prompt_budget import fit_prompt, output_limit
+
 try:
     from chat_with_llm import chat_openai, chat_anthropic, chat_gemini
 except ImportError:
@@ -14,54 +16,65 @@ except ImportError:
     sys.exit(1)
 
 
-def main():
+def build_parser():
     parser = argparse.ArgumentParser(description="Explicar código paso a paso usando IA.")
     parser.add_argument("--file", required=True, help="Ruta del archivo a explicar.")
-    args = parser.parse_args()
+    return parser
+
 
+def run(args):
+    """Explica el archivo indicado; la explicación en Markdown va en `content`."""
     file_path = args.file
 
     if not os.path.exists(file_path):
-        print(json.dumps({"status": "error", "message": f"Archivo no encontrado: {file_path}"}))
-        sys.exit(1)
+        return {"status": "error", "message": f"Archivo no encontrado: {file_path}"}
 
     try:
         with open(file_path, 'r', encoding='utf-8') as f:
             code_content = f.read()
     except Exception as e:
-        print(json.dumps({"status": "error", "message": f"Error leyendo archivo: {e}"}))
-        sys.exit(1)
+        return {"status": "error", "message": f"Error leyendo archivo: {e}"}
+
+    # Llamada al LLM (Priorizando Gemini por solicitud explícita)
+    if os.getenv("GOOGLE_API_KEY"):
+        provider, chat, model = "gemini", chat_gemini, "gemini-flash-latest"
+    elif os.getenv("OPENAI_API_KEY"):
+        provider, chat, model = "openai", chat_openai, "gpt-4o"
+    elif os.getenv("ANTHROPIC_API_KEY"):
+        provider, chat, model = "anthropic", chat_anthropic, "claude-3-5-sonnet-20240620"
+    else:
+        return {"status": "error", "message": "No se encontraron API Keys configuradas en .env"}
 
-    prompt = f"""Actúa como un Ingeniero de Software Senior y Profesor. Explica el siguiente código Python paso a paso.
+    template = f"""Actúa como un Ingeniero de Software Senior y Profesor. Explica el siguiente código Python paso a paso.
 Céntrate en la lógica, el flujo de datos y el propósito de las funciones clave.
 
 CÓDIGO A EXPLICAR ({os.path.basename(file_path)}):
-{code_content}
+{{payload}}
 
 FORMATO DE SALIDA:
 Markdown. Usa encabezados para separar secciones (Resumen, Análisis Detallado, Conclusión).
 """
+    # Archivos enormes: se explica el principio en lugar de fallar en el proveedor
+    prompt, budget = fit_prompt(template, code_content, provider, model, reserve=min(output_limit(provider, model), 4096))
+    if budget["action"] == "truncate":
+        prompt += "\nNOTA: El archivo se ha truncado por su tamaño; indica que la explicación cubre solo la parte mostrada.\n"
 
     messages = [{"role": "user", "content": prompt}]
-
-    # Llamada al LLM (Priorizando Gemini por solicitud explícita)
-    response = {}
-    if os.getenv("GOOGLE_API_KEY"):
-        response = chat_gemini(messages)
-    elif os.getenv("OPENAI_API_KEY"):
-        response = chat_openai(messages, model="gpt-4o")
-    elif os.getenv("ANTHROPIC_API_KEY"):
-        response = chat_anthropic(messages, model="claude-3-5-sonnet-20240620")
-    else:
-        print(json.dumps({"status": "error", "message": "No se encontraron API Keys configuradas en .env"}))
-        sys.exit(1)
+    response = chat(messages, model=model)
 
     if "error" in response:
-        print(json.dumps({"status": "error", "message": response["error"]}))
-        sys.exit(1)
+        return {"status": "error", "message": response["error"]}
+
+    return {"status": "success", "content": response.get("content", ""), "truncated": budget["action"] == "truncate"}
+
 
-    content = response.get("content", "")
-    print(content)
+def main():
+    result = run(build_parser().parse_args())
+    if result.get("status") == "error":
+        print(json.dumps(result))
+        sys.exit(1)
+    # La explicación se imprime tal cual (Markdown), como antes
+    print(result["content"])
 
 
 if __name__ == "__main__":
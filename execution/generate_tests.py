@@ -15,23 +15,24 @@ except ImportError:
     sys.exit(1)
 
 
-def main():
+def build_parser():
     parser = argparse.ArgumentParser(description="Generar tests unitarios automáticamente.")
     parser.add_argument("--file", required=True, help="Ruta del archivo para el cual generar tests.")
-    args = parser.parse_args()
+    return parser
+
 
+def run(args):
+    """Genera test_<archivo> junto al archivo indicado y devuelve el resultado como diccionario."""
     file_path = args.file
 
     if not os.path.exists(file_path):
-        print(json.dumps({"status": "error", "message": f"Archivo no encontrado: {file_path}"}))
-        sys.exit(1)
+        return {"status": "error", "message": f"Archivo no encontrado: {file_path}"}
 
     try:
         with open(file_path, 'r', encoding='utf-8') as f:
             original_code = f.read()
     except Exception as e:
-        print(json.dumps({"status": "error", "message": f"Error leyendo archivo: {e}"}))
-        sys.exit(1)
+        return {"status": "error", "message": f"Error leyendo archivo: {e}"}
 
     filename = os.path.basename(file_path)
     test_filename = f"test_{filename}"
@@ -62,12 +63,10 @@ REQUISITOS:
     elif os.getenv("GOOGLE_API_KEY"):
         response = chat_gemini(messages)
     else:
-        print(json.dumps({"status": "error", "message": "No se encontraron API Keys configuradas en .env"}))
-        sys.exit(1)
+        return {"status": "error", "message": "No se encontraron API Keys configuradas en .env"}
 
     if "error" in response:
-        print(json.dumps({"status": "error", "message": response["error"]}))
-        sys.exit(1)
+        return {"status": "error", "message": response["error"]}
 
     new_code = response.get("content", "")
 
@@ -85,16 +84,21 @@ REQUISITOS:
     try:
         ast.parse(new_code)
     except SyntaxError as e:
-        print(json.dumps({"status": "error", "message": f"El código generado tiene errores de sintaxis: {e}"}))
-        sys.exit(1)
+        return {"status": "error", "message": f"El código generado tiene errores de sintaxis: {e}"}
 
     # Guardado
     try:
         with open(test_file_path, 'w', encoding='utf-8') as f:
             f.write(new_code)
-        print(json.dumps({"status": "success", "message": f"Tests generados en {test_file_path}"}))
+        return {"status": "success", "message": f"Tests generados en {test_file_path}"}
     except Exception as e:
-        print(json.dumps({"status": "error", "message": f"Error escribiendo archivo: {e}"}))
+        return {"status": "error", "message": f"Error escribiendo archivo: {e}"}
+
+
+def main():
+    result = run(build_parser().parse_args())
+    print(json.dumps(result))
+    if result.get("status") == "error":
         sys.exit(1)
 
 
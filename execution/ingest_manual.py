@@ -1,78 +1,203 @@
 #!/usr/bin/env python3
 import argparse
+import datetime
+import hashlib
 import json
+import os
 import sys
 from pathlib import Path
-import uuid
-
-try:
-    from pypdf import PdfReader
-except ImportError:
-    print(json.dumps({"status": "error", "message": "Librería 'pypdf' no instalada. Ejecuta: pip install pypdf"}))
-    sys.exit(1)
-
-try:
-    import chromadb
-except ImportError:
-    print(json.dumps({"status": "error", "message": "Librería 'chromadb' no instalada. Ejecuta: pip install chromadb"}))
-    sys.exit(1)
-
-def chunk_text(text, chunk_size=1000, chunk_overlap=200):
-    """Divide un texto largo en fragmentos más pequeños con superposición."""
-    chunks = []
-    start = 0
-    while start < len(text):
-        end = start + chunk_size
-        chunks.append(text[start:end])
-        start += chunk_size - chunk_overlap
-    return chunks
 
-def main():
+from memory_service import get_service
+from pdf_extract import file_hash, iter_pages
+import chunker
+
+def text_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def chunk_id(source, page, content):
+    """ID direccionado por contenido: el mismo fragmento siempre produce el mismo ID."""
+    return hashlib.sha256(f"{source}\0{page}\0{content}".encode("utf-8")).hexdigest()[:32]
+
+def manifest_path(db_path, collection_name, source):
+    """Manifiesto por documento, junto a la base de datos (fuera del directorio de Chroma)."""
+    base = os.path.join(os.path.dirname(os.path.abspath(db_path)), "ingest_manifests", collection_name)
+    return os.path.join(base, f"{source}.json")
+
+def load_manifest(path):
+    if os.path.exists(path):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+    return None
+
+def save_manifest(path, manifest):
+    """Escritura atómica para no dejar un manifiesto a medias si la ingesta se interrumpe."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+def build_parser():
     parser = argparse.ArgumentParser(description="Ingestar un manual PDF en la memoria vectorial (ChromaDB).")
     parser.add_argument("--file", required=True, help="Ruta al archivo PDF a procesar.")
     parser.add_argument("--db-path", default=".tmp/chroma_db", help="Ruta a la base de datos ChromaDB.")
     parser.add_argument("--collection-name", default="agent_memory", help="Nombre de la colección en ChromaDB.")
-    args = parser.parse_args()
+    parser.add_argument("--force", action="store_true", help="Re-procesar todas las páginas aunque no hayan cambiado.")
+    parser.add_argument("--batch-size", type=int, default=64, help="Fragmentos por lote de embeddings/upsert (acota la memoria).")
+    parser.add_argument("--max-tokens", type=int, default=chunker.MAX_TOKENS, help="Tamaño máximo de cada fragmento en tokens (aprox.).")
+    return parser
+
+def run(args):
+    """
+    Ingesta un PDF en ChromaDB de forma incremental y devuelve el resultado como diccionario.
+
+    Los IDs de los fragmentos se derivan de (fuente, página, contenido) y un manifiesto
+    por documento guarda el hash del archivo y de cada página. Solo se procesan las
+    páginas nuevas o modificadas y se borran los fragmentos que dejaron de existir.
 
+    El PDF se procesa como un flujo: página a página, con lotes acotados de
+    embeddings/upsert. Tras cada lote se guarda un checkpoint; si la ingesta se
+    interrumpe, la siguiente ejecución sobre el mismo archivo continúa desde ahí.
+    """
     file_path = Path(args.file)
     if not file_path.exists():
-        print(json.dumps({"status": "error", "message": f"Archivo no encontrado: {file_path}"}))
-        sys.exit(1)
+        return {"status": "error", "message": f"Archivo no encontrado: {file_path}"}
+
+    source = file_path.name
+    current_hash = file_hash(file_path)
+    manifest_file = manifest_path(args.db_path, args.collection_name, source)
+    checkpoint_file = manifest_file[:-len(".json")] + ".partial.json"
+    manifest = None if args.force else load_manifest(manifest_file)
+
+    # Mismo archivo y mismas reglas de fragmentación: no hay nada que rehacer
+    settings = {"chunker_version": chunker.VERSION, "max_tokens": args.max_tokens}
+    if manifest and manifest.get("file_hash") == current_hash and all(manifest.get(k) == v for k, v in settings.items()):
+        total_chunks = sum(len(p["chunk_ids"]) for p in manifest["pages"].values())
+        return {"status": "success", "message": f"'{source}' no ha cambiado; {total_chunks} fragmentos ya estaban en memoria.",
+                "pages_total": len(manifest["pages"]), "pages_changed": 0, "chunks_added": 0, "chunks_deleted": 0}
 
-    # 1. Extraer texto del PDF
+    # 1. Conectar a ChromaDB
     try:
-        reader = PdfReader(file_path)
-        full_text = "\n".join([page.extract_text() for page in reader.pages if page.extract_text()])
+        service = get_service(args.db_path)
+        service.collection(args.collection_name)
     except Exception as e:
-        print(json.dumps({"status": "error", "message": f"Error leyendo PDF: {e}"}))
-        sys.exit(1)
+        return {"status": "error", "message": f"Error conectando a ChromaDB: {e}"}
 
-    if not full_text.strip():
-        print(json.dumps({"status": "error", "message": "El PDF está vacío o no contiene texto extraíble."}))
-        sys.exit(1)
+    # 2. Retomar un checkpoint del mismo archivo, si lo hay
+    checkpoint = load_manifest(checkpoint_file)
+    old_pages = (manifest or {}).get("pages", {})
+    if not checkpoint or checkpoint.get("file_hash") != current_hash or any(checkpoint.get(k) != v for k, v in settings.items()):
+        stale_ids = []
+        if checkpoint:
+            # Checkpoint de otra versión del archivo (o de otras reglas de fragmentación): sus lotes no llegaron al manifiesto
+            known_ids = {cid for page in old_pages.values() for cid in page["chunk_ids"]}
+            stale_ids = [cid for page in checkpoint["pages"].values() for cid in page["chunk_ids"] if cid not in known_ids]
+        checkpoint = {"file_hash": current_hash, **settings, "next_page": 1, "carry": "", "section": "", "pages": {},
+                      "pages_changed": 0, "chunks_added": 0, "total_chars": 0}
+        try:
+            if manifest is None:
+                # Primera ingesta con manifiesto: limpiar fragmentos previos (IDs aleatorios) del mismo documento
+                service.delete(where={"source": source}, name=args.collection_name)
+            elif stale_ids:
+                service.delete(ids=stale_ids, name=args.collection_name)
+        except Exception as e:
+            return {"status": "error", "message": f"Error guardando en ChromaDB: {e}"}
+    resumed_from = checkpoint["next_page"]
+
+    new_pages = checkpoint["pages"]
+    timestamp = datetime.datetime.now().isoformat()
+    batch = {"ids": [], "documents": [], "metadatas": []}
 
-    # 2. Dividir en fragmentos (Chunking)
-    text_chunks = chunk_text(full_text)
+    def commit(next_page, section, carry):
+        """Embebe y guarda el lote actual y registra el avance en el checkpoint."""
+        if batch["ids"]:
+            # Los fragmentos ya embebidos (p. ej. al re-ingestar el mismo manual) salen de la caché
+            embeddings = service.embed(batch["documents"], args.collection_name)
+            service.upsert(embeddings=embeddings, name=args.collection_name, **batch)
+            checkpoint["chunks_added"] += len(batch["ids"])
+            for values in batch.values():
+                values.clear()
+        checkpoint.update(next_page=next_page, section=section, carry=carry)
+        save_manifest(checkpoint_file, checkpoint)
 
-    # 3. Conectar a ChromaDB
+    # 3. Extraer, fragmentar y guardar página a página (solo páginas nuevas o modificadas)
+    carry = checkpoint["carry"]
+    section = checkpoint.get("section", "")
+    pages_total = resumed_from - 1
     try:
-        client = chromadb.PersistentClient(path=args.db_path)
-        collection = client.get_or_create_collection(name=args.collection_name)
+        for page_number, text in iter_pages(str(file_path), resumed_from, digest=current_hash):
+            pages_total = page_number
+            checkpoint["total_chars"] += len(text)
+            key = str(page_number)
+            # Los fragmentos de una página dependen de su texto, de la sección en curso,
+            # del final de la anterior y de las reglas del fragmentador
+            page_hash = text_hash(f"{chunker.VERSION}\0{args.max_tokens}\0{section}\0{carry}\0{text}")
+            # Fragmentar es barato; se hace siempre para saber la sección y el arrastre siguientes
+            chunks, next_section, next_carry = chunker.chunk_page(text, section, carry, args.max_tokens)
+            previous = old_pages.get(key)
+            if previous and previous["hash"] == page_hash:
+                new_pages[key] = previous
+            else:
+                page_ids = []
+                for i, chunk in enumerate(chunks):
+                    cid = chunk_id(source, page_number, chunk["text"])
+                    if cid in page_ids:
+                        continue  # Fragmento repetido en la misma página
+                    page_ids.append(cid)
+                    batch["ids"].append(cid)
+                    batch["documents"].append(chunk["text"])
+                    batch["metadatas"].append({"type": "manual", "source": source, "page": page_number, "chunk": i,
+                                               "section": chunk["section"], "char_span": "%d:%d" % chunk["char_span"],
+                                               "timestamp": timestamp})
+                new_pages[key] = {"hash": page_hash, "chunk_ids": page_ids}
+                checkpoint["pages_changed"] += 1
+            section, carry = next_section, next_carry
+
+            # Los lotes se cierran en límites de página para poder reanudar desde la siguiente
+            if len(batch["ids"]) >= args.batch_size:
+                commit(page_number + 1, section, carry)
+        commit(pages_total + 1, section, carry)
     except Exception as e:
-        print(json.dumps({"status": "error", "message": f"Error conectando a ChromaDB: {e}"}))
-        sys.exit(1)
+        return {"status": "error", "message": f"Error durante la ingesta (se reanudará desde la página {checkpoint['next_page']}): {e}"}
+
+    if not checkpoint["total_chars"] or not any(page["chunk_ids"] for page in new_pages.values()):
+        os.remove(checkpoint_file)
+        return {"status": "error", "message": "El PDF está vacío o no contiene texto extraíble."}
 
-    # 4. Ingestar fragmentos en la BD
+    # 4. Borrar los fragmentos huérfanos y confirmar el manifiesto
+    kept_ids = {cid for page in new_pages.values() for cid in page["chunk_ids"]}
+    orphan_ids = [cid for page in old_pages.values() for cid in page["chunk_ids"] if cid not in kept_ids]
     try:
-        ids = [str(uuid.uuid4()) for _ in text_chunks]
-        metadatas = [{"source": file_path.name, "chunk": i} for i in range(len(text_chunks))]
-        
-        collection.upsert(documents=text_chunks, metadatas=metadatas, ids=ids)
+        if orphan_ids:
+            service.delete(ids=orphan_ids, name=args.collection_name)
     except Exception as e:
-        print(json.dumps({"status": "error", "message": f"Error guardando en ChromaDB: {e}"}))
-        sys.exit(1)
+        return {"status": "error", "message": f"Error guardando en ChromaDB: {e}"}
+
+    save_manifest(manifest_file, {"source": source, "file_hash": current_hash, **settings,
+                                  "ingested_at": timestamp, "pages": new_pages})
+    os.remove(checkpoint_file)
+
+    chunks_added = checkpoint["chunks_added"]
+    pages_changed = checkpoint["pages_changed"]
+    result = {"status": "success",
+              "message": f"Se ingestaron {chunks_added} fragmentos nuevos desde '{source}' ({pages_changed} de {pages_total} páginas cambiaron).",
+              "pages_total": pages_total, "pages_changed": pages_changed,
+              "pages_removed": len(set(old_pages) - set(new_pages)),
+              "chunks_added": chunks_added, "chunks_deleted": len(orphan_ids),
+              "total_chars": checkpoint["total_chars"],
+              "embedding_cache": service.stats()["embedding_cache"]}
+    if resumed_from > 1:
+        result["resumed_from_page"] = resumed_from
+    return result
 
-    print(json.dumps({"status": "success", "message": f"Se ingestaron {len(text_chunks)} fragmentos desde '{file_path.name}'.", "total_chars": len(full_text)}))
+def main():
+    result = run(build_parser().parse_args())
+    print(json.dumps(result))
+    if result.get("status") == "error":
+        sys.exit(1)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+"""
+Índice léxico (BM25) de los fragmentos de memoria.
+
+Los códigos DTC ("P0340"), los números de pieza y los pares de apriete son
+tokens exactos que los embeddings densos emparejan mal: "P0340" queda cerca de
+cualquier otro código P03xx. Este índice invertido puntúa con BM25 los
+fragmentos que contienen literalmente los términos de la consulta, y
+`rrf_fuse()` combina su ranking con el de ChromaDB (reciprocal rank fusion).
+
+El índice vive en un SQLite junto a la base vectorial (`<db>_index.sqlite`),
+con una tabla de documentos (tipo de recuerdo, categoría, timestamp y longitud
+en tokens) y otra de postings (término, documento, frecuencia) por colección; la
+búsqueda se puede restringir a unos tipos (manual, note...). La tabla de
+documentos es además el índice secundario de los listados: `recent()` pagina
+por timestamp con un cursor y `match()` encuentra los documentos que contienen
+un texto sin recorrer la colección. MemoryService lo actualiza en cada escritura
+y lo reconstruye desde ChromaDB si el número de fragmentos no coincide.
+"""
+import math
+import re
+import sqlite3
+import threading
+import unicodedata
+from collections import Counter
+
+# Parámetros estándar de BM25
+K1 = 1.2
+B = 0.75
+# Constante de reciprocal rank fusion (Cormack et al.)
+RRF_K = 60
+
+# Compuestos ("p0340", "55-1234", "1.8", "10,5") se indexan enteros y por partes
+TOKEN_RE = re.compile(r"[a-z0-9]+(?:[-./,][a-z0-9]+)*")
+PART_RE = re.compile(r"[a-z0-9]+")
+STOPWORDS = frozenset(
+    "a al algo como con cual cuando de del desde donde el ella en entre era es esa ese eso esta este esto "
+    "fue ha hay la las le les lo los mas me mi muy no o para pero por que se si sin sobre su sus "
+    "te tiene un una uno unos unas y ya the of and to in is".split()
+)
+
+
+def _fold(text):
+    """Minúsculas y sin tildes ("Bujías" -> "bujias")."""
+    text = unicodedata.normalize("NFKD", text.lower())
+    return "".join(c for c in text if not unicodedata.combining(c))
+
+
+def _stem(token):
+    # Plural simple en palabras (no en códigos): "bujias" -> "bujia", "sensores" -> "sensor"
+    if token.isalpha() and len(token) > 4:
+        if token.endswith("es") and token[-3] not in "aeiou":
+            return token[:-2]
+        if token.endswith("s"):
+            return token[:-1]
+    return token
+
+
+def tokenize(text):
+    """Términos de `text` para el índice (los compuestos también por partes)."""
+    terms = []
+    for match in TOKEN_RE.findall(_fold(text or "")):
+        match = match.strip(".,")
+        parts = PART_RE.findall(match)
+        if len(parts) > 1:
+            terms.append(match)
+        terms += [_stem(p) for p in parts if p not in STOPWORDS]
+    return terms
+
+
+def rrf_fuse(rankings, k=RRF_K):
+    """
+    Combina listas de ids ordenadas (la mejor primero) por reciprocal rank fusion.
+    Devuelve `[(id, puntuación)]` de mayor a menor; los empates conservan el orden
+    de aparición.
+    """
+    scores = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, 1):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda item: -item[1])
+
+
+class LexicalIndex:
+    """Índice invertido BM25 en SQLite, por colección. Seguro entre hilos."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = None
+
+    def _connection(self):
+        if self._db is None:
+            self._db = sqlite3.connect(self.path, check_same_thread=False, timeout=10)
+            columns = {row[1] for row in self._db.execute("PRAGMA table_info(docs)")}
+            if columns and not {"type", "category", "timestamp"} <= columns:
+                # Índice de una versión anterior: se descarta y MemoryService lo reconstruye
+                self._db.executescript("DROP TABLE docs; DROP TABLE IF EXISTS postings;")
+            self._db.executescript("""
+                CREATE TABLE IF NOT EXISTS docs (
+                    collection TEXT NOT NULL, id TEXT NOT NULL, type TEXT NOT NULL DEFAULT '',
+                    category TEXT NOT NULL DEFAULT '', timestamp TEXT NOT NULL DEFAULT '',
+                    length INTEGER NOT NULL,
+                    PRIMARY KEY (collection, id));
+                CREATE INDEX IF NOT EXISTS docs_recent ON docs (collection, timestamp, id);
+                CREATE INDEX IF NOT EXISTS docs_by_type ON docs (collection, type, timestamp, id);
+                CREATE INDEX IF NOT EXISTS docs_by_category ON docs (collection, category, timestamp, id);
+                CREATE TABLE IF NOT EXISTS postings (
+                    collection TEXT NOT NULL, term TEXT NOT NULL, id TEXT NOT NULL, tf INTEGER NOT NULL,
+                    PRIMARY KEY (collection, term, id)) WITHOUT ROWID;
+                CREATE INDEX IF NOT EXISTS postings_by_doc ON postings (collection, id);
+                CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+            """)
+        return self._db
+
+    def _remove(self, db, collection, ids):
+        for doc_id in ids:
+            db.execute("DELETE FROM postings WHERE collection = ? AND id = ?", (collection, doc_id))
+            db.execute("DELETE FROM docs WHERE collection = ? AND id = ?", (collection, doc_id))
+
+    def upsert(self, collection, ids, documents, metadatas=None):
+        """
+        Indexa (o reindexa) los documentos `ids`; de `metadatas` se guardan `type`,
+        `category` y `timestamp` para filtrar y ordenar los listados.
+        """
+        metadatas = metadatas or [{}] * len(ids)
+        with self._lock:
+            db = self._connection()
+            with db:
+                self._remove(db, collection, ids)
+                for doc_id, text, meta in zip(ids, documents, metadatas):
+                    meta = meta or {}
+                    counts = Counter(tokenize(text))
+                    db.execute("INSERT INTO docs (collection, id, type, category, timestamp, length) "
+                               "VALUES (?, ?, ?, ?, ?, ?)",
+                               (collection, doc_id, str(meta.get("type") or ""), str(meta.get("category") or ""),
+                                str(meta.get("timestamp") or ""), sum(counts.values())))
+                    db.executemany("INSERT INTO postings VALUES (?, ?, ?, ?)",
+                                   [(collection, term, doc_id, tf) for term, tf in counts.items()])
+
+    def delete(self, collection, ids):
+        with self._lock:
+            db = self._connection()
+            with db:
+                self._remove(db, collection, ids)
+
+    def clear(self, collection):
+        with self._lock:
+            db = self._connection()
+            with db:
+                db.execute("DELETE FROM postings WHERE collection = ?", (collection,))
+                db.execute("DELETE FROM docs WHERE collection = ?", (collection,))
+
+    def count(self, collection):
+        with self._lock:
+            return self._connection().execute(
+                "SELECT COUNT(*) FROM docs WHERE collection = ?", (collection,)).fetchone()[0]
+
+    def get_meta(self, key):
+        with self._lock:
+            row = self._connection().execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, key, value):
+        with self._lock:
+            db = self._connection()
+            with db:
+                db.execute("INSERT OR REPLACE INTO meta VALUES (?, ?)", (key, value))
+
+    def search(self, collection, query, limit=10, types=None):
+        """
+        `[(id, puntuación BM25)]` de los `limit` mejores documentos para `query`,
+        solo entre los de `types` si se indica.
+        """
+        terms = set(tokenize(query))
+        if not terms:
+            return []
+        with self._lock:
+            db = self._connection()
+            total, length_sum = db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(length), 0) FROM docs WHERE collection = ?", (collection,)).fetchone()
+            if not total:
+                return []
+            avg_length = max(length_sum / total, 1.0)
+            scores = {}
+            for term in terms:
+                rows = db.execute(
+                    "SELECT p.id, p.tf, d.length, d.type FROM postings p JOIN docs d "
+                    "ON d.collection = p.collection AND d.id = p.id "
+                    "WHERE p.collection = ? AND p.term = ?", (collection, term)).fetchall()
+                if not rows:
+                    continue
+                # El idf se calcula sobre toda la colección; el filtro de tipo solo descarta candidatos
+                idf = math.log(1 + (total - len(rows) + 0.5) / (len(rows) + 0.5))
+                for doc_id, tf, length, kind in rows:
+                    if types and kind not in types:
+                        continue
+                    norm = tf * (K1 + 1) / (tf + K1 * (1 - B + B * length / avg_length))
+                    scores[doc_id] = scores.get(doc_id, 0.0) + idf * norm
+        return sorted(scores.items(), key=lambda item: -item[1])[:limit]
+
+    def recent(self, collection, limit=10, types=None, category=None, after=None):
+        """
+        `[(id, timestamp)]` de los `limit` documentos más recientes (timestamp y
+        luego id, descendente), filtrados por `types`/`category`. `after` es la
+        fila `(id, timestamp)` del último de la página anterior: la consulta recorre el
+        índice desde ahí, así que cada página cuesta lo mismo que la primera.
+        """
+        clauses, params = ["collection = ?"], [collection]
+        if types:
+            clauses.append("type IN (%s)" % ",".join("?" * len(types)))
+            params += list(types)
+        if category:
+            clauses.append("category = ?")
+            params.append(category)
+        if after:
+            clauses.append("(timestamp, id) < (?, ?)")
+            params += [after[1], after[0]]
+        with self._lock:
+            return self._connection().execute(
+                "SELECT id, timestamp FROM docs WHERE %s ORDER BY timestamp DESC, id DESC LIMIT ?"
+                % " AND ".join(clauses), params + [limit]).fetchall()
+
+    def match(self, collection, text, types=None):
+        """
+        Ids candidatos a contener `text` empezando en principio de palabra: los que
+        tienen un término que empieza por cada palabra de `text` (la última puede
+        estar a medias, "buj" encuentra "bujías"). Es un superconjunto; quien llama
+        confirma la subcadena. None si `text` no tiene palabras indexables.
+        """
+        parts = PART_RE.findall(_fold(text or ""))
+        prefixes = set()
+        for i, part in enumerate(parts):
+            if part in STOPWORDS:
+                continue
+            if i < len(parts) - 1:
+                prefixes.add(_stem(part))
+            else:
+                # Palabra quizá incompleta: el índice guarda la raíz sin plural
+                # ("nubes" -> "nub"), así que el prefijo no puede pasar de ahí
+                prefixes.add(part[:-2] if part.isalpha() and len(part) > 3 else part)
+        if not prefixes:
+            return None
+        terms = sorted(prefixes, key=len, reverse=True)
+        sql = "SELECT DISTINCT p.id FROM postings p"
+        params = [collection]
+        if types:
+            sql += " JOIN docs d ON d.collection = p.collection AND d.id = p.id AND d.type IN (%s)" % ",".join("?" * len(types))
+            params = list(types) + params
+        # Rango sobre la clave primaria (collection, term, id): búsqueda por prefijo indexada
+        sql += " WHERE p.collection = ? AND p.term >= ? AND p.term < ?"
+        ids = None
+        with self._lock:
+            db = self._connection()
+            for term in terms:
+                found = {row[0] for row in db.execute(sql, params + [term, term + "\uffff"])}
+                ids = found if ids is None else ids & found
+                if not ids:
+                    return set()
+        return ids
@@ -1,51 +1,50 @@
+import argparse
 import json
-import sys
 import os
 from pathlib import Path
 
-try:
-    import chromadb
-except ImportError:
-    print(json.dumps({"status": "error", "message": "Falta chromadb"}), file=sys.stderr)
-    sys.exit(1)
+from ingest_manual import load_manifest, manifest_path
+from memory_service import COLLECTION_NAME
 
-def main():
-    # Configuración de rutas
-    base_dir = Path(__file__).resolve().parent.parent
-    db_path = base_dir / ".tmp" / "chroma_db"
+DEFAULT_DB_PATH = Path(__file__).resolve().parent.parent / ".tmp" / "chroma_db"
+
+def run(args=None):
+    """Lista los PDFs ingestados en la memoria y devuelve el resultado como diccionario."""
+    db_path = getattr(args, "db_path", None) or str(DEFAULT_DB_PATH)
+    collection_name = getattr(args, "collection_name", None) or COLLECTION_NAME
 
-    if not db_path.exists():
-        print(json.dumps({"status": "success", "documents": []}))
-        sys.exit(0)
+    # Cada PDF ingestado tiene su manifiesto (fuente, fecha y páginas): se listan esos
+    # archivos en lugar de leer los metadatos de todos los fragmentos de manuales
+    manifests_dir = os.path.dirname(manifest_path(db_path, collection_name, "_"))
+    if not os.path.isdir(manifests_dir):
+        return {"status": "success", "documents": []}
 
     try:
-        client = chromadb.PersistentClient(path=str(db_path))
-        collection = client.get_or_create_collection(name="agent_memory")
-        
-        # Traemos todos los metadatos para filtrar
-        results = collection.get(include=["metadatas"])
-        
-        files = {}
-        if results['metadatas']:
-            for meta in results['metadatas']:
-                # Buscamos documentos PDF ingestados
-                source = meta.get('source', '')
-                doc_type = meta.get('type', '')
-                
-                # Filtramos si es un PDF o si el tipo es document_pdf
-                if source and (doc_type == 'document_pdf' or source.lower().endswith('.pdf')):
-                    timestamp = meta.get('timestamp', '')
-                    # Usamos el nombre base (ej: manual.pdf) en lugar de la ruta completa
-                    name = os.path.basename(source)
-                    if name not in files:
-                        files[name] = timestamp
-        
-        doc_list = [{"name": k, "ingested_at": v} for k, v in files.items()]
-        
-        print(json.dumps({"status": "success", "documents": doc_list}))
-        
+        doc_list = []
+        for entry in sorted(os.listdir(manifests_dir)):
+            # Los checkpoints (.partial.json) son ingestas a medias, aún no confirmadas
+            if not entry.endswith(".json") or entry.endswith(".partial.json"):
+                continue
+            manifest = load_manifest(os.path.join(manifests_dir, entry))
+            if not manifest:
+                continue
+            doc_list.append({"name": manifest.get("source", entry[:-len(".json")]),
+                             "ingested_at": manifest.get("ingested_at", ""),
+                             "pages": len(manifest.get("pages", {}))})
+
+        return {"status": "success", "documents": doc_list}
+
     except Exception as e:
-        print(json.dumps({"status": "error", "message": str(e)}))
+        return {"status": "error", "message": str(e)}
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Listar los documentos PDF ingestados en la memoria.")
+    parser.add_argument("--db-path", default=str(DEFAULT_DB_PATH), help="Ruta a la base de datos ChromaDB.")
+    parser.add_argument("--collection-name", default=COLLECTION_NAME, help="Nombre de la colección en ChromaDB.")
+    return parser
+
+def main():
+    print(json.dumps(run(build_parser().parse_args())))
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
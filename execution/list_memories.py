@@ -9,58 +9,60 @@ except ImportError:
     print("Error: Missing 'chromadb'.", file=sys.stderr)
     sys.exit(10)
 
+from memory_service import get_service, MEMORY_TYPES
 
-def main():
-    """
-    Lists the most recent memories stored in ChromaDB by sorting metadata timestamps.
-    """
+
+def build_parser():
     parser = argparse.ArgumentParser(description="List recent agent memories.")
-    parser.add_argument("--limit", type=int, default=10, help="Number of memories to return.")
+    parser.add_argument("--limit", type=int, default=10, help="Number of memories to return (page size).")
+    parser.add_argument("--type", default="note", choices=list(MEMORY_TYPES) + ["all"],
+                        help="Memory type to list (default: user notes; 'all' includes manual chunks).")
+    parser.add_argument("--category", help="Only memories with this category (e.g. telegram_note).")
+    parser.add_argument("--cursor", help="next_cursor from a previous page to continue listing.")
     parser.add_argument("--db-path", default=".tmp/chroma_db", help="Path to ChromaDB.")
-    args = parser.parse_args()
+    return parser
 
+
+def run(args):
+    """
+    Lists the most recent memories, newest first, one page at a time.
+    Returns the result as a dict; errors carry the CLI exit code.
+    """
     try:
-        client = chromadb.PersistentClient(path=args.db_path)
-        collection = client.get_or_create_collection(name="agent_memory")
+        service = get_service(args.db_path)
+        service.collection()
     except Exception as e:
-        print(json.dumps({"status": "error", "message": str(e)}), file=sys.stderr)
-        sys.exit(2)
+        return {"status": "error", "message": str(e), "exit_code": 2}
 
     try:
-        # Fetch all items to sort them in Python (ChromaDB doesn't support native sort by metadata yet)
-        # For a local agent with <10k memories, this is fast enough.
-        data = collection.get()
-
-        memories = []
-        if data['ids']:
-            for i in range(len(data['ids'])):
-                mem_id = data['ids'][i]
-                doc = data['documents'][i] if data['documents'] else ""
-                meta = data['metadatas'][i] if data['metadatas'] else {}
-
-                memories.append({
-                    "id": mem_id,
-                    "content": doc,
-                    "metadata": meta,
-                    "timestamp": meta.get("timestamp", "")
-                })
+        # The sidecar index keeps type/category/timestamp per memory, so only the
+        # requested page is read from ChromaDB instead of the whole collection
+        memories, next_cursor = service.list_recent(
+            limit=args.limit,
+            types=None if args.type == "all" else [args.type],
+            category=args.category,
+            cursor=args.cursor
+        )
+    except ValueError as e:
+        return {"status": "error", "message": str(e), "exit_code": 1}
+    except Exception as e:
+        return {"status": "error", "message": str(e), "exit_code": 3}
 
-        # Sort by timestamp descending (newest first)
-        # ISO format strings are sortable lexicographically
-        memories.sort(key=lambda x: x['timestamp'], reverse=True)
+    return {
+        "status": "success",
+        "count": len(memories),
+        "memories": memories,
+        "next_cursor": next_cursor
+    }
 
-        # Slice to limit
-        recent_memories = memories[:args.limit]
 
-    except Exception as e:
-        print(json.dumps({"status": "error", "message": str(e)}), file=sys.stderr)
-        sys.exit(3)
+def main():
+    result = run(build_parser().parse_args())
+    if result["status"] == "error":
+        print(json.dumps({"status": "error", "message": result["message"]}), file=sys.stderr)
+        sys.exit(result["exit_code"])
 
-    print(json.dumps({
-        "status": "success",
-        "count": len(recent_memories),
-        "memories": recent_memories
-    }, indent=2))
+    print(json.dumps(result, indent=2))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+Transporte HTTP compartido para los proveedores LLM (OpenAI, Anthropic, Groq).
+
+Cada `requests.post` suelto pagaba DNS y un handshake TCP+TLS por turno. Aquí una
+sola `requests.Session` mantiene un pool de conexiones keep-alive por host, con
+timeouts de conexión y lectura configurables y reintentos con backoff exponencial
+y jitter ante 429/5xx o errores de conexión (respetando `Retry-After`).
+
+Las URL base se pueden sobreescribir (`OPENAI_BASE_URL`, `ANTHROPIC_BASE_URL`,
+`GROQ_BASE_URL`), p. ej. para apuntar al servidor simulado de `mock_llm_server.py`.
+"""
+import json
+import os
+import random
+import sys
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+DEFAULT_BASE_URLS = {
+    "openai": "https://api.openai.com/v1",
+    "anthropic": "https://api.anthropic.com/v1",
+    "groq": "https://api.groq.com/openai/v1",
+}
+
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+def base_url(provider):
+    """URL base del proveedor (variable `<PROVEEDOR>_BASE_URL` o la oficial)."""
+    return os.getenv(f"{provider.upper()}_BASE_URL", DEFAULT_BASE_URLS[provider]).rstrip("/")
+
+
+class ProviderTransport:
+    """Sesión HTTP con pool por host, timeouts y reintentos con backoff + jitter."""
+
+    def __init__(self, connect_timeout=None, read_timeout=None, max_retries=None,
+                 backoff_base=0.5, backoff_max=8.0, pool_maxsize=10):
+        self.connect_timeout = connect_timeout or float(os.getenv("LLM_CONNECT_TIMEOUT", "5"))
+        self.read_timeout = read_timeout or float(os.getenv("LLM_READ_TIMEOUT", "30"))
+        self.max_retries = int(os.getenv("LLM_MAX_RETRIES", "2")) if max_retries is None else max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+        self.session = requests.Session()
+        # Un pool por host; pool_maxsize acota las conexiones simultáneas a cada proveedor
+        adapter = HTTPAdapter(pool_connections=len(DEFAULT_BASE_URLS), pool_maxsize=pool_maxsize)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        self._lock = threading.Lock()
+        self.stats = {"requests": 0, "retries": 0}
+
+    def _delay(self, attempt, response=None):
+        """Backoff exponencial con jitter completo; `Retry-After` manda si viene en la respuesta."""
+        if response is not None:
+            retry_after = response.headers.get("Retry-After")
+            if retry_after:
+                try:
+                    return min(float(retry_after), self.backoff_max)
+                except ValueError:
+                    pass
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def post(self, url, headers=None, json=None, timeout=None, cancel=None, limiter=None, tokens=0, **kwargs):
+        """
+        POST con reintentos. Devuelve la última `Response` (aunque sea un error HTTP)
+        para que cada proveedor conserve su manejo de errores; relanza la excepción
+        de red si fallan todos los intentos. Si el `threading.Event` `cancel` se
+        activa durante la espera entre intentos, no se reintenta más.
+
+        Con `limiter` (ver rate_limiter.py) cada intento espera turno en la cubeta de
+        la API key con `tokens` estimados, y las cabeceras de límite de la respuesta
+        la reajustan.
+        """
+        timeout = timeout or (self.connect_timeout, self.read_timeout)
+        for attempt in range(self.max_retries + 1):
+            if limiter is not None:
+                limiter.acquire(tokens, cancel=cancel)
+            with self._lock:
+                self.stats["requests"] += 1
+            try:
+                response = self.session.post(url, headers=headers, json=json, timeout=timeout, **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                if attempt == self.max_retries:
+                    raise
+                delay = self._delay(attempt)
+                print(f"⚠️  [HTTP] {type(e).__name__} en {url}. Reintento en {delay:.1f}s...", file=sys.stderr)
+            else:
+                if limiter is not None:
+                    limiter.observe(response.headers, response.status_code)
+                if response.status_code not in RETRY_STATUS or attempt == self.max_retries:
+                    return response
+                delay = self._delay(attempt, response)
+                print(f"⚠️  [HTTP] {response.status_code} en {url}. Reintento en {delay:.1f}s...", file=sys.stderr)
+                response.close()
+            with self._lock:
+                self.stats["retries"] += 1
+            if cancel is None:
+                time.sleep(delay)
+            elif cancel.wait(delay):
+                raise requests.exceptions.RequestException("Cancelado: otro proveedor respondió antes.")
+
+
+def _sse_data(data_lines):
+    data = "\n".join(data_lines)
+    try:
+        return json.loads(data)
+    except ValueError:
+        return data
+
+
+def iter_sse(response):
+    """
+    Genera los eventos Server-Sent Events de una respuesta con `stream=True` como
+    `(evento, datos)`. `datos` es el JSON decodificado (o el texto si no es JSON);
+    el marcador final `[DONE]` de OpenAI/Groq termina la iteración.
+    """
+    event, data_lines = None, []
+    # chunk_size=None entrega cada trozo chunked en cuanto llega (no espera a llenar un búfer)
+    for raw in response.iter_lines(chunk_size=None):
+        line = raw.decode("utf-8", errors="replace")
+        if line.startswith(":"):
+            continue  # comentario / keep-alive del servidor
+        if line:
+            field, _, value = line.partition(":")
+            value = value[1:] if value.startswith(" ") else value
+            if field == "event":
+                event = value
+            elif field == "data":
+                data_lines.append(value)
+            continue
+        # Línea en blanco: fin del evento
+        if data_lines:
+            if data_lines == ["[DONE]"]:
+                return
+            yield event, _sse_data(data_lines)
+        event, data_lines = None, []
+    if data_lines and data_lines != ["[DONE]"]:
+        yield event, _sse_data(data_lines)
+
+
+_TRANSPORT = None
+_TRANSPORT_LOCK = threading.Lock()
+
+
+def get_transport():
+    """Transporte compartido del proceso (el listener lo reutiliza en todos los turnos)."""
+    global _TRANSPORT
+    with _TRANSPORT_LOCK:
+        if _TRANSPORT is None:
+            _TRANSPORT = ProviderTransport()
+        return _TRANSPORT
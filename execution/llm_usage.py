@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Tokens consumidos y coste estimado de las llamadas al LLM.
+
+Los proveedores informan de los tokens de cada respuesta (`usage` en
+OpenAI/Groq/Anthropic, `usage_metadata` en Gemini); en streaming no llegan y
+chat_with_llm los estima con `prompt_budget.count_tokens`. `meter()` abre un
+contador para las llamadas hechas dentro del bloque, también desde los hilos
+del hedging y del map-reduce (que copian el contexto), así un lote sabe cuánto
+costó cada elemento aunque por dentro haga varias llamadas.
+
+Precios en USD por millón de tokens (entrada, salida), aproximados a las tarifas
+públicas; `LLM_PRICES` los sobreescribe con un JSON `{"prefijo": [entrada, salida]}`.
+"""
+import contextlib
+import contextvars
+import json
+import os
+import threading
+
+# (prefijo del modelo, USD por millón de tokens de entrada, de salida); el primero que encaje
+MODEL_PRICES = [
+    ("gpt-4o-mini", 0.15, 0.60),
+    ("gpt-4o", 2.50, 10.00),
+    ("claude-3-5-sonnet", 3.00, 15.00),
+    ("claude-3-5-haiku", 0.80, 4.00),
+    ("claude-3-haiku", 0.25, 1.25),
+    ("gemini-1.5-flash", 0.075, 0.30),
+    ("gemini-flash", 0.30, 2.50),
+    ("gemini-pro", 1.25, 5.00),
+    ("llama-3.3-70b", 0.59, 0.79),
+    ("llama-3.1-8b", 0.05, 0.08),
+]
+
+_METER = contextvars.ContextVar("llm_usage_meter", default=None)
+
+
+def _prices():
+    try:
+        extra = json.loads(os.getenv("LLM_PRICES") or "{}")
+    except ValueError:
+        extra = {}
+    return [(prefix, float(i), float(o)) for prefix, (i, o) in extra.items()] + MODEL_PRICES
+
+
+def cost(model, input_tokens, output_tokens):
+    """Coste estimado en USD, o None si el modelo no tiene precio conocido."""
+    for prefix, input_price, output_price in _prices():
+        if model and model.startswith(prefix):
+            return (input_tokens * input_price + output_tokens * output_price) / 1e6
+    return None
+
+
+class Meter:
+    """Acumulado de las llamadas de un bloque `meter()`."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls = []
+
+    def add(self, provider, model, input_tokens, output_tokens, estimated=False):
+        with self._lock:
+            self.calls.append({"provider": provider, "model": model, "input_tokens": input_tokens,
+                               "output_tokens": output_tokens, "estimated": estimated,
+                               "cost_usd": cost(model, input_tokens, output_tokens)})
+
+    def totals(self):
+        """Suma de tokens y coste; `cost_usd` es None si ninguna llamada tenía precio."""
+        with self._lock:
+            calls = list(self.calls)
+        costs = [c["cost_usd"] for c in calls if c["cost_usd"] is not None]
+        return {
+            "calls": len(calls),
+            "input_tokens": sum(c["input_tokens"] for c in calls),
+            "output_tokens": sum(c["output_tokens"] for c in calls),
+            "cost_usd": round(sum(costs), 6) if costs else None,
+            "estimated": any(c["estimated"] for c in calls),
+        }
+
+
+@contextlib.contextmanager
+def meter():
+    """Cuenta las llamadas al LLM hechas dentro del bloque; devuelve el `Meter`."""
+    current = Meter()
+    token = _METER.set(current)
+    try:
+        yield current
+    finally:
+        _METER.reset(token)
+
+
+def record(provider, model, input_tokens, output_tokens, estimated=False):
+    """Anota una llamada en el contador activo (no hace nada fuera de `meter()`)."""
+    current = _METER.get()
+    if current is not None:
+        current.add(provider, model, int(input_tokens or 0), int(output_tokens or 0), estimated)
@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""
+Map-reduce sobre documentos largos (resúmenes y traducciones).
+
+Meter un manual entero en un solo prompt fallaba o se truncaba sin avisar. Aquí
+el texto se parte en trozos que caben en el presupuesto de tokens
+(prompt_budget.py), cada trozo se envía al LLM en paralelo (`LLM_MAP_CONCURRENCY`
+llamadas a la vez, con prioridad de fondo en el limitador de cada API key, ver
+rate_limiter.py) y los resultados se combinan: las traducciones se reensamblan
+en orden y las notas parciales se vuelven a condensar hasta que caben en el
+prompt final.
+
+Cada trozo terminado se anota en `.tmp/map_reduce_cache/<trabajo>.jsonl`; si el
+proceso se corta, al repetir el mismo trabajo solo se piden los que faltan. El
+archivo se borra cuando el trabajo termina bien.
+"""
+import contextvars
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from prompt_budget import count_tokens, split_to_tokens
+from rate_limiter import priority, BACKGROUND
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CACHE_DIR = os.path.join(PROJECT_ROOT, ".tmp", "map_reduce_cache")
+
+MAP_CONCURRENCY = int(os.getenv("LLM_MAP_CONCURRENCY", "4"))
+# Rondas de condensado como máximo (notas de notas...) antes de rendirse
+MAX_ROUNDS = 4
+
+NOTES_TEMPLATE = """Extrae la información técnica clave del siguiente fragmento (parte {index} de {total}) de un documento más largo.
+Conserva especificaciones, valores, procedimientos, códigos y advertencias. Responde solo con viñetas concisas, en español.
+
+FRAGMENTO:
+{payload}
+"""
+
+
+class ChunkCache:
+    """Resultados por trozo de un trabajo, en un JSONL al que solo se añaden líneas."""
+
+    def __init__(self, job, cache_dir=CACHE_DIR):
+        self.path = os.path.join(cache_dir, f"{job}.jsonl")
+        self._lock = threading.Lock()
+        self.entries = {}
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue  # línea a medio escribir cuando se cortó el proceso
+                    self.entries[record["key"]] = record["output"]
+        except FileNotFoundError:
+            pass
+
+    def get(self, key):
+        return self.entries.get(key)
+
+    def put(self, key, output):
+        with self._lock:
+            self.entries[key] = output
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps({"key": key, "output": output}, ensure_ascii=False) + "\n")
+
+    def discard(self):
+        with self._lock:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+
+def _hash(*parts):
+    return hashlib.sha256("\0".join(parts).encode("utf-8")).hexdigest()
+
+
+def default_call(prompt):
+    """Llamada al LLM con la cadena de proveedores de chat_with_llm (sin historial ni memoria)."""
+    from chat_with_llm import complete
+    result = complete(prompt)
+    if "content" not in result:
+        raise RuntimeError(result.get("error", "sin respuesta"))
+    return result["content"]
+
+
+class MapReduce:
+    """
+    Motor map-reduce. `call(prompt) -> str` hace la llamada al LLM (y lanza una
+    excepción si falla). Las plantillas llevan el marcador `{payload}` y pueden usar
+    `{index}` y `{total}` para situar el trozo.
+    """
+
+    def __init__(self, call=default_call, concurrency=MAP_CONCURRENCY, cache_dir=CACHE_DIR):
+        self.call = call
+        self.concurrency = max(concurrency, 1)
+        self.cache_dir = cache_dir
+        self.stats = {"chunks": 0, "cached": 0, "calls": 0, "rounds": 0, "seconds": 0.0}
+        self._lock = threading.Lock()
+
+    def _count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+    def _prompt(self, template, chunk, index, total):
+        return template.replace("{index}", str(index)).replace("{total}", str(total)).replace("{payload}", chunk)
+
+    def map(self, chunks, template, cache):
+        """Aplica `template` a cada trozo en paralelo y devuelve las salidas en el orden de entrada."""
+        total = len(chunks)
+        prompts = [self._prompt(template, chunk, i, total) for i, chunk in enumerate(chunks, 1)]
+        outputs = [None] * total
+        errors = []
+
+        def work(i):
+            key = _hash(prompts[i])
+            cached = cache.get(key)
+            if cached is not None:
+                self._count("cached")
+                outputs[i] = cached
+                return
+            self._count("calls")
+            try:
+                # Trabajo por lotes: cede el turno al chat interactivo en el limitador de cada API key
+                with priority(BACKGROUND):
+                    outputs[i] = self.call(prompts[i])
+            except Exception as e:
+                errors.append((i + 1, e))
+                return
+            cache.put(key, outputs[i])
+
+        self.stats["chunks"] += total
+        with ThreadPoolExecutor(max_workers=min(self.concurrency, total) or 1) as pool:
+            # Cada trozo en una copia del contexto: conserva el contador de consumo del llamante (llm_usage)
+            for future in [pool.submit(contextvars.copy_context().run, work, i) for i in range(total)]:
+                future.result()
+        if errors:
+            errors.sort(key=lambda item: item[0])
+            index, error = errors[0]
+            raise RuntimeError(
+                f"Fallaron {len(errors)} de {total} fragmentos (el {index}: {error}); "
+                f"los {total - len(errors)} terminados quedan guardados y no se repetirán."
+            )
+        return outputs
+
+    def translate(self, text, template, chunk_tokens):
+        """Traduce `text` por trozos de hasta `chunk_tokens` y los reensambla en orden."""
+        start = time.perf_counter()
+        cache = ChunkCache(_hash("translate", template, text), self.cache_dir)
+        chunks = [c for c in split_to_tokens(text, chunk_tokens) if c.strip()]
+        outputs = self.map(chunks, template, cache)
+        cache.discard()
+        self.stats["seconds"] = round(time.perf_counter() - start, 2)
+        return "\n\n".join(o.strip() for o in outputs if o.strip())
+
+    def condense(self, text, target_tokens, chunk_tokens, template=NOTES_TEMPLATE):
+        """
+        Reduce `text` a notas que quepan en `target_tokens`: cada trozo de
+        `chunk_tokens` se resume en paralelo y, si las notas unidas siguen sin caber,
+        se vuelven a resumir (hasta `MAX_ROUNDS` rondas).
+        """
+        start = time.perf_counter()
+        cache = ChunkCache(_hash("condense", template, text), self.cache_dir)
+        for _ in range(MAX_ROUNDS):
+            if count_tokens(text) <= target_tokens:
+                break
+            self.stats["rounds"] += 1
+            chunks = [c for c in split_to_tokens(text, chunk_tokens) if c.strip()]
+            text = "\n\n".join(o.strip() for o in self.map(chunks, template, cache))
+        cache.discard()
+        self.stats["seconds"] = round(time.perf_counter() - start, 2)
+        return text
+
+
+def condense_for_prompt(template, payload, engine=None, **fixed):
+    """
+    Si `payload` no cabe en `template` con la cadena de proveedores actual, lo
+    sustituye por notas condensadas con map-reduce. Devuelve `(texto, stats)`;
+    `stats` es None si cabía tal cual.
+    """
+    from prompt_budget import plan
+    budget = plan(payload, mode="split", template=template.replace("{payload}", ""), **fixed)
+    if budget["action"] == "fit":
+        return payload, None
+    engine = engine or MapReduce()
+    # Los trozos del map solo llevan la plantilla de notas: pueden ser más grandes que el hueco final
+    chunk_budget = plan(payload, mode="split", template=NOTES_TEMPLATE)["available"]
+    print(f"🧩 [MAP-REDUCE] Documento de {budget['payload_tokens']} tokens; condensando a {budget['available']}...", file=sys.stderr)
+    notes = engine.condense(payload, budget["available"], chunk_budget)
+    return notes, dict(engine.stats)
@@ -0,0 +1,514 @@
+#!/usr/bin/env python3
+"""
+Servicio de memoria compartido (ChromaDB).
+
+Cada herramienta de memoria creaba su propio `chromadb.PersistentClient` y
+llamaba a `get_or_create_collection('agent_memory')` en cada invocación, lo que
+volvía a abrir el SQLite, el índice HNSW y a cargar el modelo de embeddings en
+la primera consulta. Este módulo mantiene un cliente y un handle de colección
+por ruta de base de datos durante toda la vida del proceso (el listener, o una
+llamada CLI suelta), de modo que solo la primera operación paga la carga en frío.
+Las consultas y la ingesta pasan por la caché de embeddings (embedding_cache.py).
+
+Las escrituras (`add`, `upsert`, `delete`) mantienen además el índice léxico BM25
+(lexical_index.py) y `hybrid_query()` fusiona sus resultados con los vectoriales,
+para que los códigos y números de pieza exactos no dependan solo de los embeddings.
+
+Notas del usuario, fragmentos de manuales y datos de ejemplo
+comparten la colección `agent_memory` y se distinguen por el metadato `type`
+(`MEMORY_TYPES`). `type_filter()` lo convierte en un `where` que ChromaDB aplica
+dentro de la consulta, así cada ruta (p. ej. `/scan` solo manuales) consulta su
+subconjunto sin traer el resto.
+
+Los listados tampoco recorren la colección: el índice guarda también el tipo, la
+categoría y el timestamp de cada recuerdo, y `list_recent()` pagina con un cursor
+sobre esa tabla; `find_text()` localiza por el índice los recuerdos que contienen
+un texto. De ChromaDB solo se leen los recuerdos de la página o los candidatos.
+
+Las consultas vectoriales que llegan a la vez (varios chats, o los códigos DTC
+de un `/scan`) se agrupan (query_batcher.py): un solo cálculo de embeddings y un
+`collection.query` por filtro para todo el lote. `hybrid_query_many()` manda
+varias consultas como un lote, y `aquery()`/`ahybrid_query()` son las versiones
+para asyncio.
+"""
+import asyncio
+import base64
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import chromadb
+except ImportError:
+    chromadb = None
+
+from embedding_cache import get_cache
+from lexical_index import LexicalIndex, rrf_fuse
+from query_batcher import QueryBatcher
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_DB_PATH = os.path.join(PROJECT_ROOT, ".tmp", "chroma_db")
+COLLECTION_NAME = "agent_memory"
+# Tipos de recuerdo (metadato `type`): notas del usuario, manuales ingestados, datos de ejemplo
+MEMORY_TYPES = ("note", "manual", "fact")
+# Candidatos que aporta cada ranking (vectorial y léxico) a la fusión
+HYBRID_CANDIDATES = 10
+# Objetivo de latencia de una consulta híbrida; si se supera se avisa en stderr
+LATENCY_TARGET_MS = float(os.getenv("RAG_LATENCY_TARGET_MS", "200"))
+# Fragmentos leídos por página al reconstruir el índice léxico
+REBUILD_PAGE = 1000
+# Ventana en la que se juntan consultas vectoriales concurrentes (0: sin espera) y tamaño máximo del lote
+BATCH_WINDOW_MS = float(os.getenv("RAG_BATCH_WINDOW_MS", "5"))
+BATCH_MAX = int(os.getenv("RAG_BATCH_MAX", "32"))
+# Campos por consulta en la respuesta de collection.query
+RESULT_FIELDS = ("ids", "documents", "metadatas", "distances", "embeddings", "uris", "data")
+
+
+def infer_type(metadata):
+    """Tipo de un recuerdo guardado antes de que existiera el campo `type`."""
+    metadata = metadata or {}
+    kind = metadata.get("type")
+    if kind in MEMORY_TYPES:
+        return kind
+    source = str(metadata.get("source", ""))
+    if kind == "document_pdf" or "page" in metadata or source.lower().endswith(".pdf"):
+        return "manual"
+    return "note"
+
+
+def type_filter(types):
+    """Filtro `where` de ChromaDB para los tipos `types` (None si son todos)."""
+    types = [t for t in (types or []) if t]
+    if not types or set(types) >= set(MEMORY_TYPES):
+        return None
+    return {"type": types[0]} if len(types) == 1 else {"type": {"$in": list(types)}}
+
+
+def _index_metadatas(metadatas, count):
+    """Metadatos que se guardan en el índice, con el tipo ya resuelto."""
+    return [dict(meta or {}, type=infer_type(meta)) for meta in metadatas or [{}] * count]
+
+
+def encode_cursor(doc_id, timestamp):
+    """Cursor opaco de paginación a partir del último recuerdo de una página."""
+    raw = json.dumps([doc_id, timestamp]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor):
+    """`(id, timestamp)` de un cursor de `encode_cursor()`; ValueError si no es válido."""
+    try:
+        doc_id, timestamp = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        return str(doc_id), str(timestamp)
+    except Exception:
+        raise ValueError(f"Cursor de paginación no válido: {cursor}")
+
+
+def parse_types(value):
+    """Lista de tipos de una opción CLI separada por comas ("manual,note"); None o "all" son todos."""
+    if not value or value == "all":
+        return None
+    types = [t.strip() for t in value.split(",") if t.strip()]
+    unknown = [t for t in types if t not in MEMORY_TYPES]
+    if unknown:
+        raise ValueError(f"Tipos de recuerdo desconocidos: {', '.join(unknown)} (válidos: {', '.join(MEMORY_TYPES)}).")
+    return types
+
+
+class MemoryService:
+    """Cliente ChromaDB de larga duración con caché de colecciones y métricas de arranque."""
+
+    def __init__(self, db_path=DEFAULT_DB_PATH):
+        self.db_path = db_path
+        self._client = None
+        self._collections = {}
+        self._lock = threading.Lock()
+        self._lexical = None
+        self._synced = set()
+        self._sync_lock = threading.Lock()
+        self._pool = None
+        self._batcher = QueryBatcher(self._query_batch, BATCH_WINDOW_MS / 1000, BATCH_MAX)
+        self.metrics = {"client_open_s": None, "warmup_s": None, "collections_opened": 0,
+                        "hybrid_queries": 0, "slow_queries": 0, "lexical_rebuilds": 0, "typed_legacy": 0}
+
+    @property
+    def client(self):
+        if chromadb is None:
+            raise RuntimeError("Librería 'chromadb' no instalada. Ejecuta: pip install chromadb")
+        with self._lock:
+            if self._client is None:
+                start = time.perf_counter()
+                self._client = chromadb.PersistentClient(path=self.db_path)
+                self.metrics["client_open_s"] = round(time.perf_counter() - start, 4)
+            return self._client
+
+    def collection(self, name=COLLECTION_NAME, metadata=None):
+        """
+        Devuelve el handle cacheado de la colección (la crea si no existe).
+        `metadata` solo se aplica al crearla (p. ej. `{"hnsw:space": "cosine"}`).
+        """
+        handle = self._collections.get(name)
+        if handle is not None:
+            return handle
+        client = self.client
+        with self._lock:
+            if name not in self._collections:
+                self._collections[name] = client.get_or_create_collection(name=name, metadata=metadata)
+                self.metrics["collections_opened"] += 1
+            return self._collections[name]
+
+    def embed(self, texts, name=COLLECTION_NAME):
+        """Embeddings de `texts` con el modelo de la colección, pasando por la caché."""
+        collection = self.collection(name)
+        return get_cache().embed(collection._embedding_function, texts)
+
+    def query(self, query_texts, n_results=3, name=COLLECTION_NAME, where=None, **kwargs):
+        """
+        `collection.query` con embeddings precalculados (y cacheados) en lugar de
+        `query_texts`. Sin otros argumentos que `where`, cada texto entra en el lote
+        de consultas concurrentes y la respuesta se recompone con sus filas.
+        """
+        if kwargs:
+            collection = self.collection(name)
+            return collection.query(query_embeddings=self.embed(query_texts, name), n_results=n_results,
+                                    **dict(kwargs, **({"where": where} if where else {})))
+        rows = self._batcher.call_many([(name, text, n_results, where) for text in query_texts])
+        merged = {field: [row[field][0] for row in rows] if rows and rows[0][field] is not None else None
+                  for field in RESULT_FIELDS}
+        merged["included"] = rows[0]["included"] if rows else []
+        return merged
+
+    def _query_batch(self, requests):
+        """
+        Resuelve un lote de `(colección, texto, n_results, where)`: un embedding por
+        colección para todos los textos y un `collection.query` por filtro. Devuelve
+        por petición una respuesta de una fila, recortada a su `n_results` (o la
+        excepción de su grupo).
+        """
+        groups = {}
+        for i, (name, text, n_results, where) in enumerate(requests):
+            key = (name, json.dumps(where, sort_keys=True) if where else "")
+            groups.setdefault(key, []).append(i)
+        vectors = {}
+        for name in {name for name, _, _, _ in requests}:
+            texts = list(dict.fromkeys(text for n, text, _, _ in requests if n == name))
+            vectors.update(zip(((name, text) for text in texts), self.embed(texts, name)))
+
+        responses = [None] * len(requests)
+        for (name, _), indexes in groups.items():
+            where = requests[indexes[0]][3]
+            try:
+                found = self.collection(name).query(
+                    query_embeddings=[vectors[(name, requests[i][1])] for i in indexes],
+                    n_results=max(requests[i][2] for i in indexes), **({"where": where} if where else {}))
+            except Exception as e:
+                # Un filtro inválido solo hace fallar a las consultas que lo usan
+                for i in indexes:
+                    responses[i] = e
+                continue
+            for row, i in enumerate(indexes):
+                limit = requests[i][2]
+                responses[i] = {field: None if found.get(field) is None else [found[field][row][:limit]]
+                                for field in RESULT_FIELDS}
+                responses[i]["included"] = found.get("included", [])
+        return responses
+
+    async def aquery(self, query_texts, n_results=3, name=COLLECTION_NAME, where=None):
+        """`query()` para asyncio: espera en un hilo sin bloquear el bucle de eventos."""
+        return await asyncio.to_thread(self.query, query_texts, n_results, name, where)
+
+    # --- Índice léxico ---
+
+    @property
+    def lexical(self):
+        """Índice BM25 junto a la base vectorial (`<db>_index.sqlite`)."""
+        with self._lock:
+            if self._lexical is None:
+                os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+                self._lexical = LexicalIndex(f"{self.db_path}_index.sqlite")
+            return self._lexical
+
+    def sync_lexical(self, name=COLLECTION_NAME, force=False):
+        """
+        Reconstruye el índice léxico desde ChromaDB si no tiene los mismos fragmentos
+        (base anterior al índice, o escrituras que no pasaron por este servicio).
+        """
+        collection = self.collection(name)
+        if not force and self.lexical.count(name) == collection.count():
+            return False
+        start = time.perf_counter()
+        self.lexical.clear(name)
+        offset = 0
+        while True:
+            page = collection.get(include=["documents", "metadatas"], limit=REBUILD_PAGE, offset=offset)
+            if not page["ids"]:
+                break
+            self.lexical.upsert(name, page["ids"], [doc or "" for doc in page["documents"]],
+                                _index_metadatas(page["metadatas"], len(page["ids"])))
+            offset += len(page["ids"])
+            if len(page["ids"]) < REBUILD_PAGE:
+                break
+        self.metrics["lexical_rebuilds"] += 1
+        print(f"🔤 [MEMORY] Índice léxico de '{name}' reconstruido: {offset} fragmentos en {time.perf_counter() - start:.2f}s.", file=sys.stderr)
+        return True
+
+    def migrate_types(self, name=COLLECTION_NAME):
+        """
+        Añade `type` a los recuerdos guardados antes de que existiera (deducido de
+        `source`/`page`). Recorre la colección una sola vez por base: queda anotado
+        en el índice. Devuelve cuántos se actualizaron.
+        """
+        key = f"types_migrated:{name}"
+        if self.lexical.get_meta(key):
+            return 0
+        collection = self.collection(name)
+        updated = offset = 0
+        while True:
+            page = collection.get(include=["metadatas"], limit=REBUILD_PAGE, offset=offset)
+            if not page["ids"]:
+                break
+            ids, metadatas = [], []
+            for doc_id, meta in zip(page["ids"], page["metadatas"]):
+                if (meta or {}).get("type") not in MEMORY_TYPES:
+                    ids.append(doc_id)
+                    metadatas.append(dict(meta or {}, type=infer_type(meta)))
+            if ids:
+                collection.update(ids=ids, metadatas=metadatas)
+                updated += len(ids)
+            offset += len(page["ids"])
+            if len(page["ids"]) < REBUILD_PAGE:
+                break
+        self.lexical.set_meta(key, "1")
+        if updated:
+            self.metrics["typed_legacy"] += updated
+            print(f"🏷️  [MEMORY] {updated} recuerdos antiguos de '{name}' etiquetados con su tipo.", file=sys.stderr)
+        return updated
+
+    def ensure_ready(self, name=COLLECTION_NAME):
+        """
+        Etiqueta los recuerdos antiguos con su tipo y pone al día el índice léxico.
+        Se comprueba una vez por proceso y colección; después lo mantienen las escrituras.
+        """
+        if name in self._synced:
+            return
+        with self._sync_lock:
+            if name not in self._synced:
+                # Si se etiquetaron recuerdos antiguos, el índice debe recoger sus tipos
+                self.sync_lexical(name, force=bool(self.migrate_types(name)))
+                self._synced.add(name)
+
+    # --- Escrituras (ChromaDB + índice léxico) ---
+
+    def add(self, ids, documents, metadatas=None, name=COLLECTION_NAME, **kwargs):
+        self.ensure_ready(name)
+        self.collection(name).add(ids=ids, documents=documents, metadatas=metadatas, **kwargs)
+        self.lexical.upsert(name, ids, documents, _index_metadatas(metadatas, len(ids)))
+
+    def upsert(self, ids, documents, metadatas=None, name=COLLECTION_NAME, **kwargs):
+        self.ensure_ready(name)
+        self.collection(name).upsert(ids=ids, documents=documents, metadatas=metadatas, **kwargs)
+        self.lexical.upsert(name, ids, documents, _index_metadatas(metadatas, len(ids)))
+
+    def delete(self, ids=None, where=None, name=COLLECTION_NAME):
+        """Borra por ids o por filtro de metadatos; devuelve los ids borrados."""
+        self.ensure_ready(name)
+        collection = self.collection(name)
+        if where is not None:
+            ids = list(set(ids or []) | set(collection.get(where=where, include=[])["ids"]))
+        if ids:
+            collection.delete(ids=ids)
+            self.lexical.delete(name, ids)
+        return ids or []
+
+    # --- Listados (índice secundario) ---
+
+    def list_recent(self, limit=10, types=None, category=None, cursor=None, name=COLLECTION_NAME):
+        """
+        Página de los `limit` recuerdos más recientes de `types`/`category` y el
+        cursor de la siguiente (None si no hay más). Cada recuerdo lleva `id`,
+        `content`, `metadata` y `timestamp`.
+        """
+        self.ensure_ready(name)
+        after = decode_cursor(cursor) if cursor else None
+        rows = self.lexical.recent(name, limit + 1, types=types, category=category, after=after)
+        page, more = rows[:limit], len(rows) > limit
+        if not page:
+            return [], None
+        data = self.collection(name).get(ids=[doc_id for doc_id, _ in page], include=["documents", "metadatas"])
+        found = {doc_id: (doc, meta) for doc_id, doc, meta in zip(data["ids"], data["documents"], data["metadatas"])}
+        memories = []
+        for doc_id, timestamp in page:
+            if doc_id in found:  # ausente si se borró de ChromaDB por fuera del servicio
+                doc, meta = found[doc_id]
+                memories.append({"id": doc_id, "content": doc, "metadata": meta or {}, "timestamp": timestamp})
+        return memories, encode_cursor(*page[-1]) if more else None
+
+    def find_text(self, text, types=None, name=COLLECTION_NAME):
+        """
+        Ids de los recuerdos que contienen `text` (sin distinguir mayúsculas) a partir
+        de un principio de palabra. El índice da los candidatos y solo esos se leen de
+        ChromaDB para confirmar la subcadena.
+        """
+        self.ensure_ready(name)
+        collection = self.collection(name)
+        needle = text.lower()
+        candidates = self.lexical.match(name, text, types=types)
+        if candidates is None:
+            # Sin palabras indexables (solo signos o palabras vacías): recorrido por páginas
+            where = type_filter(types)
+            pages, offset = [], 0
+            while True:
+                page = collection.get(include=["documents"], limit=REBUILD_PAGE, offset=offset,
+                                      **({"where": where} if where else {}))
+                pages.append(page)
+                offset += len(page["ids"])
+                if len(page["ids"]) < REBUILD_PAGE:
+                    break
+        else:
+            candidates = sorted(candidates)
+            pages = [collection.get(ids=candidates[i:i + REBUILD_PAGE], include=["documents"])
+                     for i in range(0, len(candidates), REBUILD_PAGE)]
+        return [doc_id for page in pages for doc_id, doc in zip(page["ids"], page["documents"])
+                if doc and needle in doc.lower()]
+
+    # --- Consulta híbrida ---
+
+    def hybrid_query(self, query, n_results=3, name=COLLECTION_NAME, candidates=HYBRID_CANDIDATES, types=None):
+        """
+        Fusiona por RRF los `candidates` mejores resultados vectoriales y BM25 de
+        `query` (solo entre los recuerdos de `types`, si se indican), y devuelve
+        `(resultados, tiempos)`. Cada resultado lleva `id`,
+        `document`, `metadata`, `distance` (None si solo lo encontró BM25), `bm25` y
+        `rrf`; los tiempos van en milisegundos.
+        """
+        return self.hybrid_query_many([query], n_results, name, candidates, types)[0]
+
+    def hybrid_query_many(self, queries, n_results=3, name=COLLECTION_NAME, candidates=HYBRID_CANDIDATES, types=None):
+        """
+        `hybrid_query()` de varias consultas a la vez (p. ej. un código DTC por
+        consulta): las búsquedas vectoriales van en un solo lote. Devuelve una lista
+        de `(resultados, tiempos)` en el orden de `queries`.
+        """
+        start = time.perf_counter()
+        collection = self.collection(name)
+        self.ensure_ready(name)
+        timings = [{} for _ in queries]
+
+        def lexical_search(i):
+            t = time.perf_counter()
+            hits = self.lexical.search(name, queries[i], candidates, types=types)
+            timings[i]["lexical_ms"] = round((time.perf_counter() - t) * 1000, 1)
+            return hits
+
+        # BM25 (SQLite) corre en paralelo con el embedding de las consultas y el HNSW
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="lexical")
+        lexical_futures = [self._pool.submit(lexical_search, i) for i in range(len(queries))]
+        t = time.perf_counter()
+        # El filtro de tipo va en la consulta (where): ChromaDB no trae los demás recuerdos
+        vector = self.query(list(queries), n_results=min(candidates, max(collection.count(), 1)), name=name,
+                            where=type_filter(types))
+        vector_ms = round((time.perf_counter() - t) * 1000, 1)
+
+        fused_by_query, found = [], {}
+        for i, future in enumerate(lexical_futures):
+            lexical_hits = future.result()
+            timings[i]["vector_ms"] = vector_ms
+            vector_ids = vector["ids"][i]
+            for rank, doc_id in enumerate(vector_ids):
+                found.setdefault(doc_id, {
+                    "id": doc_id,
+                    "document": vector["documents"][i][rank] if vector.get("documents") else None,
+                    "metadata": vector["metadatas"][i][rank] if vector.get("metadatas") else None,
+                    "bm25": None,
+                })
+            distances = dict(zip(vector_ids, vector["distances"][i])) if vector.get("distances") else {}
+            fused = rrf_fuse([vector_ids, [doc_id for doc_id, _ in lexical_hits]])[:n_results]
+            fused_by_query.append((fused, dict(lexical_hits), distances))
+
+        # Los aciertos solo léxicos se leen de ChromaDB (no están en la respuesta vectorial)
+        missing = list(dict.fromkeys(doc_id for fused, _, _ in fused_by_query for doc_id, _ in fused
+                                     if doc_id not in found))
+        if missing:
+            extra = collection.get(ids=missing, include=["documents", "metadatas"])
+            for i, doc_id in enumerate(extra["ids"]):
+                found[doc_id] = {"id": doc_id, "document": extra["documents"][i],
+                                 "metadata": extra["metadatas"][i], "bm25": None}
+
+        answers = []
+        total_ms = round((time.perf_counter() - start) * 1000, 1)
+        for (fused, bm25, distances), query_timings in zip(fused_by_query, timings):
+            results = []
+            for doc_id, score in fused:
+                if doc_id in found:
+                    results.append(dict(found[doc_id], distance=distances.get(doc_id),
+                                        bm25=round(bm25[doc_id], 3) if doc_id in bm25 else None,
+                                        rrf=round(score, 5)))
+            query_timings["total_ms"] = total_ms
+            answers.append((results, query_timings))
+
+        self.metrics["hybrid_queries"] += len(queries)
+        if total_ms > LATENCY_TARGET_MS:
+            self.metrics["slow_queries"] += len(queries)
+            print(f"⏱️  [MEMORY] Consulta híbrida en {total_ms}ms (objetivo {LATENCY_TARGET_MS:.0f}ms): "
+                  f"{len(queries)} consultas, {timings[0]}", file=sys.stderr)
+        return answers
+
+    async def ahybrid_query(self, query, n_results=3, name=COLLECTION_NAME, candidates=HYBRID_CANDIDATES, types=None):
+        """`hybrid_query()` para asyncio; las llamadas concurrentes comparten lote de embeddings."""
+        return await asyncio.to_thread(self.hybrid_query, query, n_results, name, candidates, types)
+
+    async def ahybrid_query_many(self, queries, n_results=3, name=COLLECTION_NAME, candidates=HYBRID_CANDIDATES, types=None):
+        """`hybrid_query_many()` para asyncio."""
+        return await asyncio.to_thread(self.hybrid_query_many, queries, n_results, name, candidates, types)
+
+    def stats(self):
+        """Métricas de arranque y contadores de la caché de embeddings."""
+        return dict(self.metrics, query_batches=self._batcher.stats(), embedding_cache=get_cache().stats())
+
+    def warmup(self, name=COLLECTION_NAME):
+        """
+        Abre cliente y colección, sincroniza el índice léxico y carga el modelo de
+        embeddings con un texto corto.
+        Devuelve los segundos empleados (queda también en `metrics["warmup_s"]`).
+        """
+        start = time.perf_counter()
+        collection = self.collection(name)
+        try:
+            self.ensure_ready(name)
+        except Exception as e:
+            # Las consultas híbridas lo reintentarán; el arranque no debe caerse por el índice
+            print(f"⚠️  [MEMORY] No se pudo sincronizar el índice léxico: {e}", file=sys.stderr)
+        embedding_function = getattr(collection, "_embedding_function", None)
+        if embedding_function is not None:
+            try:
+                embedding_function(["warmup"])
+            except Exception as e:
+                # Sin modelo descargado (p. ej. sin red) las consultas fallarán igual; no es fatal aquí
+                print(f"⚠️  [MEMORY] No se pudo precargar el modelo de embeddings: {e}", file=sys.stderr)
+        elapsed = time.perf_counter() - start
+        self.metrics["warmup_s"] = round(elapsed, 4)
+        return elapsed
+
+
+_SERVICES = {}
+_SERVICES_LOCK = threading.Lock()
+
+
+def get_service(db_path=None):
+    """Devuelve el servicio compartido para `db_path` (rutas relativas según el directorio actual)."""
+    key = os.path.abspath(db_path or DEFAULT_DB_PATH)
+    with _SERVICES_LOCK:
+        service = _SERVICES.get(key)
+        if service is None:
+            service = _SERVICES[key] = MemoryService(key)
+        return service
+
+
+def get_collection(db_path=None, name=COLLECTION_NAME):
+    """Atajo para `get_service(db_path).collection(name)`."""
+    return get_service(db_path).collection(name)
@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+"""
+Servidor LLM simulado, compatible con OpenAI/Groq y Anthropic.
+
+Responde en local a `POST .../chat/completions` (formato OpenAI, también Groq) y
+`POST .../messages` (formato Anthropic) con un eco del último mensaje del
+usuario, en SSE si la petición lleva `"stream": true`. Sirve para probar el
+transporte HTTP sin red ni claves reales: keep-alive (cuenta las conexiones TCP
+abiertas), reintentos (se le pueden inyectar respuestas 429/5xx), streaming y
+latencia artificial.
+
+Uso manual:
+    python execution/mock_llm_server.py --port 8099
+    OPENAI_BASE_URL=http://127.0.0.1:8099/v1 OPENAI_API_KEY=x \\
+        python execution/chat_with_llm.py --prompt "hola" --provider openai
+"""
+import argparse
+import json
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class MockLLMServer:
+    """
+    Servidor simulado en un hilo propio. Con `port=0` el sistema elige un puerto libre.
+
+    `fail_next(status, count)` hace que las próximas `count` peticiones respondan
+    `status`; `delay` añade latencia (segundos) a cada respuesta y `stream_delay`
+    entre eventos cuando la petición pide `"stream": true`.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, delay=0.0, stream_delay=0.0):
+        self.delay = delay
+        self.stream_delay = stream_delay
+        self.requests = []
+        self.connections = 0
+        self._failures = deque()
+        self._lock = threading.Lock()
+        self._thread = None
+
+        self.httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self.httpd.daemon_threads = True
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def fail_next(self, status, count=1, retry_after=None):
+        with self._lock:
+            self._failures.extend([(status, retry_after)] * count)
+
+    def _next_failure(self):
+        with self._lock:
+            return self._failures.popleft() if self._failures else None
+
+    def reply_text(self, payload):
+        """Eco del último mensaje del usuario."""
+        for message in reversed(payload.get("messages", [])):
+            if message.get("role") == "user":
+                return f"eco: {message.get('content', '')}"
+        return "eco:"
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # HTTP/1.1 para que el cliente pueda reutilizar la conexión
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                super().setup()
+                with server._lock:
+                    server.connections += 1
+
+            def _send_json(self, code, body, extra_headers=None):
+                data = json.dumps(body).encode("utf-8")
+                self.send_response(code)
+                self.send_header("Content-Type", "application/json")
+                for name, value in (extra_headers or {}).items():
+                    self.send_header(name, value)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _send_chunk(self, data):
+                self.wfile.write(f"{len(data):X}\r\n".encode() + data + b"\r\n")
+                self.wfile.flush()
+
+            def _send_stream(self, text):
+                """Respuesta SSE (chunked) con una palabra por evento, en el formato de cada API."""
+                anthropic = self.path.endswith("/messages")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+
+                words = text.split(" ")
+                deltas = [w if i == 0 else " " + w for i, w in enumerate(words)]
+                if anthropic:
+                    events = [("message_start", {"type": "message_start", "message": {"id": "mock-1", "role": "assistant"}})]
+                    events += [("content_block_delta", {"type": "content_block_delta", "index": 0,
+                                                        "delta": {"type": "text_delta", "text": d}}) for d in deltas]
+                    events.append(("message_stop", {"type": "message_stop"}))
+                    body = [f"event: {name}\ndata: {json.dumps(data)}\n\n" for name, data in events]
+                else:
+                    body = [f"data: {json.dumps({'choices': [{'index': 0, 'delta': {'content': d}}]})}\n\n" for d in deltas]
+                    body.append("data: [DONE]\n\n")
+
+                for event in body:
+                    self._send_chunk(event.encode("utf-8"))
+                    if server.stream_delay:
+                        time.sleep(server.stream_delay)
+                self.wfile.write(b"0\r\n\r\n")
+                self.wfile.flush()
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                try:
+                    payload = json.loads(self.rfile.read(length) or b"{}")
+                except ValueError:
+                    return self._send_json(400, {"error": {"message": "JSON inválido"}})
+                with server._lock:
+                    server.requests.append({"path": self.path, "headers": dict(self.headers), "json": payload})
+
+                if server.delay:
+                    time.sleep(server.delay)
+
+                failure = server._next_failure()
+                if failure:
+                    status, retry_after = failure
+                    headers = {"Retry-After": str(retry_after)} if retry_after is not None else None
+                    return self._send_json(status, {"error": {"message": f"fallo simulado {status}"}}, headers)
+
+                text = server.reply_text(payload)
+                if payload.get("stream"):
+                    return self._send_stream(text)
+                if self.path.endswith("/chat/completions"):
+                    return self._send_json(200, {
+                        "id": "mock-1",
+                        "object": "chat.completion",
+                        "model": payload.get("model"),
+                        "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+                    })
+                if self.path.endswith("/messages"):
+                    return self._send_json(200, {
+                        "id": "mock-1",
+                        "type": "message",
+                        "role": "assistant",
+                        "model": payload.get("model"),
+                        "content": [{"type": "text", "text": text}],
+                        "stop_reason": "end_turn",
+                    })
+                return self._send_json(404, {"error": {"message": f"Ruta desconocida: {self.path}"}})
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name="mock-llm", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        if self._thread:
+            self._thread.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Servidor LLM simulado (OpenAI/Groq/Anthropic) para pruebas locales.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--delay", type=float, default=0.0, help="Latencia artificial por respuesta (segundos).")
+    args = parser.parse_args()
+
+    server = MockLLMServer(args.host, args.port, args.delay)
+    print(json.dumps({"status": "running", "base_url": server.base_url}))
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.httpd.server_close()
+
+
+if __name__ == "__main__":
+    main()
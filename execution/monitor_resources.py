@@ -12,12 +12,15 @@ except ImportError:
     sys.exit(1)
 
 
-def main():
+def build_parser():
     parser = argparse.ArgumentParser(description="Monitorear uso de CPU y Memoria.")
     parser.add_argument("--cpu-threshold", type=float, default=85.0, help="Umbral de alerta para CPU (%)")
     parser.add_argument("--mem-threshold", type=float, default=85.0, help="Umbral de alerta para Memoria (%)")
-    args = parser.parse_args()
+    return parser
+
 
+def run(args):
+    """Mide CPU, memoria y disco y devuelve métricas y alertas como diccionario."""
     # Medir CPU (requiere un pequeño intervalo para ser preciso)
     cpu_usage = psutil.cpu_percent(interval=1)
 
@@ -53,10 +56,15 @@ def main():
         "alerts": alerts
     }
 
+    return result
+
+
+def main():
+    result = run(build_parser().parse_args())
     print(json.dumps(result, indent=2))
 
     # Salir con error si hay alertas para que el orquestador lo note
-    if alerts:
+    if result["alerts"]:
         sys.exit(1)
 
 
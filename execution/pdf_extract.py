@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+Motor compartido de extracción de texto de PDFs.
+
+`pypdf` es CPU-bound y de un solo hilo. Este módulo reparte rangos de páginas
+entre los núcleos con un `ProcessPoolExecutor` (creado una vez y reutilizado),
+devuelve las páginas en orden y guarda el texto extraído en `.tmp/pdf_text_cache/`
+bajo el hash del archivo, así que un mismo manual nunca se analiza dos veces.
+Lo usan `ingest_manual.py`, `translate_text.py` y el listener de Telegram.
+"""
+import hashlib
+import json
+import multiprocessing
+import os
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    from pypdf import PdfReader
+except ImportError:
+    PdfReader = None
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CACHE_DIR = os.path.join(PROJECT_ROOT, ".tmp", "pdf_text_cache")
+
+# Por debajo de este número de páginas no compensa repartir el trabajo entre procesos
+PARALLEL_MIN_PAGES = 16
+PAGES_PER_TASK = 8
+
+_POOL = None
+_POOL_LOCK = threading.Lock()
+
+
+def file_hash(path):
+    """Hash SHA-256 del archivo, leído por bloques."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _extract_range(path, start, end):
+    """Extrae las páginas [start, end) (base 0). Se ejecuta en un proceso del pool."""
+    reader = PdfReader(path)
+    return [reader.pages[i].extract_text() or "" for i in range(start, end)]
+
+
+def _get_pool():
+    global _POOL
+    with _POOL_LOCK:
+        if _POOL is None:
+            # "spawn": el listener es multihilo y hacer fork con hilos activos puede bloquear
+            _POOL = ProcessPoolExecutor(max_workers=os.cpu_count() or 1,
+                                        mp_context=multiprocessing.get_context("spawn"))
+        return _POOL
+
+
+def page_count(path):
+    return len(PdfReader(path).pages)
+
+
+def _iter_extracted(path, start_page, total):
+    """Genera el texto de cada página desde `start_page` (base 1), en orden."""
+    if total - start_page + 1 < PARALLEL_MIN_PAGES or (os.cpu_count() or 1) < 2:
+        reader = PdfReader(path)
+        for i in range(start_page - 1, total):
+            yield reader.pages[i].extract_text() or ""
+        return
+
+    pool = _get_pool()
+    ranges = deque((i, min(i + PAGES_PER_TASK, total)) for i in range(start_page - 1, total, PAGES_PER_TASK))
+    in_flight = deque()
+    # Ventana acotada de rangos en curso: orden garantizado y memoria constante
+    max_in_flight = 2 * (os.cpu_count() or 1)
+    while ranges or in_flight:
+        while ranges and len(in_flight) < max_in_flight:
+            in_flight.append(pool.submit(_extract_range, path, *ranges.popleft()))
+        for text in in_flight.popleft().result():
+            yield text
+
+
+def iter_pages(path, start_page=1, digest=None):
+    """
+    Genera (número de página, texto) desde `start_page`, en orden.
+    Si el archivo ya se extrajo antes (mismo hash), el texto sale de la caché.
+    `digest` evita recalcular el hash si quien llama ya lo tiene.
+    """
+    if PdfReader is None:
+        raise RuntimeError("Librería 'pypdf' no instalada. Ejecuta: pip install pypdf")
+
+    cache_file = os.path.join(CACHE_DIR, f"{digest or file_hash(path)}.jsonl")
+    if os.path.exists(cache_file):
+        with open(cache_file, 'r', encoding='utf-8') as f:
+            for number, line in enumerate(f, start=1):
+                if number >= start_page:
+                    yield number, json.loads(line)
+        return
+
+    total = page_count(path)
+    # Solo una extracción completa alimenta la caché; se publica al terminar (rename atómico)
+    tmp_file = f"{cache_file}.{os.getpid()}.{threading.get_ident()}.tmp" if start_page == 1 else None
+    out = None
+    if tmp_file:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        out = open(tmp_file, 'w', encoding='utf-8')
+    completed = False
+    try:
+        for number, text in enumerate(_iter_extracted(path, start_page, total), start=start_page):
+            if out:
+                out.write(json.dumps(text, ensure_ascii=False) + "\n")
+            yield number, text
+        completed = True
+    finally:
+        if out:
+            out.close()
+            if completed:
+                os.replace(tmp_file, cache_file)
+            else:
+                os.remove(tmp_file)
+
+
+def extract_pages(path):
+    """Lista con el texto de todas las páginas, en orden."""
+    return [text for _, text in iter_pages(path)]
+
+
+def extract_text(path):
+    """Texto completo del PDF, con las páginas separadas por saltos de línea."""
+    return "\n".join(extract_pages(path))
+
@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+"""
+Presupuesto de tokens por proveedor/modelo.
+
+El listener cortaba los PDF a 15000 caracteres (y las webs o archivos a 10000)
+sin mirar el modelo, y `translate_text.py`/`explain_code.py` enviaban el archivo
+entero. Un prompt demasiado grande lo rechaza el proveedor y la petición recorre
+toda la cadena de respaldo fallando en cada uno. Este módulo:
+
+- Cuenta tokens con `tiktoken` si está instalado (o ~4 caracteres por token).
+- Calcula el límite de entrada de cada proveedor/modelo: ventana del modelo menos
+  la salida reservada, acotado por `LLM_MAX_INPUT_TOKENS` (y
+  `LLM_MAX_INPUT_TOKENS_<PROVEEDOR>`; Groq en el plan gratuito admite ~6000
+  tokens por minuto, menos que su ventana).
+- `plan()` decide si el contenido cabe, se trunca o se parte, e informa cuántos
+  tokens usa cada parte del prompt (sistema, memoria, historial, contenido...).
+"""
+import os
+import re
+import sys
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+from chunker import estimate_tokens
+
+# (prefijo del modelo, ventana de contexto, salida máxima)
+MODEL_LIMITS = [
+    ("gpt-4o", 128000, 16384),
+    ("claude-3", 200000, 8192),
+    ("gemini", 1048576, 8192),
+    ("llama-3", 131072, 32768),
+]
+PROVIDER_LIMITS = {
+    "openai": (128000, 16384),
+    # chat_anthropic pide max_tokens=1024: no se puede esperar más salida por llamada
+    "anthropic": (200000, 1024),
+    "gemini": (1048576, 8192),
+    "groq": (131072, 8192),
+}
+# Tokens por petición (prompt + respuesta) que admite el plan, si es menor que la ventana
+PROVIDER_CAPS = {"groq": 6000}
+API_KEYS = {"groq": "GROQ_API_KEY", "gemini": "GOOGLE_API_KEY", "openai": "OPENAI_API_KEY", "anthropic": "ANTHROPIC_API_KEY"}
+
+# Tope de coste por petición aunque el modelo admita más (y, en modo aislado, el prompt
+# viaja como argumento de línea de comandos: Linux no admite uno de más de 128 KB)
+MAX_INPUT_TOKENS = int(os.getenv("LLM_MAX_INPUT_TOKENS", "24000"))
+OUTPUT_RESERVE = 1024
+# Margen para el error de la estimación (sobre todo sin tiktoken)
+SAFETY = 0.9
+# Lo que chat_with_llm añade a un prompt: instrucción del sistema, contexto de memoria
+# (reranker.py lo ajusta a este tamaño) y el resumen del historial
+CHAT_OVERHEAD = {"system": 200, "memory": 1000, "history": 400}
+TRUNCATION_MARK = "\n... (truncado)"
+
+_ENCODING = None
+
+
+def _encoding():
+    global _ENCODING
+    if _ENCODING is None:
+        try:
+            _ENCODING = tiktoken.get_encoding("cl100k_base")
+        except Exception:
+            # Sin red la primera vez no se puede descargar el vocabulario
+            _ENCODING = False
+    return _ENCODING
+
+
+def count_tokens(text):
+    """Tokens de `text`: cl100k de tiktoken si está disponible (aproximado para no-OpenAI)."""
+    if not text:
+        return 0
+    if tiktoken is not None and _encoding():
+        return len(_ENCODING.encode(text, disallowed_special=()))
+    return estimate_tokens(text)
+
+
+def model_limits(provider, model=None):
+    """`(ventana, salida máxima)` del modelo, o los valores por defecto del proveedor."""
+    default = PROVIDER_LIMITS.get(provider, (32000, 4096))
+    for prefix, context, output in MODEL_LIMITS:
+        if model and model.startswith(prefix):
+            return context, min(output, default[1])
+    return default
+
+
+def input_limit(provider, model=None, reserve=OUTPUT_RESERVE):
+    """Tokens de entrada que admite una petición a `provider`/`model` dejando `reserve` para la respuesta."""
+    context, _ = model_limits(provider, model)
+    cap = os.getenv(f"LLM_MAX_INPUT_TOKENS_{(provider or '').upper()}")
+    cap = int(cap) if cap else PROVIDER_CAPS.get(provider)
+    limit = context - reserve
+    if cap:
+        limit = min(limit, cap - reserve)
+    return int(min(limit, MAX_INPUT_TOKENS) * SAFETY)
+
+
+def output_limit(provider, model=None):
+    return model_limits(provider, model)[1]
+
+
+def configured_providers():
+    return [p for p, var in API_KEYS.items() if (os.getenv(var) or "").strip()]
+
+
+def chain_limit(reserve=OUTPUT_RESERVE):
+    """Límite del proveedor más pequeño configurado: cualquiera de la cadena de respaldo acepta el prompt."""
+    limits = [input_limit(p, reserve=reserve) for p in configured_providers()]
+    return min(limits) if limits else input_limit(None, reserve=reserve)
+
+
+def truncate_to_tokens(text, max_tokens):
+    """Corta `text` a unos `max_tokens`, preferentemente en un salto de línea, y añade la marca de truncado."""
+    if count_tokens(text) <= max_tokens:
+        return text
+    budget = max(max_tokens - count_tokens(TRUNCATION_MARK), 1)
+    cut = int(len(text) * budget / count_tokens(text))
+    while cut > 0 and count_tokens(text[:cut]) > budget:
+        cut = int(cut * 0.95)
+    newline = text.rfind("\n", 0, cut)
+    if newline > cut * 0.8:
+        cut = newline
+    return text[:cut] + TRUNCATION_MARK
+
+
+def split_to_tokens(text, max_tokens):
+    """
+    Parte `text` en trozos de hasta `max_tokens` por párrafos (o líneas, o caracteres
+    si una línea no cabe). Concatenar los trozos devuelve exactamente `text`.
+    """
+    max_tokens = max(max_tokens, 1)
+    units = []
+    for para in re.split(r"(?<=\n\n)", text):
+        if count_tokens(para) <= max_tokens:
+            units.append(para)
+            continue
+        for line in para.splitlines(keepends=True):
+            tokens = count_tokens(line)
+            if tokens <= max_tokens:
+                units.append(line)
+                continue
+            step = max(int(len(line) * max_tokens / tokens * SAFETY), 1)
+            units.extend(line[i:i + step] for i in range(0, len(line), step))
+
+    parts, current, used = [], "", 0
+    for unit in units:
+        tokens = count_tokens(unit)
+        if current and used + tokens > max_tokens:
+            parts.append(current)
+            current, used = "", 0
+        current += unit
+        used += tokens
+    if current:
+        parts.append(current)
+    return parts
+
+
+def plan(payload, provider=None, model=None, reserve=OUTPUT_RESERVE, mode="truncate", max_part=None, **fixed):
+    """
+    Reparte el presupuesto entre las partes fijas del prompt (`fixed`: texto o tokens
+    ya contados, p. ej. `system=`, `memory=`, `history=`, `template=`) y el contenido
+    variable `payload`.
+
+    Sin `provider` se usa el límite más estricto de los proveedores configurados.
+    `mode` indica qué hacer si no cabe: "truncate" o "split" (`max_part` acota
+    además cada trozo, p. ej. a la salida máxima al traducir). Devuelve un dict con
+    `action` ("fit" | "truncate" | "split"), `parts`, `limit`, `available` y `usage`.
+    """
+    limit = input_limit(provider, model, reserve) if provider else chain_limit(reserve)
+    usage = {name: value if isinstance(value, int) else count_tokens(value) for name, value in fixed.items()}
+    # Siempre queda algo para el contenido, aunque las partes fijas se coman el límite
+    available = max(limit - sum(usage.values()), limit // 4)
+    if max_part:
+        available = min(available, max_part)
+
+    payload_tokens = count_tokens(payload)
+    if payload_tokens <= available:
+        action, parts = "fit", [payload]
+    elif mode == "split":
+        action, parts = "split", split_to_tokens(payload, available)
+    else:
+        action, parts = "truncate", [truncate_to_tokens(payload, available)]
+    usage["payload"] = payload_tokens if action != "truncate" else count_tokens(parts[0])
+    return {
+        "action": action,
+        "parts": parts,
+        "provider": provider,
+        "model": model,
+        "limit": limit,
+        "available": available,
+        "payload_tokens": payload_tokens,
+        "usage": usage,
+    }
+
+
+def describe(budget):
+    """Resumen de una línea para los logs."""
+    usage = ", ".join(f"{name} {tokens}" for name, tokens in budget["usage"].items())
+    action = {"fit": "cabe", "truncate": "truncado", "split": f"partido en {len(budget['parts'])}"}[budget["action"]]
+    return f"{action}: {budget['payload_tokens']} tokens de contenido, límite {budget['limit']} ({usage})"
+
+
+def fit_prompt(template, payload, provider=None, model=None, reserve=OUTPUT_RESERVE, **fixed):
+    """
+    Inserta `payload` en el marcador `{payload}` de `template`, truncándolo si el
+    prompt completo no cabe. Devuelve `(prompt, plan)`.
+    """
+    fixed["template"] = template.replace("{payload}", "")
+    budget = plan(payload, provider, model, reserve, mode="truncate", **fixed)
+    if budget["action"] != "fit":
+        print(f"📏 [BUDGET] {describe(budget)}", file=sys.stderr)
+    return template.replace("{payload}", budget["parts"][0]), budget
+
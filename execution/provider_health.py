@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+"""
+Registro persistente de salud de los proveedores LLM.
+
+Por cada proveedor/modelo guarda en `.tmp/provider_health.json` la tasa de
+éxito (media móvil), los errores por clase (auth, quota, 5xx, timeout, other) y
+un histograma de latencias de las respuestas válidas (p50/p90/p99). Encima de
+eso mantiene un circuit breaker:
+
+- closed: se usa con normalidad.
+- open: tras `LLM_BREAKER_FAILURES` fallos seguidos (o un error de credenciales)
+  se salta durante un tiempo de enfriamiento que se duplica en cada recaída.
+- half_open: vencido el enfriamiento, una sola petición de prueba decide si se
+  cierra o vuelve a abrirse.
+
+`order()` reordena los proveedores por salud y velocidad (latencia esperada
+entre tasa de éxito) y deja fuera los que tienen el circuito abierto; solo
+consulta el estado. La plaza de prueba la toma `allow()` cuando
+`provider_hedging.hedged_call` lanza de verdad al proveedor, y `release()` la
+devuelve si la llamada se cancela (perdió la carrera o esperó cupo local). El
+registro también sirve de fuente de retrasos para `hedged_call`.
+
+Como script muestra el estado:
+    python execution/provider_health.py [--reset]
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import threading
+import time
+
+# Añadir el directorio actual al path para importar provider_hedging
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from provider_hedging import BUCKETS, DEFAULT_DELAY, MIN_SAMPLES, bucket_index, clamp_delay, percentile
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_HEALTH_PATH = os.path.join(PROJECT_ROOT, ".tmp", "provider_health.json")
+
+FAILURE_THRESHOLD = int(os.getenv("LLM_BREAKER_FAILURES", "3"))
+BASE_COOLDOWN = float(os.getenv("LLM_BREAKER_COOLDOWN", "30"))
+MAX_COOLDOWN = 900.0
+AUTH_COOLDOWN = 600.0
+# Si la petición de prueba no termina en este tiempo, se permite otra
+PROBE_TIMEOUT = 60.0
+# Peso de cada resultado en la media móvil de la tasa de éxito
+EWMA_ALPHA = 0.2
+
+ERROR_PATTERNS = [
+    ("auth", re.compile(r"\b40[13]\b|unauthori[sz]ed|forbidden|invalid.{0,20}(api.?key|x-api-key)|api.?key not valid|Falta \w+_API_KEY", re.IGNORECASE)),
+    ("quota", re.compile(r"\b429\b|quota|rate.?limit|resource.?exhausted|too many requests", re.IGNORECASE)),
+    ("timeout", re.compile(r"timed? ?out|timeout|deadline", re.IGNORECASE)),
+    ("5xx", re.compile(r"\b5\d\d\b|server error|service unavailable|bad gateway|overloaded", re.IGNORECASE)),
+]
+
+
+def classify_error(message):
+    """Clase del error a partir del mensaje que devuelve el proveedor."""
+    for name, pattern in ERROR_PATTERNS:
+        if pattern.search(message or ""):
+            return name
+    return "other"
+
+
+def _new_entry():
+    return {
+        "ok": 0,
+        "fail": 0,
+        "success_rate": 1.0,
+        "errors": {},
+        "latency": [0] * (len(BUCKETS) + 1),
+        "consecutive_failures": 0,
+        "state": "closed",
+        "opened_at": 0.0,
+        "cooldown": BASE_COOLDOWN,
+        "probe_at": 0.0,
+    }
+
+
+class ProviderHealth:
+    """Estado de salud por clave `proveedor/modelo`, compartido por el proceso y guardado en disco."""
+
+    def __init__(self, path=DEFAULT_HEALTH_PATH, clock=time.time):
+        self.path = path
+        self.clock = clock
+        self._lock = threading.Lock()
+        self.entries = {}
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get("buckets") == BUCKETS:
+                self.entries = data.get("providers", {})
+        except (OSError, ValueError):
+            pass
+
+    def _entry(self, key):
+        return self.entries.setdefault(key, _new_entry())
+
+    def _save(self):
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp_path = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({"buckets": BUCKETS, "providers": self.entries}, f, indent=1)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            print(f"⚠️  [HEALTH] No se pudo guardar el registro de salud: {e}", file=sys.stderr)
+
+    # --- Resultados (interfaz de estadísticas de hedged_call) ---
+
+    def record(self, key, seconds):
+        """Respuesta válida: cierra el circuito y alimenta el histograma de latencia."""
+        with self._lock:
+            entry = self._entry(key)
+            entry["ok"] += 1
+            entry["success_rate"] += EWMA_ALPHA * (1.0 - entry["success_rate"])
+            entry["latency"][bucket_index(seconds)] += 1
+            entry["consecutive_failures"] = 0
+            if entry["state"] != "closed":
+                print(f"✅ [HEALTH] '{key}' vuelve a responder. Circuito cerrado.", file=sys.stderr)
+            entry.update(state="closed", cooldown=BASE_COOLDOWN, probe_at=0.0)
+            self._save()
+
+    def record_failure(self, key, error):
+        """Error del proveedor: cuenta la clase y abre el circuito si toca."""
+        if (error or "").startswith(("Cancelado", "Limitado")):
+            # Perdió la carrera del hedging o esperó cupo local: no es un fallo del proveedor,
+            # y si era la prueba del half_open, la prueba no llegó a hacerse
+            self.release(key)
+            return
+        error_class = classify_error(error)
+        with self._lock:
+            entry = self._entry(key)
+            entry["fail"] += 1
+            entry["success_rate"] -= EWMA_ALPHA * entry["success_rate"]
+            entry["errors"][error_class] = entry["errors"].get(error_class, 0) + 1
+            entry["consecutive_failures"] += 1
+
+            now = self.clock()
+            if entry["state"] == "half_open":
+                # Falló la prueba: reabrir con el doble de enfriamiento
+                entry["cooldown"] = min(entry["cooldown"] * 2, MAX_COOLDOWN)
+                self._open(key, entry, now)
+            elif error_class == "auth":
+                entry["cooldown"] = max(entry["cooldown"], AUTH_COOLDOWN)
+                self._open(key, entry, now)
+            elif entry["state"] == "closed" and entry["consecutive_failures"] >= FAILURE_THRESHOLD:
+                self._open(key, entry, now)
+            self._save()
+
+    def _open(self, key, entry, now):
+        entry.update(state="open", opened_at=now, probe_at=0.0)
+        print(f"🔌 [HEALTH] Circuito abierto para '{key}' durante {entry['cooldown']:.0f}s.", file=sys.stderr)
+
+    # --- Enrutado ---
+
+    def available(self, key):
+        """¿Se podría llamar a `key` ahora? Solo consulta: no toma la plaza de prueba."""
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is None or entry["state"] == "closed":
+                return True
+            now = self.clock()
+            if entry["state"] == "open":
+                return now - entry["opened_at"] >= entry["cooldown"]
+            return now - entry["probe_at"] >= PROBE_TIMEOUT
+
+    def allow(self, key):
+        """
+        Se va a llamar a `key`: ¿puede? Con el circuito abierto y el enfriamiento
+        vencido pasa a half_open y esta llamada es la prueba (solo una a la vez).
+        Lo llama `hedged_call` al lanzar el proveedor, no al ordenar la lista.
+        """
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is None or entry["state"] == "closed":
+                return True
+            now = self.clock()
+            if entry["state"] == "open":
+                if now - entry["opened_at"] < entry["cooldown"]:
+                    return False
+                entry.update(state="half_open", probe_at=now)
+                self._save()
+                return True
+            # half_open: solo si la prueba anterior se quedó colgada
+            if now - entry["probe_at"] >= PROBE_TIMEOUT:
+                entry["probe_at"] = now
+                return True
+            return False
+
+    def release(self, key):
+        """La prueba de `key` no llegó a hacerse (cancelada): otra llamada puede tomarla."""
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry["state"] == "half_open":
+                # El enfriamiento ya venció: vuelve a open y la siguiente llamada es la prueba
+                entry.update(state="open", probe_at=0.0)
+                self._save()
+
+    def score(self, key):
+        """Latencia esperada (p50 / tasa de éxito): menor es mejor."""
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return DEFAULT_DELAY
+            latency = percentile(entry["latency"], 0.5) if sum(entry["latency"]) >= MIN_SAMPLES else DEFAULT_DELAY
+            return latency / max(entry["success_rate"], 0.05)
+
+    def order(self, keys):
+        """
+        Ordena `keys` por salud y velocidad, sin los que tienen el circuito abierto.
+        Los empates conservan el orden recibido. Si todos están abiertos se devuelve
+        la lista original: es mejor intentarlo que no responder.
+        """
+        allowed = [key for key in keys if self.available(key)]
+        if not allowed:
+            return list(keys)
+        return sorted(allowed, key=self.score)
+
+    def hedge_delay(self, key):
+        """p90 de la clave como retraso de hedging (o el valor por defecto con pocas muestras)."""
+        with self._lock:
+            counts = list(self.entries.get(key, {}).get("latency", []))
+        if sum(counts) < MIN_SAMPLES:
+            return DEFAULT_DELAY
+        return clamp_delay(percentile(counts, 0.9))
+
+    def report(self):
+        """Resumen por clave: estado, tasa de éxito, errores y percentiles de latencia."""
+        with self._lock:
+            return {
+                key: {
+                    "state": entry["state"],
+                    "success_rate": round(entry["success_rate"], 3),
+                    "ok": entry["ok"],
+                    "fail": entry["fail"],
+                    "errors": dict(entry["errors"]),
+                    "p50_s": percentile(entry["latency"], 0.5),
+                    "p90_s": percentile(entry["latency"], 0.9),
+                    "p99_s": percentile(entry["latency"], 0.99),
+                }
+                for key, entry in sorted(self.entries.items())
+            }
+
+
+_HEALTH = None
+_HEALTH_LOCK = threading.Lock()
+
+
+def get_health():
+    """Registro compartido del proceso (el listener lo conserva entre mensajes)."""
+    global _HEALTH
+    with _HEALTH_LOCK:
+        if _HEALTH is None:
+            _HEALTH = ProviderHealth()
+        return _HEALTH
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Mostrar la salud registrada de los proveedores LLM.")
+    parser.add_argument("--reset", action="store_true", help="Borra el registro (cierra todos los circuitos).")
+    return parser
+
+
+def run(args):
+    health = get_health()
+    if args.reset:
+        with health._lock:
+            health.entries.clear()
+            health._save()
+        return {"status": "success", "message": "Registro de salud reiniciado."}
+    return {"status": "success", "providers": health.report()}
+
+
+def main():
+    print(json.dumps(run(build_parser().parse_args()), indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+"""
+Fallback de proveedores LLM con cobertura ("hedging").
+
+Antes se probaba un proveedor detrás de otro: uno colgado costaba su timeout
+completo antes de pasar al siguiente. `hedged_call` lanza el primero y, si no ha
+respondido cuando vence su p90 de latencia, lanza el siguiente en paralelo; gana
+la primera respuesta válida y al resto se le pide que se detenga (un
+`threading.Event` que los proveedores consultan entre fragmentos y reintentos).
+Un error rápido lanza el siguiente sin esperar.
+
+El p90 sale de histogramas de latencia por proveedor que sobreviven entre
+invocaciones del script: `chat_with_llm` usa los del registro de salud
+(`provider_health.py`); sin él se guardan en `.tmp/provider_latency.json`.
+"""
+import bisect
+import contextvars
+import json
+import os
+import queue
+import sys
+import threading
+import time
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_HISTOGRAM_PATH = os.path.join(PROJECT_ROOT, ".tmp", "provider_latency.json")
+
+# Límites superiores (s) de los cubos del histograma; el último cubo es "más de 32 s"
+BUCKETS = [0.25, 0.5, 1, 2, 3, 5, 8, 13, 21, 32]
+# Con menos muestras que esto no se confía en el p90 y se usa el retraso por defecto
+MIN_SAMPLES = 5
+DEFAULT_DELAY = float(os.getenv("LLM_HEDGE_DEFAULT_DELAY", "5"))
+MIN_DELAY = 0.5
+MAX_DELAY = float(os.getenv("LLM_HEDGE_MAX_DELAY", "15"))
+
+
+def bucket_index(seconds):
+    return bisect.bisect_left(BUCKETS, seconds)
+
+
+def percentile(counts, q):
+    """Percentil `q` (0-1) de un histograma con los cubos de BUCKETS, o None si está vacío."""
+    total = sum(counts)
+    if not total:
+        return None
+    target = q * total
+    cumulative = 0
+    for i, count in enumerate(counts):
+        cumulative += count
+        if cumulative >= target:
+            return BUCKETS[i] if i < len(BUCKETS) else MAX_DELAY
+    return MAX_DELAY
+
+
+def clamp_delay(seconds):
+    return min(max(seconds, MIN_DELAY), MAX_DELAY)
+
+
+class LatencyHistograms:
+    """Histogramas de latencia de respuestas válidas por proveedor, persistidos en JSON."""
+
+    def __init__(self, path=DEFAULT_HISTOGRAM_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self.counts = {}
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get("buckets") == BUCKETS:
+                self.counts = data.get("counts", {})
+        except (OSError, ValueError):
+            pass
+
+    def record(self, provider, seconds):
+        with self._lock:
+            counts = self.counts.setdefault(provider, [0] * (len(BUCKETS) + 1))
+            counts[bucket_index(seconds)] += 1
+            self._save()
+
+    def _save(self):
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({"buckets": BUCKETS, "counts": self.counts}, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            print(f"⚠️  [HEDGE] No se pudo guardar el histograma de latencias: {e}", file=sys.stderr)
+
+    def samples(self, provider):
+        with self._lock:
+            return sum(self.counts.get(provider, []))
+
+    def percentile(self, provider, q):
+        """Límite superior del cubo que contiene el percentil `q` (0-1), o None sin datos."""
+        with self._lock:
+            counts = list(self.counts.get(provider, []))
+        return percentile(counts, q)
+
+    def record_failure(self, provider, error):
+        """Los errores no cuentan: el histograma solo mide respuestas válidas."""
+
+    def hedge_delay(self, provider):
+        """Segundos a esperar al proveedor antes de lanzar el siguiente en paralelo."""
+        if self.samples(provider) < MIN_SAMPLES:
+            return DEFAULT_DELAY
+        return clamp_delay(self.percentile(provider, 0.9))
+
+
+_HISTOGRAMS = None
+_HISTOGRAMS_LOCK = threading.Lock()
+
+
+def get_histograms():
+    global _HISTOGRAMS
+    with _HISTOGRAMS_LOCK:
+        if _HISTOGRAMS is None:
+            _HISTOGRAMS = LatencyHistograms()
+        return _HISTOGRAMS
+
+
+def _is_success(result):
+    return isinstance(result, dict) and "content" in result and "error" not in result
+
+
+class _StreamArbiter:
+    """
+    Con varios proveedores en carrera solo uno puede escribir en `on_delta`: el
+    primero que emite texto. Si ese falla, lo mostrado se descarta (`on_delta(None)`)
+    y el siguiente que emita toma el relevo enviando lo que ya llevaba acumulado.
+    """
+
+    def __init__(self, on_delta, cancel):
+        self.on_delta = on_delta
+        self.cancel = cancel
+        self.owner = None
+        self.texts = {}
+        self._lock = threading.Lock()
+
+    def callback(self, provider):
+        def forward(delta):
+            with self._lock:
+                if self.cancel.is_set() and self.owner != provider:
+                    return
+                if delta is None:
+                    self.texts[provider] = []
+                    if self.owner == provider:
+                        self.owner = None
+                        self.on_delta(None)
+                    return
+                self.texts.setdefault(provider, []).append(delta)
+                if self.owner is None:
+                    self.owner = provider
+                    self.on_delta("".join(self.texts[provider]))
+                elif self.owner == provider:
+                    self.on_delta(delta)
+        return forward
+
+    def release(self, provider):
+        """El proveedor terminó con error: liberar la salida si era suyo."""
+        with self._lock:
+            self.texts.pop(provider, None)
+            if self.owner == provider:
+                self.owner = None
+                self.on_delta(None)
+
+    def settle(self, provider, content):
+        """Gana `provider`: si no era quien escribía, reemplazar lo mostrado por su respuesta."""
+        with self._lock:
+            if self.owner == provider:
+                return
+            if self.owner is not None:
+                self.on_delta(None)
+            self.owner = provider
+            self.on_delta(content)
+
+
+def hedged_call(providers, call, on_delta=None, hedge=True, stats=None):
+    """
+    Resuelve una petición con la lista ordenada `providers`.
+
+    `call(proveedor, on_delta, cancel)` debe devolver un dict con `content` o
+    `error`. Con `hedge=False` los proveedores se prueban de uno en uno (el
+    comportamiento anterior). `stats` da los retrasos y recibe los resultados
+    (`hedge_delay`, `record`, `record_failure`); por defecto, los histogramas de
+    latencia. Si además tiene `allow`/`release` (registro de salud), cada
+    proveedor se confirma justo antes de lanzarlo (un circuito en half_open solo
+    admite una prueba) y los que pierden la carrera devuelven su plaza.
+    Devuelve el resultado ganador con la clave `provider`, o el último error si
+    todos fallan.
+    """
+    stats = stats or get_histograms()
+    cancel = threading.Event()
+    arbiter = _StreamArbiter(on_delta, cancel) if on_delta else None
+    results = queue.Queue()
+    pending = list(providers)
+    running = []
+    allow = getattr(stats, "allow", lambda provider: True)
+    release = getattr(stats, "release", lambda provider: None)
+    started = []
+
+    def attempt(provider):
+        start = time.perf_counter()
+        try:
+            result = call(provider, arbiter.callback(provider) if arbiter else None, cancel)
+        except Exception as e:
+            print(f"⚠️ Excepción crítica en '{provider}': {e}. Intentando siguiente...", file=sys.stderr)
+            result = {"error": str(e)}
+        results.put((provider, result, time.perf_counter() - start))
+
+    def launch():
+        while pending:
+            provider = pending.pop(0)
+            # Si ninguno se ha podido lanzar, el último se intenta igual: mejor que no responder
+            if allow(provider) or (not started and not pending):
+                break
+            print(f"🔌 [HEDGE] '{provider}' no admite llamadas ahora (circuito abierto o prueba en curso). Se salta.", file=sys.stderr)
+        else:
+            return None
+        started.append(provider)
+        running.append(provider)
+        # Hilos daemon: un perdedor colgado no retrasa la salida del proceso
+        # copy_context: el hilo hereda la prioridad de la petición (ver rate_limiter.priority)
+        threading.Thread(target=contextvars.copy_context().run, args=(attempt, provider),
+                         name=f"llm-{provider}", daemon=True).start()
+        return provider
+
+    last_started = launch()
+    last_result = {"error": "No hay proveedores disponibles."}
+    while running:
+        timeout = stats.hedge_delay(last_started) if hedge and pending else None
+        try:
+            provider, result, elapsed = results.get(timeout=timeout)
+        except queue.Empty:
+            print(f"⏱️  [HEDGE] '{last_started}' supera su p90 ({timeout:.1f}s). Lanzando '{pending[0]}' en paralelo...", file=sys.stderr)
+            last_started = launch() or last_started
+            continue
+
+        running.remove(provider)
+        if _is_success(result):
+            cancel.set()
+            for loser in running:
+                # Cancelados: si eran la prueba de un circuito half_open, no llegó a hacerse
+                release(loser)
+            stats.record(provider, elapsed)
+            if arbiter:
+                arbiter.settle(provider, result["content"])
+            return dict(result, provider=provider)
+
+        stats.record_failure(provider, result.get("error", ""))
+        if arbiter:
+            arbiter.release(provider)
+        print(f"⚠️ Proveedor '{provider}' falló: {result.get('error', 'Error desconocido')}. Intentando siguiente...", file=sys.stderr)
+        last_result = result
+        if pending:
+            # Un error rápido no espera al p90: el siguiente arranca ya
+            last_started = launch() or last_started
+
+    return last_result
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Agrupa en lotes las peticiones que llegan a la vez.
+
+Cada consulta a la memoria calcula su embedding y lanza su propio
+`collection.query`, aunque ChromaDB acepta una lista de vectores y el modelo de
+embeddings procesa una lista igual de rápido que un texto. Con varios chats
+atendidos en paralelo (o varios códigos DTC en un mismo `/scan`), `QueryBatcher`
+junta las peticiones que llegan dentro de una ventana corta y las resuelve con
+una sola llamada a `run_batch(peticiones) -> resultados`.
+
+No usa un hilo propio: la primera petición de un lote (la "líder") espera la
+ventana, o a que el lote se llene, y ejecuta el lote en su hilo; las demás
+esperan su resultado. Si `run_batch` falla, todas las peticiones del lote
+reciben la excepción; si devuelve una excepción en el lugar de un resultado,
+solo la recibe esa petición.
+"""
+import threading
+
+
+class _Batch:
+    def __init__(self):
+        self.items = []
+        self.full = threading.Event()
+        self.done = threading.Event()
+        self.closed = False
+        self.results = None
+        self.error = None
+
+
+class QueryBatcher:
+    """Lotes de hasta `max_batch` peticiones llegadas dentro de `window_s` segundos."""
+
+    def __init__(self, run_batch, window_s=0.005, max_batch=32):
+        self.run_batch = run_batch
+        self.window_s = window_s
+        self.max_batch = max_batch
+        self._lock = threading.Lock()
+        self._open = None
+        self.metrics = {"requests": 0, "batches": 0, "largest_batch": 0}
+
+    def call(self, item):
+        """Resultado de `item`, resuelto junto a las peticiones concurrentes."""
+        return self.call_many([item])[0]
+
+    def call_many(self, items):
+        """Resultados de `items` (en orden); van en el mismo lote si caben."""
+        items = list(items)
+        results = [None] * len(items)
+        position = 0
+        while position < len(items):
+            with self._lock:
+                batch = self._open
+                leader = batch is None or batch.closed or len(batch.items) >= self.max_batch
+                if leader:
+                    batch = self._open = _Batch()
+                room = self.max_batch - len(batch.items)
+                chunk = items[position:position + room]
+                offset = len(batch.items)
+                batch.items.extend(chunk)
+                if len(batch.items) >= self.max_batch:
+                    batch.full.set()
+            if leader:
+                self._flush(batch)
+            batch.done.wait()
+            if batch.error is not None:
+                raise batch.error
+            results[position:position + len(chunk)] = batch.results[offset:offset + len(chunk)]
+            position += len(chunk)
+        for result in results:
+            if isinstance(result, Exception):
+                raise result
+        return results
+
+    def _flush(self, batch):
+        # Espera a que lleguen más peticiones (o a que el lote se llene) y lo cierra
+        if self.window_s > 0:
+            batch.full.wait(self.window_s)
+        with self._lock:
+            batch.closed = True
+            if self._open is batch:
+                self._open = None
+            size = len(batch.items)
+            self.metrics["requests"] += size
+            self.metrics["batches"] += 1
+            self.metrics["largest_batch"] = max(self.metrics["largest_batch"], size)
+        try:
+            results = list(self.run_batch(batch.items))
+            if len(results) != size:
+                raise RuntimeError(f"El lote devolvió {len(results)} resultados para {size} peticiones.")
+            batch.results = results
+        except Exception as e:
+            batch.error = e
+        finally:
+            batch.done.set()
+
+    def stats(self):
+        with self._lock:
+            batches = self.metrics["batches"]
+            return dict(self.metrics, avg_batch=round(self.metrics["requests"] / batches, 2) if batches else 0.0)
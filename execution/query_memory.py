@@ -9,32 +9,73 @@ except ImportError:
     print("Error: Missing 'chromadb'.", file=sys.stderr)
     sys.exit(10)
 
+from memory_service import get_service, parse_types
+from reranker import retrieve
 
-def main():
-    """
-    Queries the ChromaDB vector store for semantically similar memories.
-    """
+
+def build_parser():
     parser = argparse.ArgumentParser(description="Query agent memory.")
     parser.add_argument("--query", required=True, help="The question or topic to search for.")
     parser.add_argument("--n-results", type=int, default=3, help="Number of results to return.")
+    parser.add_argument("--mode", choices=["hybrid", "rerank", "vector"], default="hybrid",
+                        help="hybrid fuses vector and BM25 (exact codes, part numbers); rerank re-scores hybrid "
+                             "candidates with a relevance cutoff and token budget (as chat RAG does); vector is embeddings only.")
+    parser.add_argument("--types", type=parse_types,
+                        help="Comma-separated memory types to search (note, manual, fact). Default: all.")
     parser.add_argument("--db-path", default=".tmp/chroma_db", help="Path to ChromaDB.")
-    args = parser.parse_args()
+    return parser
 
+
+def run(args):
+    """
+    Queries agent memory: vector similarity fused with BM25 keyword hits (or vector only).
+    Returns the result as a dict; errors carry the CLI exit code.
+    """
     try:
-        client = chromadb.PersistentClient(path=args.db_path)
-        collection = client.get_or_create_collection(name="agent_memory")
+        service = get_service(args.db_path)
+        service.collection()
     except Exception as e:
-        print(json.dumps({"status": "error", "message": str(e)}), file=sys.stderr)
-        sys.exit(2)
+        return {"status": "error", "message": str(e), "exit_code": 2}
+
+    if args.mode == "rerank":
+        try:
+            items, report = retrieve(service, args.query, types=args.types, max_items=args.n_results)
+        except Exception as e:
+            return {"status": "error", "message": str(e), "exit_code": 3}
+        return {
+            "status": "success",
+            "query": args.query,
+            "results": [
+                {"content": r["document"], "metadata": r["metadata"], "relevance_distance": r["distance"],
+                 "score": r["score"]}
+                for r in items
+            ],
+            "report": report
+        }
+
+    if args.mode == "hybrid":
+        try:
+            results, timings = service.hybrid_query(args.query, n_results=args.n_results, types=args.types)
+        except Exception as e:
+            return {"status": "error", "message": str(e), "exit_code": 3}
+        return {
+            "status": "success",
+            "query": args.query,
+            "results": [
+                {"content": r["document"], "metadata": r["metadata"], "relevance_distance": r["distance"],
+                 "bm25": r["bm25"], "rrf": r["rrf"]}
+                for r in results
+            ],
+            "timings_ms": timings
+        }
 
     try:
-        results = collection.query(
-            query_texts=[args.query],
+        results = service.query(
+            [args.query],
             n_results=args.n_results
         )
     except Exception as e:
-        print(json.dumps({"status": "error", "message": str(e)}), file=sys.stderr)
-        sys.exit(3)
+        return {"status": "error", "message": str(e), "exit_code": 3}
 
     # Format results for easier reading by the LLM
     formatted_results = []
@@ -50,11 +91,20 @@ def main():
                 "relevance_distance": dist
             })
 
-    print(json.dumps({
+    return {
         "status": "success",
         "query": args.query,
         "results": formatted_results
-    }, indent=2))
+    }
+
+
+def main():
+    result = run(build_parser().parse_args())
+    if result["status"] == "error":
+        print(json.dumps({"status": "error", "message": result["message"]}), file=sys.stderr)
+        sys.exit(result["exit_code"])
+
+    print(json.dumps(result, indent=2))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+"""
+Limitador de peticiones por API key (lado cliente).
+
+Con varios chats a la vez se disparaban 429 de Groq/OpenAI, que el hedging y el
+registro de salud trataban como fallos y acababan en proveedores más lentos. Aquí
+cada API key tiene dos cubetas de fichas (token bucket) que se rellenan de forma
+continua: peticiones por minuto (RPM) y tokens por minuto (TPM), con los límites
+de `DEFAULT_LIMITS` o `LLM_RPM_<PROVEEDOR>` / `LLM_TPM_<PROVEEDOR>`.
+
+- Antes de cada petición `acquire()` espera a que haya fichas. Las esperas forman
+  una cola por prioridad: el chat interactivo pasa delante del trabajo de fondo
+  (map-reduce, resúmenes del historial, lotes), marcado con `priority(BACKGROUND)`.
+- `observe()` ajusta las cubetas con las cabeceras de la respuesta
+  (`x-ratelimit-remaining-*`/`x-ratelimit-reset-*` de OpenAI/Groq,
+  `anthropic-ratelimit-*` de Anthropic) y con `Retry-After` de un 429.
+- Si la espera estimada supera `LLM_RATE_MAX_WAIT`, la petición falla al momento
+  con un error "Limitado: ..." para que el hedging pruebe otro proveedor.
+
+El estado es del proceso (el listener atiende todos los chats en uno solo).
+"""
+import contextlib
+import contextvars
+import datetime
+import hashlib
+import heapq
+import itertools
+import os
+import re
+import threading
+import time
+
+from prompt_budget import count_tokens
+
+INTERACTIVE = 0
+BACKGROUND = 10
+_PRIORITY = contextvars.ContextVar("llm_priority", default=INTERACTIVE)
+
+# (RPM, TPM) de los planes de entrada de cada proveedor
+DEFAULT_LIMITS = {
+    "groq": (30, 6000),
+    "gemini": (15, 1000000),
+    "openai": (500, 200000),
+    "anthropic": (50, 40000),
+}
+MAX_WAIT = float(os.getenv("LLM_RATE_MAX_WAIT", "60"))
+# Tokens de respuesta que se suman a la estimación del prompt (cuentan para el TPM)
+EXPECTED_OUTPUT_TOKENS = 512
+# Cada cuánto revisa la cola un hilo en espera (para atender `cancel`)
+POLL_INTERVAL = 0.5
+
+DURATION_RE = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+HEADER_NAMES = {
+    # dimensión: (restantes, reinicio) en OpenAI/Groq y en Anthropic
+    "requests": (("x-ratelimit-remaining-requests", "x-ratelimit-reset-requests"),
+                 ("anthropic-ratelimit-requests-remaining", "anthropic-ratelimit-requests-reset")),
+    "tokens": (("x-ratelimit-remaining-tokens", "x-ratelimit-reset-tokens"),
+               ("anthropic-ratelimit-tokens-remaining", "anthropic-ratelimit-tokens-reset")),
+}
+
+
+@contextlib.contextmanager
+def priority(level):
+    """Marca las llamadas al LLM hechas dentro del bloque (y de los hilos del hedging) con `level`."""
+    token = _PRIORITY.set(level)
+    try:
+        yield
+    finally:
+        _PRIORITY.reset(token)
+
+
+def current_priority():
+    return _PRIORITY.get()
+
+
+def parse_reset(value, now=None):
+    """
+    Segundos hasta el reinicio: duraciones de OpenAI/Groq ("1s", "6m0s", "20ms"),
+    número de segundos o fecha RFC 3339 de Anthropic. None si no se entiende.
+    """
+    if value is None:
+        return None
+    value = value.strip()
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    parts = DURATION_RE.findall(value)
+    if parts and "".join(n + u for n, u in parts) == value:
+        scale = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+        return sum(float(n) * scale[u] for n, u in parts)
+    try:
+        moment = datetime.datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    return max(moment.timestamp() - (now if now is not None else time.time()), 0.0)
+
+
+def request_tokens(messages, system=None, output_tokens=EXPECTED_OUTPUT_TOKENS):
+    """Tokens que consumirá una petición: prompt estimado + respuesta esperada."""
+    return count_tokens(system) + sum(count_tokens(str(m.get("content", ""))) for m in messages) + output_tokens
+
+
+class KeyLimiter:
+    """Cubetas RPM/TPM de una API key con cola de espera por prioridad."""
+
+    def __init__(self, name, rpm, tpm, clock=time.monotonic, max_wait=MAX_WAIT):
+        self.name = name
+        self.rpm = rpm
+        self.tpm = tpm
+        self.clock = clock
+        self.max_wait = max_wait
+        self.levels = {"requests": float(rpm), "tokens": float(tpm)}
+        self.blocked_until = 0.0
+        self._updated = clock()
+        self._cond = threading.Condition()
+        self._queue = []  # (prioridad, orden de llegada)
+        self._order = itertools.count()
+        self.stats = {"granted": 0, "waited_s": 0.0, "throttled": 0, "rejected": 0}
+
+    def _refill(self, now):
+        elapsed = max(now - self._updated, 0.0)
+        self._updated = now
+        self.levels["requests"] = min(self.rpm, self.levels["requests"] + elapsed * self.rpm / 60.0)
+        self.levels["tokens"] = min(self.tpm, self.levels["tokens"] + elapsed * self.tpm / 60.0)
+
+    def _wait_for(self, tokens, now):
+        """Segundos hasta que haya fichas para la petición (0 si ya las hay)."""
+        wait = max(self.blocked_until - now, 0.0)
+        wait = max(wait, (1 - self.levels["requests"]) * 60.0 / self.rpm)
+        return max(wait, (tokens - self.levels["tokens"]) * 60.0 / self.tpm)
+
+    def acquire(self, tokens, level=None, cancel=None):
+        """
+        Espera turno y consume 1 petición y `tokens` tokens. Devuelve los segundos de
+        espera. Lanza RuntimeError si `cancel` se activa o si la espera supera `max_wait`.
+        """
+        tokens = min(tokens, self.tpm)  # una petición enorme no puede esperar para siempre
+        entry = (current_priority() if level is None else level, next(self._order))
+        start = self.clock()
+        with self._cond:
+            heapq.heappush(self._queue, entry)
+            try:
+                while True:
+                    now = self.clock()
+                    self._refill(now)
+                    wait = POLL_INTERVAL
+                    if self._queue[0] == entry:
+                        wait = self._wait_for(tokens, now)
+                        if wait <= 0:
+                            heapq.heappop(self._queue)
+                            self.levels["requests"] -= 1
+                            self.levels["tokens"] -= tokens
+                            waited = now - start
+                            self.stats["granted"] += 1
+                            self.stats["waited_s"] = round(self.stats["waited_s"] + waited, 3)
+                            self._cond.notify_all()
+                            return waited
+                    if cancel is not None and cancel.is_set():
+                        raise RuntimeError("Cancelado: otro proveedor respondió antes.")
+                    expected = now - start + (wait if self._queue[0] == entry else 0.0)
+                    if expected > self.max_wait:
+                        self.stats["rejected"] += 1
+                        raise RuntimeError(
+                            f"Limitado: {self.name} no tendrá cupo en {self.max_wait:.0f}s "
+                            f"(límite {self.rpm} peticiones y {self.tpm} tokens por minuto)."
+                        )
+                    self._cond.wait(min(wait, POLL_INTERVAL))
+            except BaseException:
+                if entry in self._queue:
+                    self._queue.remove(entry)
+                    heapq.heapify(self._queue)
+                self._cond.notify_all()
+                raise
+
+    def observe(self, headers, status=None):
+        """Ajusta las cubetas con las cabeceras de límite de la respuesta del proveedor."""
+        now = self.clock()
+        with self._cond:
+            self._refill(now)
+            for dimension, variants in HEADER_NAMES.items():
+                for remaining_name, reset_name in variants:
+                    remaining = headers.get(remaining_name)
+                    if remaining is None:
+                        continue
+                    try:
+                        remaining = float(remaining)
+                    except ValueError:
+                        continue
+                    # El servidor manda: si nos quedan menos fichas de las que creíamos, se ajusta
+                    self.levels[dimension] = min(self.levels[dimension], remaining)
+                    reset = parse_reset(headers.get(reset_name))
+                    if remaining < 1 and reset:
+                        self.blocked_until = max(self.blocked_until, now + reset)
+            if status == 429:
+                self.stats["throttled"] += 1
+                retry_after = parse_reset(headers.get("Retry-After") or headers.get("retry-after"))
+                self.blocked_until = max(self.blocked_until, now + (retry_after if retry_after is not None else 1.0))
+            self._cond.notify_all()
+
+    def report(self):
+        with self._cond:
+            self._refill(self.clock())
+            return dict(self.stats, rpm=self.rpm, tpm=self.tpm, queued=len(self._queue),
+                        requests_left=int(self.levels["requests"]), tokens_left=int(self.levels["tokens"]))
+
+
+_LIMITERS = {}
+_LIMITERS_LOCK = threading.Lock()
+
+
+def get_limiter(provider, api_key):
+    """Limitador compartido de la API key (la clave se identifica por su hash, nunca en claro)."""
+    name = f"{provider}:{hashlib.sha256((api_key or '').encode('utf-8')).hexdigest()[:8]}"
+    with _LIMITERS_LOCK:
+        limiter = _LIMITERS.get(name)
+        if limiter is None:
+            rpm, tpm = DEFAULT_LIMITS.get(provider, (60, 100000))
+            rpm = int(os.getenv(f"LLM_RPM_{provider.upper()}", rpm))
+            tpm = int(os.getenv(f"LLM_TPM_{provider.upper()}", tpm))
+            limiter = _LIMITERS[name] = KeyLimiter(name, rpm, tpm)
+        return limiter
+
+
+def report():
+    """Estado de todos los limitadores del proceso, por `proveedor:hash`."""
+    with _LIMITERS_LOCK:
+        limiters = list(_LIMITERS.values())
+    return {limiter.name: limiter.report() for limiter in limiters}
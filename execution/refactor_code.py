@@ -16,25 +16,26 @@ except ImportError:
     sys.exit(1)
 
 
-def main():
+def build_parser():
     parser = argparse.ArgumentParser(description="Refactorizar código usando LLM.")
     parser.add_argument("--file", required=True, help="Ruta del archivo a refactorizar.")
     parser.add_argument("--issues", required=True, help="Lista de problemas a corregir.")
-    args = parser.parse_args()
+    return parser
+
 
+def run(args):
+    """Refactoriza el archivo indicado para corregir `--issues` y devuelve el resultado como diccionario."""
     file_path = args.file
     issues = args.issues
 
     if not os.path.exists(file_path):
-        print(json.dumps({"status": "error", "message": f"Archivo no encontrado: {file_path}"}))
-        sys.exit(1)
+        return {"status": "error", "message": f"Archivo no encontrado: {file_path}"}
 
     try:
         with open(file_path, 'r', encoding='utf-8') as f:
             original_code = f.read()
     except Exception as e:
-        print(json.dumps({"status": "error", "message": f"Error leyendo archivo: {e}"}))
-        sys.exit(1)
+        return {"status": "error", "message": f"Error leyendo archivo: {e}"}
 
     prompt = f"""Actúa como un Ingeniero de Software Senior y experto en Python.
 Tu tarea es refactorizar el siguiente código para corregir los problemas reportados.
@@ -63,12 +64,10 @@ INSTRUCCIONES:
     elif os.getenv("GOOGLE_API_KEY"):
         response = chat_gemini(messages)
     else:
-        print(json.dumps({"status": "error", "message": "No se encontraron API Keys configuradas en .env"}))
-        sys.exit(1)
+        return {"status": "error", "message": "No se encontraron API Keys configuradas en .env"}
 
     if "error" in response:
-        print(json.dumps({"status": "error", "message": response["error"]}))
-        sys.exit(1)
+        return {"status": "error", "message": response["error"]}
 
     new_code = response.get("content", "")
 
@@ -87,16 +86,21 @@ INSTRUCCIONES:
     try:
         ast.parse(new_code)
     except SyntaxError as e:
-        print(json.dumps({"status": "error", "message": f"El código generado tiene errores de sintaxis y fue rechazado: {e}"}))
-        sys.exit(1)
+        return {"status": "error", "message": f"El código generado tiene errores de sintaxis y fue rechazado: {e}"}
 
     # Guardado
     try:
         with open(file_path, 'w', encoding='utf-8') as f:
             f.write(new_code)
-        print(json.dumps({"status": "success", "message": f"Archivo {file_path} refactorizado exitosamente."}))
+        return {"status": "success", "message": f"Archivo {file_path} refactorizado exitosamente."}
     except Exception as e:
-        print(json.dumps({"status": "error", "message": f"Error escribiendo archivo: {e}"}))
+        return {"status": "error", "message": f"Error escribiendo archivo: {e}"}
+
+
+def main():
+    result = run(build_parser().parse_args())
+    print(json.dumps(result))
+    if result.get("status") == "error":
         sys.exit(1)
 
 
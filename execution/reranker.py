@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+"""
+Segunda etapa del RAG: re-puntuar candidatos, cortar por relevancia y ajustar a tokens.
+
+`get_memory_context()` inyectaba los 3 primeros de la búsqueda híbrida sin
+umbral: aunque la memoria no tuviera nada relevante, entraban 3 recuerdos en
+cada prompt. `retrieve()` pide `RAG_CANDIDATES` (20) candidatos a
+`MemoryService.hybrid_query()`, los puntúa de 0 a 1, descarta los que no llegan
+a `RAG_MIN_SCORE` y mete los demás, del mejor al peor, hasta llenar
+`RAG_CONTEXT_TOKENS` (el hueco de memoria que reserva prompt_budget.py).
+
+Puntuación:
+- Con `RAG_RERANKER_MODEL` (un cross-encoder de sentence-transformers, p. ej.
+  `cross-encoder/ms-marco-MiniLM-L-6-v2`) y la librería instalada, la del
+  modelo en CPU.
+- Si no, un puntuador léxico barato: la media de la similitud coseno del vector
+  y la cobertura de los términos de la consulta en el recuerdo (los términos con
+  dígitos, como "P0340", pesan el doble).
+
+El informe trae los tiempos de cada etapa y cuánto se redujo el contexto frente
+a inyectar los primeros resultados sin filtrar.
+"""
+import math
+import os
+import sys
+import threading
+import time
+
+try:
+    from sentence_transformers import CrossEncoder
+except ImportError:
+    CrossEncoder = None
+
+from lexical_index import tokenize
+from prompt_budget import CHAT_OVERHEAD, count_tokens, truncate_to_tokens
+
+# Candidatos que se piden a la búsqueda híbrida antes de re-puntuar
+CANDIDATES = int(os.getenv("RAG_CANDIDATES", "20"))
+# Puntuación mínima (0-1) para entrar en el contexto
+MIN_SCORE = float(os.getenv("RAG_MIN_SCORE", "0.35"))
+# Tokens del contexto de memoria y número máximo de recuerdos
+CONTEXT_TOKENS = int(os.getenv("RAG_CONTEXT_TOKENS", str(CHAT_OVERHEAD["memory"])))
+MAX_ITEMS = int(os.getenv("RAG_MAX_ITEMS", "5"))
+# Cross-encoder opcional (vacío: puntuador léxico)
+RERANKER_MODEL = os.getenv("RAG_RERANKER_MODEL", "")
+# Recuerdos que se inyectaban antes, sin re-puntuar: referencia para medir la reducción
+BASELINE_ITEMS = 3
+
+_MODEL = None
+_MODEL_LOCK = threading.Lock()
+
+
+def _cross_encoder():
+    """Cross-encoder de `RAG_RERANKER_MODEL`, cargado una vez (False si no hay)."""
+    global _MODEL
+    with _MODEL_LOCK:
+        if _MODEL is None:
+            _MODEL = False
+            if RERANKER_MODEL and CrossEncoder is not None:
+                try:
+                    _MODEL = CrossEncoder(RERANKER_MODEL, device="cpu")
+                except Exception as e:
+                    print(f"⚠️  [RAG] No se pudo cargar el re-ranker {RERANKER_MODEL}: {e}", file=sys.stderr)
+            elif RERANKER_MODEL:
+                print("⚠️  [RAG] RAG_RERANKER_MODEL requiere sentence-transformers; se usa el puntuador léxico.", file=sys.stderr)
+        return _MODEL
+
+
+def similarity(distance, space="l2"):
+    """Similitud coseno a partir de la distancia de ChromaDB (None si no la hay)."""
+    if distance is None:
+        return None
+    # l2 es la distancia al cuadrado entre vectores normalizados: 2 - 2·cos
+    cosine = 1 - distance / 2 if space == "l2" else 1 - distance
+    return min(max(cosine, 0.0), 1.0)
+
+
+def coverage(query_terms, document):
+    """Fracción (ponderada) de los términos de la consulta que aparecen en `document`."""
+    if not query_terms:
+        return None
+    terms = set(tokenize(document))
+    weights = {t: 2.0 if any(c.isdigit() for c in t) else 1.0 for t in query_terms}
+    return sum(w for t, w in weights.items() if t in terms) / sum(weights.values())
+
+
+def lexical_scores(query, candidates, space="l2"):
+    """Puntuación 0-1 de cada candidato: media de similitud vectorial y cobertura de términos."""
+    query_terms = set(tokenize(query))
+    scores = []
+    for candidate in candidates:
+        parts = [x for x in (similarity(candidate.get("distance"), space),
+                             coverage(query_terms, candidate["document"])) if x is not None]
+        scores.append(sum(parts) / len(parts) if parts else 0.0)
+    return scores
+
+
+def score(query, candidates, space="l2"):
+    """`(puntuaciones 0-1, nombre del puntuador)` de los candidatos para `query`."""
+    model = _cross_encoder()
+    if model:
+        raw = [float(x) for x in model.predict([(query, c["document"]) for c in candidates])]
+        # Los cross-encoder de ms-marco devuelven logits: se pasan a 0-1
+        if any(x < 0 or x > 1 for x in raw):
+            raw = [1 / (1 + math.exp(-x)) for x in raw]
+        return raw, f"cross-encoder:{RERANKER_MODEL}"
+    return lexical_scores(query, candidates, space), "lexical"
+
+
+def pack(documents, max_tokens, max_items=MAX_ITEMS):
+    """
+    `[(índice, texto)]` de los documentos (ya ordenados) que caben en `max_tokens`
+    como líneas "- texto". Uno que no cabe se salta para probar los siguientes; si
+    ni el primero cabe entero, entra truncado.
+    """
+    packed, used = [], 0
+    for i, document in enumerate(documents):
+        if len(packed) >= max_items:
+            break
+        # Cada recuerdo ocupa una línea "- texto\n"
+        tokens = count_tokens(f"- {document}\n")
+        if used + tokens > max_tokens:
+            if packed:
+                continue
+            document = truncate_to_tokens(document, max_tokens - count_tokens("- \n"))
+            tokens = count_tokens(f"- {document}\n")
+        packed.append((i, document))
+        used += tokens
+    return packed
+
+
+def retrieve(service, query, types=None, candidates=CANDIDATES, min_score=MIN_SCORE,
+             max_tokens=CONTEXT_TOKENS, max_items=MAX_ITEMS):
+    """
+    Recupera, re-puntúa y ajusta a tokens el contexto de memoria para `query` (un
+    texto, o una lista de consultas que se buscan en un solo lote, p. ej. un código
+    DTC por consulta; cada candidato se puntúa con la consulta que lo encontró y
+    se queda con su mejor puntuación).
+    Devuelve `(recuerdos, informe)`: cada recuerdo es un resultado de
+    `hybrid_query()` con `score` (y `document` truncado si hizo falta); el informe
+    lleva los tiempos por etapa en ms, los candidatos descartados y los tokens
+    del contexto frente a los primeros resultados sin filtrar.
+    """
+    start = time.perf_counter()
+    queries = [query] if isinstance(query, str) else list(query)
+    answers = service.hybrid_query_many(queries, n_results=candidates, candidates=candidates, types=types)
+
+    t = time.perf_counter()
+    space = (getattr(service.collection(), "metadata", None) or {}).get("hnsw:space", "l2")
+    best, baseline, scorers = {}, [], set()
+    for text, (results, _) in zip(queries, answers):
+        # Fragmentos repetidos (la misma nota guardada dos veces) cuentan una sola vez
+        seen, unique = set(), []
+        for result in results:
+            if result["document"] and result["document"] not in seen:
+                seen.add(result["document"])
+                unique.append(result)
+        baseline += [r["document"] for r in unique[:BASELINE_ITEMS]]
+        if not unique:
+            continue
+        scores, scorer = score(text, unique, space)
+        scorers.add(scorer)
+        for value, result in zip(scores, unique):
+            if result["document"] not in best or value > best[result["document"]][0]:
+                best[result["document"]] = (value, result)
+    ranked = sorted(best.values(), key=lambda item: -item[0])
+    kept = [(s, r) for s, r in ranked if s >= min_score]
+    rerank_ms = round((time.perf_counter() - t) * 1000, 1)
+
+    t = time.perf_counter()
+    packed = pack([r["document"] for _, r in kept], max_tokens, max_items)
+    items = [dict(kept[i][1], document=text, score=round(kept[i][0], 3)) for i, text in packed]
+    pack_ms = round((time.perf_counter() - t) * 1000, 1)
+
+    raw_tokens = count_tokens("\n".join(f"- {doc}" for doc in dict.fromkeys(baseline)))
+    context_tokens = count_tokens("\n".join(f"- {r['document']}" for r in items))
+    timings = [answer_timings for _, answer_timings in answers]
+    report = {
+        "scorer": ",".join(sorted(scorers)) or "lexical",
+        "queries": len(queries),
+        "candidates": len(ranked),
+        "below_cutoff": len(ranked) - len(kept),
+        "kept": len(items),
+        "raw_tokens": raw_tokens,
+        "context_tokens": context_tokens,
+        "shrink_pct": round(100 * (1 - context_tokens / raw_tokens), 1) if raw_tokens else 0.0,
+        "timings_ms": {
+            "retrieve_ms": timings[0].get("total_ms"),
+            "vector_ms": timings[0].get("vector_ms"),
+            "lexical_ms": round(sum(t.get("lexical_ms", 0) for t in timings), 1),
+            "rerank_ms": rerank_ms,
+            "pack_ms": pack_ms,
+            "total_ms": round((time.perf_counter() - start) * 1000, 1),
+        },
+    }
+    return items, report
@@ -28,19 +28,22 @@ def print_error(message: str, details: str, exit_code: int):
     sys.exit(exit_code)
 
 
-def main():
-    """
-    Main function to research a topic using DuckDuckGo.
-    Saves titles, URLs, and snippets to a text file.
-    """
+def build_parser():
     parser = argparse.ArgumentParser(
         description="Performs a web search for a topic and saves the results."
     )
     parser.add_argument("--query", required=True, help="The search query.")
     parser.add_argument("--output-file", required=True, help="Path to save the research results.")
     parser.add_argument("--max-results", type=int, default=10, help="Maximum number of results to fetch.")
-    args = parser.parse_args()
+    return parser
 
+
+def run(args):
+    """
+    Researches a topic using DuckDuckGo.
+    Saves titles, URLs, and snippets to a text file and returns the result as a dict;
+    errors carry the CLI exit code.
+    """
     query = args.query
     output_file = Path(args.output_file)
     max_results = args.max_results
@@ -56,7 +59,8 @@ def main():
                 results = list(search_gen)
 
     except Exception as e:
-        print_error("Search Error: Failed to retrieve results from the search engine.", str(e), 2)
+        return {"status": "error", "error_message": "Search Error: Failed to retrieve results from the search engine.",
+                "details": str(e).strip(), "exit_code": 2}
 
     # --- Formatting Output ---
     if not results:
@@ -83,15 +87,23 @@ def main():
         output_file.parent.mkdir(parents=True, exist_ok=True)
         output_file.write_text(content, encoding='utf-8')
     except IOError as e:
-        print_error(f"File Error: Could not write to output file '{output_file}'.", str(e), 3)
+        return {"status": "error", "error_message": f"File Error: Could not write to output file '{output_file}'.",
+                "details": str(e).strip(), "exit_code": 3}
 
     # --- Success Output ---
-    output_data = {
+    return {
         "status": "success",
         "research_file_path": str(output_file),
         "results_count": len(results)
     }
-    print(json.dumps(output_data, indent=2))
+
+
+def main():
+    result = run(build_parser().parse_args())
+    if result["status"] == "error":
+        print_error(result["error_message"], result["details"], result["exit_code"])
+
+    print(json.dumps(result, indent=2))
     sys.exit(0)
 
 
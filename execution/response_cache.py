@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+"""
+Caché de respuestas del LLM.
+
+Los mecánicos repiten preguntas ("orden de encendido", torques, `/mantenimiento
+60000`, el mismo DTC de `/scan`) y cada una costaba una llamada nueva al
+proveedor. La caché guarda la respuesta en `.tmp/response_cache.sqlite` bajo
+sha256(prompt + ámbito) y la sirve en milisegundos. El ámbito (`scope_key`) junta
+la instrucción del sistema, el proveedor pedido, el historial que se enviaría
+(resumen y turnos) y los tipos de recuerdo consultados: una pregunta de
+seguimiento en otra conversación no recibe la respuesta de esta.
+
+- Nivel exacto: mismo prompt en el mismo ámbito.
+- Nivel semántico (opcional, `LLM_CACHE_SEMANTIC=1`): embebe el prompt con el
+  modelo de la memoria (pasando por la caché de embeddings) y lo busca en la
+  colección Chroma `llm_response_cache`; reutiliza la respuesta si la similitud
+  coseno supera `LLM_CACHE_SEMANTIC_THRESHOLD`.
+- Caducidad (`LLM_CACHE_TTL`, 24 h) y tamaño máximo (`LLM_CACHE_MAX_ITEMS`);
+  al superarlo se descartan las entradas usadas hace más tiempo.
+
+La fecha y hora que el listener añade al sistema no forma parte de la clave; el
+chat libre, que es el que la lleva, llama sin caché (`--no-cache`).
+"""
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_CACHE_PATH = os.path.join(PROJECT_ROOT, ".tmp", "response_cache.sqlite")
+SEMANTIC_COLLECTION = "llm_response_cache"
+
+DEFAULT_TTL = float(os.getenv("LLM_CACHE_TTL", "86400"))
+DEFAULT_MAX_ITEMS = int(os.getenv("LLM_CACHE_MAX_ITEMS", "1000"))
+DEFAULT_THRESHOLD = float(os.getenv("LLM_CACHE_SEMANTIC_THRESHOLD", "0.92"))
+# Prompts más cortos ("sí", "¿y el otro?") dependen de la conversación: no se cachean
+MIN_PROMPT_CHARS = int(os.getenv("LLM_CACHE_MIN_CHARS", "15"))
+
+VOLATILE_CONTEXT_RE = re.compile(r"\n?\[Contexto Temporal:[^\]]*\]")
+
+
+def scope_key(system, provider, history=None, memory_types=None):
+    """
+    Ámbito de la caché: la misma pregunta con otra personalidad, otro proveedor,
+    otro historial (`(resumen, turnos)`) u otros tipos de recuerdo es otra entrada.
+    """
+    system = VOLATILE_CONTEXT_RE.sub("", system or "").strip()
+    summary, turns = history or (None, [])
+    context = json.dumps({"summary": summary, "turns": [[t["role"], t["content"]] for t in turns],
+                          "types": sorted(memory_types or [])}, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(f"{provider or 'auto'}\0{system}\0{context}".encode("utf-8")).hexdigest()[:32]
+
+
+def entry_key(prompt, scope):
+    return hashlib.sha256(f"{scope}\0{prompt.strip()}".encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """Caché SQLite de respuestas con nivel semántico opcional sobre Chroma. Segura entre hilos."""
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, ttl=DEFAULT_TTL, max_items=DEFAULT_MAX_ITEMS,
+                 semantic=None, threshold=DEFAULT_THRESHOLD, memory=None, clock=time.time):
+        self.path = path
+        self.ttl = ttl
+        self.max_items = max_items
+        self.semantic = os.getenv("LLM_CACHE_SEMANTIC", "") == "1" if semantic is None else semantic
+        self.threshold = threshold
+        self._memory = memory
+        self.clock = clock
+        self._db = None
+        self._lock = threading.Lock()
+        self.counters = {"exact_hits": 0, "semantic_hits": 0, "misses": 0, "evicted": 0}
+
+    def _connection(self):
+        if self._db is None:
+            if os.path.dirname(self.path):
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, scope TEXT NOT NULL, prompt TEXT NOT NULL, content TEXT NOT NULL, "
+                "created REAL NOT NULL, last_used REAL NOT NULL, hits INTEGER NOT NULL DEFAULT 0)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)")
+        return self._db
+
+    def _semantic_collection(self):
+        if self._memory is None:
+            from memory_service import get_service
+            self._memory = get_service()
+        return self._memory.collection(SEMANTIC_COLLECTION, metadata={"hnsw:space": "cosine"})
+
+    def _embed(self, prompt):
+        self._semantic_collection()
+        return self._memory.embed([prompt], name=SEMANTIC_COLLECTION)
+
+    def cacheable(self, prompt):
+        return len(prompt.strip()) >= MIN_PROMPT_CHARS
+
+    def _lookup(self, key, now):
+        """Fila vigente para `key` (marcándola como usada) o None."""
+        db = self._connection()
+        row = db.execute("SELECT content, created FROM responses WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        if now - row[1] > self.ttl:
+            db.execute("DELETE FROM responses WHERE key = ?", (key,))
+            db.commit()
+            return None
+        db.execute("UPDATE responses SET last_used = ?, hits = hits + 1 WHERE key = ?", (now, key))
+        db.commit()
+        return row[0]
+
+    def get(self, prompt, scope):
+        """Devuelve `(respuesta, "exact" | "semantic")` o None."""
+        if not self.cacheable(prompt):
+            return None
+        now = self.clock()
+        with self._lock:
+            content = self._lookup(entry_key(prompt, scope), now)
+            if content is not None:
+                self.counters["exact_hits"] += 1
+                return content, "exact"
+
+        if self.semantic:
+            try:
+                found = self._semantic_collection().query(
+                    query_embeddings=self._embed(prompt), n_results=1, where={"scope": scope}
+                )
+                ids, distances = found["ids"][0], found["distances"][0]
+                # Espacio coseno: distancia = 1 - similitud
+                if ids and 1.0 - distances[0] >= self.threshold:
+                    with self._lock:
+                        content = self._lookup(ids[0], now)
+                    if content is not None:
+                        self.counters["semantic_hits"] += 1
+                        return content, "semantic"
+            except Exception as e:
+                print(f"⚠️  [CACHE] Nivel semántico no disponible: {e}", file=sys.stderr)
+
+        with self._lock:
+            self.counters["misses"] += 1
+        return None
+
+    def put(self, prompt, scope, content):
+        if not self.cacheable(prompt) or not content:
+            return
+        key = entry_key(prompt, scope)
+        now = self.clock()
+        with self._lock:
+            db = self._connection()
+            db.execute(
+                "INSERT OR REPLACE INTO responses (key, scope, prompt, content, created, last_used, hits) "
+                "VALUES (?, ?, ?, ?, ?, ?, 0)",
+                (key, scope, prompt.strip(), content, now, now),
+            )
+            db.commit()
+        if self.semantic:
+            try:
+                self._semantic_collection().upsert(
+                    ids=[key], embeddings=self._embed(prompt), documents=[prompt.strip()], metadatas=[{"scope": scope}]
+                )
+            except Exception as e:
+                print(f"⚠️  [CACHE] No se pudo indexar el prompt: {e}", file=sys.stderr)
+        self.evict()
+
+    def evict(self):
+        """Borra lo caducado y, si se supera `max_items`, lo usado hace más tiempo."""
+        now = self.clock()
+        with self._lock:
+            db = self._connection()
+            stale = [r[0] for r in db.execute("SELECT key FROM responses WHERE created < ?", (now - self.ttl,))]
+            overflow = db.execute("SELECT COUNT(*) FROM responses").fetchone()[0] - len(stale) - self.max_items
+            if overflow > 0:
+                stale += [r[0] for r in db.execute(
+                    "SELECT key FROM responses WHERE created >= ? ORDER BY last_used LIMIT ?", (now - self.ttl, overflow)
+                )]
+            if not stale:
+                return 0
+            db.executemany("DELETE FROM responses WHERE key = ?", [(k,) for k in stale])
+            db.commit()
+            self.counters["evicted"] += len(stale)
+        if self.semantic:
+            try:
+                self._semantic_collection().delete(ids=stale)
+            except Exception as e:
+                print(f"⚠️  [CACHE] No se pudieron borrar vectores caducados: {e}", file=sys.stderr)
+        return len(stale)
+
+    def stats(self):
+        with self._lock:
+            items = self._connection().execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+            return dict(self.counters, items=items)
+
+
+_CACHE = None
+_CACHE_LOCK = threading.Lock()
+
+
+def get_response_cache():
+    """Caché compartida del proceso."""
+    global _CACHE
+    with _CACHE_LOCK:
+        if _CACHE is None:
+            _CACHE = ResponseCache()
+        return _CACHE
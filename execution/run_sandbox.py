@@ -77,10 +77,15 @@ def run_in_sandbox(code_to_run):
         if container:
             container.remove(force=True)
 
-if __name__ == "__main__":
+def build_parser():
     parser = argparse.ArgumentParser(description="Ejecutar código Python en un sandbox de Docker.")
     parser.add_argument("--code", required=True, help="El código Python a ejecutar.")
-    args = parser.parse_args()
+    return parser
+
+def run(args):
+    """Punto de entrada estructurado (sin imprimir) para el registro de herramientas."""
+    return run_in_sandbox(args.code)
 
-    output = run_in_sandbox(args.code)
+if __name__ == "__main__":
+    output = run(build_parser().parse_args())
     print(json.dumps(output, indent=2))
\ No newline at end of file
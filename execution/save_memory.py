@@ -14,6 +14,8 @@ except ImportError:
     )
     sys.exit(10)
 
+from memory_service import get_service, MEMORY_TYPES
+
 
 def print_error(message: str, details: str, exit_code: int):
     error_data = {
@@ -25,22 +27,28 @@ def print_error(message: str, details: str, exit_code: int):
     sys.exit(exit_code)
 
 
-def main():
-    """
-    Saves a text snippet to the local ChromaDB vector store.
-    Generates a unique ID and timestamps the entry.
-    """
+def build_parser():
     parser = argparse.ArgumentParser(description="Save a memory to ChromaDB.")
     parser.add_argument("--text", required=True, help="The content to remember.")
     parser.add_argument("--category", default="general", help="Category tag (e.g., error_fix, preference).")
+    parser.add_argument("--type", default="note", choices=[t for t in MEMORY_TYPES if t != "manual"],
+                        help="Memory type used to filter retrieval (manual chunks come from ingest_manual.py).")
     parser.add_argument("--db-path", default=".tmp/chroma_db", help="Path to ChromaDB.")
-    args = parser.parse_args()
+    return parser
 
+
+def run(args):
+    """
+    Saves a text snippet to the local ChromaDB vector store.
+    Generates a unique ID and timestamps the entry.
+    Returns the result as a dict; errors carry the CLI exit code.
+    """
     try:
-        client = chromadb.PersistentClient(path=args.db_path)
-        collection = client.get_or_create_collection(name="agent_memory")
+        service = get_service(args.db_path)
+        service.collection()
     except Exception as e:
-        print_error("Database Error: Failed to connect to ChromaDB.", str(e), 2)
+        return {"status": "error", "error_message": "Database Error: Failed to connect to ChromaDB.",
+                "details": str(e).strip(), "exit_code": 2}
 
     # Generate unique ID and metadata
     memory_id = str(uuid.uuid4())
@@ -48,26 +56,37 @@ def main():
 
     metadata = {
         "category": args.category,
+        "type": args.type,
         "timestamp": timestamp,
         "source": "user_input"
     }
 
     try:
-        collection.add(
+        # Vía el servicio: también queda en el índice léxico (BM25)
+        service.add(
             documents=[args.text],
             metadatas=[metadata],
             ids=[memory_id]
         )
     except Exception as e:
-        print_error("Storage Error: Failed to save memory.", str(e), 3)
+        return {"status": "error", "error_message": "Storage Error: Failed to save memory.",
+                "details": str(e).strip(), "exit_code": 3}
 
-    output_data = {
+    return {
         "status": "success",
         "memory_id": memory_id,
         "category": args.category,
+        "type": args.type,
         "timestamp": timestamp
     }
-    print(json.dumps(output_data, indent=2))
+
+
+def main():
+    result = run(build_parser().parse_args())
+    if result["status"] == "error":
+        print_error(result["error_message"], result["details"], result["exit_code"])
+
+    print(json.dumps(result, indent=2))
     sys.exit(0)
 
 
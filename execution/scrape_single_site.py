@@ -5,12 +5,14 @@ import sys
 import requests
 from bs4 import BeautifulSoup
 
-def main():
+def build_parser():
     parser = argparse.ArgumentParser(description="Scrape text from a website.")
     parser.add_argument("--url", required=True, help="URL to scrape.")
     parser.add_argument("--output-file", required=True, help="Output file path.")
-    args = parser.parse_args()
+    return parser
 
+def run(args):
+    """Scrapes the page text into the output file and returns the result as a dict."""
     try:
         headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'}
         response = requests.get(args.url, headers=headers, timeout=15)
@@ -32,10 +34,15 @@ def main():
         with open(args.output_file, 'w', encoding='utf-8') as f:
             f.write(f"Source: {args.url}\n\n{text}")
             
-        print(json.dumps({"status": "success", "file": args.output_file}))
+        return {"status": "success", "file": args.output_file}
         
     except Exception as e:
-        print(json.dumps({"status": "error", "message": str(e)}))
+        return {"status": "error", "message": str(e)}
+
+def main():
+    result = run(build_parser().parse_args())
+    print(json.dumps(result))
+    if result["status"] == "error":
         sys.exit(1)
 
 if __name__ == "__main__":
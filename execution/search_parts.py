@@ -4,12 +4,14 @@ import json
 import sys
 from duckduckgo_search import DDGS
 
-def main():
+def build_parser():
     parser = argparse.ArgumentParser(description="Buscar repuestos automotrices en línea.")
     parser.add_argument("--part", required=True, help="Nombre del repuesto (ej. 'Sensor MAP Fiat Siena 1.8').")
     parser.add_argument("--region", default="ve", help="Código de región para la búsqueda (ve, ar, br, co, mx).")
-    args = parser.parse_args()
+    return parser
 
+def run(args):
+    """Busca el repuesto y devuelve los resultados como diccionario."""
     # Construir una query optimizada para e-commerce
     # Priorizamos MercadoLibre por ser el estándar en Latam mencionado en el contexto
     site_filter = f"site:mercadolibre.com.{args.region}"
@@ -30,8 +32,7 @@ def main():
                         "price_hint": r.get("body") # A veces el precio aparece en el snippet
                     })
     except Exception as e:
-        print(json.dumps({"status": "error", "message": str(e)}))
-        sys.exit(1)
+        return {"status": "error", "message": str(e)}
 
     # Formatear salida
     if not results:
@@ -45,20 +46,25 @@ def main():
             pass
 
     if results:
-        print(json.dumps({
+        return {
             "status": "success",
             "part": args.part,
             "count": len(results),
             "results": results
-        }, indent=2))
-    else:
-        print(json.dumps({
-            "status": "success",
-            "part": args.part,
-            "count": 0,
-            "results": [],
-            "message": "No se encontraron resultados directos."
-        }))
+        }
+    return {
+        "status": "success",
+        "part": args.part,
+        "count": 0,
+        "results": [],
+        "message": "No se encontraron resultados directos."
+    }
+
+def main():
+    result = run(build_parser().parse_args())
+    print(json.dumps(result, indent=2))
+    if result["status"] == "error":
+        sys.exit(1)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
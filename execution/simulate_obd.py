@@ -15,13 +15,17 @@ COMMON_DTCS = {
     "P0340": "Mal funcionamiento del circuito del sensor de posición del árbol de levas"
 }
 
-def main():
+def build_parser():
     parser = argparse.ArgumentParser(description="Simulador de escáner OBD-II para Fiat Siena 1.8.")
     parser.add_argument("--query", choices=["dtc", "rpm", "temp"], required=True, help="Dato a simular.")
-    args = parser.parse_args()
+    parser.add_argument("--no-delay", action="store_true", help="Omite el retraso simulado del escáner (útil para benchmarks).")
+    return parser
 
+def run(args):
+    """Simula la lectura OBD-II pedida y devuelve el resultado como diccionario."""
     # Simular un pequeño retraso como un escáner real
-    time.sleep(random.uniform(0.5, 2.0))
+    if not args.no_delay:
+        time.sleep(random.uniform(0.5, 2.0))
 
     if args.query == "dtc":
         # 30% de probabilidad de no tener códigos
@@ -38,8 +42,11 @@ def main():
     elif args.query == "temp":
         temp = random.randint(88, 95)
         result = {"status": "success", "data": {"coolant_temp": temp}}
-    
+    return result
+
+def main():
+    result = run(build_parser().parse_args())
     print(json.dumps(result, indent=2))
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Despachador concurrente de mensajes para el listener de Telegram.
+
+Mantiene una cola por chat y un pool fijo de hilos. Un chat nunca tiene más de
+un mensaje en proceso a la vez (las respuestas salen en orden dentro del chat),
+pero chats distintos se atienden en paralelo, así que un `/py` de 120 s o un
+`/reporte` lento ya no bloquea al resto de usuarios.
+"""
+import queue
+import sys
+import threading
+import time
+from collections import deque
+
+
+class ChatDispatcher:
+    """
+    Pool de hilos con colas por chat acotadas.
+
+    `handler(chat_id, item)` se ejecuta en un hilo del pool. `submit()` devuelve
+    False (sin encolar) cuando se supera `max_per_chat` o `max_pending`, para que
+    quien produce los mensajes aplique contrapresión.
+    """
+
+    def __init__(self, handler, max_workers=4, max_per_chat=10, max_pending=100):
+        self._handler = handler
+        self.max_workers = max_workers
+        self.max_per_chat = max_per_chat
+        self.max_pending = max_pending
+
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._queues = {}
+        self._ready = queue.Queue()
+        self._pending = 0
+        self._busy = 0
+        self._processed = 0
+        self._rejected = 0
+        self._started_at = time.time()
+
+        self._workers = []
+        for i in range(max_workers):
+            worker = threading.Thread(target=self._work, name=f"chat-worker-{i}", daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+    def submit(self, chat_id, item):
+        """Encola `item` para `chat_id`. Devuelve False si la cola está llena."""
+        with self._lock:
+            chat_queue = self._queues.get(chat_id)
+            if self._pending >= self.max_pending or (chat_queue is not None and len(chat_queue) >= self.max_per_chat):
+                self._rejected += 1
+                return False
+
+            if chat_queue is None:
+                # El chat no tenía trabajo: entra en la cola de chats listos
+                chat_queue = self._queues[chat_id] = deque()
+                self._ready.put(chat_id)
+            chat_queue.append(item)
+            self._pending += 1
+            return True
+
+    def _work(self):
+        while True:
+            chat_id = self._ready.get()
+            if chat_id is None:
+                return
+
+            with self._lock:
+                item = self._queues[chat_id][0]
+                self._busy += 1
+
+            try:
+                self._handler(chat_id, item)
+            except Exception as e:
+                print(f"   ❌ [DISPATCHER] Error procesando mensaje de {chat_id}: {e}", file=sys.stderr)
+            finally:
+                with self._lock:
+                    chat_queue = self._queues[chat_id]
+                    chat_queue.popleft()
+                    self._pending -= 1
+                    self._busy -= 1
+                    self._processed += 1
+                    if chat_queue:
+                        # Vuelve al final de la cola de listos: reparto justo entre chats
+                        self._ready.put(chat_id)
+                    else:
+                        del self._queues[chat_id]
+                    if self._pending == 0:
+                        self._idle.notify_all()
+
+    def stats(self):
+        """Devuelve una instantánea del backlog para logs y `/status`."""
+        with self._lock:
+            return {
+                "workers": self.max_workers,
+                "busy": self._busy,
+                "pending": self._pending,
+                "chats_waiting": len(self._queues),
+                "max_chat_backlog": max((len(q) for q in self._queues.values()), default=0),
+                "max_pending": self.max_pending,
+                "max_per_chat": self.max_per_chat,
+                "processed": self._processed,
+                "rejected": self._rejected,
+                "uptime_s": round(time.time() - self._started_at, 1),
+            }
+
+    def join(self, timeout=None):
+        """Espera a que no quede trabajo pendiente. Devuelve False si vence `timeout`."""
+        with self._lock:
+            return self._idle.wait_for(lambda: self._pending == 0, timeout=timeout)
+
+    def shutdown(self, wait=True):
+        """Detiene los hilos; con `wait=True` termina antes el trabajo pendiente."""
+        if wait:
+            self.join()
+        for _ in self._workers:
+            self._ready.put(None)
+        if wait:
+            for worker in self._workers:
+                worker.join()
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+Respuestas en streaming para Telegram.
+
+En lugar de esperar la respuesta completa del LLM y mandar un único mensaje,
+`StreamingReply` envía un mensaje provisional y lo va reemplazando con
+`editMessageText` a medida que llegan fragmentos de texto (`feed`). Las
+ediciones se espacian para respetar los límites de Telegram:
+
+- Por mensaje: como mucho una edición cada `min_interval` segundos
+  (`TELEGRAM_EDIT_INTERVAL`, 1.5 s por defecto).
+- Global: `EditBudget` reparte un máximo de ediciones por segundo entre todos
+  los chats (`TELEGRAM_EDITS_PER_SECOND`, 20); si no hay cupo la edición se
+  salta y el texto sale en la siguiente.
+- Si Telegram responde 429 se pausan las ediciones de ese mensaje `retry_after`
+  segundos.
+
+El texto parcial se edita como texto plano (el Markdown puede estar sin cerrar);
+la edición final (`finish`) aplica Markdown.
+"""
+import os
+import threading
+import time
+from collections import deque
+
+import telegram_tool
+
+MAX_MESSAGE_CHARS = 4096
+CURSOR = " ▌"
+
+
+class EditBudget:
+    """Ventana deslizante de un segundo con un máximo de ediciones para todo el bot."""
+
+    def __init__(self, max_per_second=20, clock=time.monotonic):
+        self.max_per_second = max_per_second
+        self.clock = clock
+        self._times = deque()
+        self._lock = threading.Lock()
+
+    def try_acquire(self):
+        now = self.clock()
+        with self._lock:
+            while self._times and now - self._times[0] >= 1.0:
+                self._times.popleft()
+            if len(self._times) >= self.max_per_second:
+                return False
+            self._times.append(now)
+            return True
+
+
+BUDGET = EditBudget(int(os.getenv("TELEGRAM_EDITS_PER_SECOND", "20")))
+
+
+def split_message(text, limit=MAX_MESSAGE_CHARS):
+    """Divide un texto en partes de hasta `limit` caracteres, cortando en saltos de línea si es posible."""
+    parts = []
+    while len(text) > limit:
+        cut = text.rfind("\n", 0, limit)
+        if cut <= 0:
+            cut = limit
+        parts.append(text[:cut])
+        text = text[cut:].lstrip("\n")
+    parts.append(text)
+    return parts
+
+
+class StreamingReply:
+    """
+    Mensaje de Telegram que se actualiza mientras el LLM genera la respuesta.
+
+    Uso: `reply = StreamingReply(chat_id).start()`, pasar `reply.feed` como
+    `on_delta` a chat_with_llm y terminar con `reply.finish(texto_final)`.
+    """
+
+    def __init__(self, chat_id, placeholder="🧠 Pensando...", min_interval=None,
+                 budget=None, clock=time.monotonic):
+        self.chat_id = chat_id
+        self.placeholder = placeholder
+        self.min_interval = float(os.getenv("TELEGRAM_EDIT_INTERVAL", "1.5")) if min_interval is None else min_interval
+        self.budget = budget or BUDGET
+        self.clock = clock
+
+        self.message_id = None
+        self.text = ""
+        self._shown = None
+        self._last_edit = None
+        self._blocked_until = 0.0
+        self._started = None
+        self.stats = {"edits": 0, "skipped": 0, "first_text_s": None}
+
+    def start(self):
+        """Envía el mensaje provisional. Si falla, `finish` enviará un mensaje normal."""
+        self._started = self.clock()
+        res = telegram_tool.send_message(self.placeholder, self.chat_id)
+        self.message_id = res.get("message_id") if res.get("status") == "success" else None
+        return self
+
+    def feed(self, delta):
+        """Callback `on_delta`: añade un fragmento (o reinicia el texto si `delta` es None)."""
+        if delta is None:
+            self.text = ""
+            return
+        self.text += delta
+        self._maybe_edit()
+
+    def _display(self):
+        limit = MAX_MESSAGE_CHARS - len(CURSOR)
+        return self.text[:limit] + CURSOR
+
+    def _maybe_edit(self):
+        if self.message_id is None or not self.text.strip():
+            return
+        now = self.clock()
+        if now < self._blocked_until:
+            return
+        if self._last_edit is not None and now - self._last_edit < self.min_interval:
+            return
+        display = self._display()
+        if display == self._shown:
+            return
+        if not self.budget.try_acquire():
+            self.stats["skipped"] += 1
+            return
+        self._edit(display, markdown=False)
+
+    def _edit(self, text, markdown):
+        res = telegram_tool.edit_message(text, self.chat_id, self.message_id, markdown=markdown)
+        now = self.clock()
+        self._last_edit = now
+        if res.get("retry_after"):
+            self._blocked_until = now + float(res["retry_after"])
+            return res
+        if res.get("status") == "success":
+            self._shown = text
+            self.stats["edits"] += 1
+            if self.stats["first_text_s"] is None and self._started is not None:
+                self.stats["first_text_s"] = now - self._started
+        return res
+
+    def finish(self, final_text):
+        """Publica la respuesta completa (con Markdown). Lo que exceda un mensaje se envía aparte."""
+        parts = split_message(final_text)
+        if self.message_id is None:
+            res = None
+            for part in parts:
+                res = telegram_tool.send_message(part, self.chat_id)
+            return res
+
+        for _ in range(2):
+            wait = self._blocked_until - self.clock()
+            if wait > 0:
+                time.sleep(wait)
+            res = self._edit(parts[0], markdown=True)
+            if not res.get("retry_after"):
+                break
+        if res.get("status") != "success":
+            # Último recurso: mandar la respuesta como mensaje nuevo
+            res = telegram_tool.send_message(parts[0], self.chat_id)
+        for part in parts[1:]:
+            res = telegram_tool.send_message(part, self.chat_id)
+        return res
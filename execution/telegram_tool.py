@@ -15,37 +15,72 @@ CHAT_ID = os.getenv("TELEGRAM_CHAT_ID")
 ALLOWED_USERS = os.getenv("TELEGRAM_ALLOWED_USERS", CHAT_ID or "").strip()
 OFFSET_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".tmp", "telegram_offset.txt")
 
+# Sesión HTTP compartida: reutiliza conexiones TCP/TLS con api.telegram.org (keep-alive)
+SESSION = requests.Session()
+
 def send_message(text, target_chat_id=None):
     """Envía un mensaje al chat configurado."""
     dest_id = target_chat_id or CHAT_ID
     if not TOKEN or not dest_id:
-        print(json.dumps({"status": "error", "message": "Faltan credenciales o Chat ID destino."}))
-        sys.exit(1)
+        return {"status": "error", "message": "Faltan credenciales o Chat ID destino."}
     
     url = f"https://api.telegram.org/bot{TOKEN}/sendMessage"
     payload = {"chat_id": dest_id, "text": text, "parse_mode": "Markdown"}
     
     try:
-        response = requests.post(url, json=payload, timeout=10)
+        response = SESSION.post(url, json=payload, timeout=10)
         response.raise_for_status()
-        print(json.dumps({"status": "success", "message": "Mensaje enviado."}))
+        return {"status": "success", "message": "Mensaje enviado.", "message_id": _message_id(response)}
     except Exception:
         # Si falla (común por errores de sintaxis Markdown), reintentar como texto plano
         try:
             payload.pop("parse_mode", None)
-            response = requests.post(url, json=payload, timeout=10)
+            response = SESSION.post(url, json=payload, timeout=10)
             response.raise_for_status()
-            print(json.dumps({"status": "success", "message": "Mensaje enviado (texto plano por error de formato)."}))
+            return {"status": "success", "message": "Mensaje enviado (texto plano por error de formato).", "message_id": _message_id(response)}
         except Exception as e:
-            print(json.dumps({"status": "error", "message": str(e)}))
-            sys.exit(1)
+            return {"status": "error", "message": str(e)}
+
+def _message_id(response):
+    try:
+        return response.json()["result"]["message_id"]
+    except (ValueError, KeyError, TypeError):
+        return None
+
+def edit_message(text, target_chat_id, message_id, markdown=True):
+    """
+    Reemplaza el texto de un mensaje ya enviado (editMessageText).
+    Con `markdown=False` se envía como texto plano (útil para texto parcial con
+    Markdown aún sin cerrar). Si Telegram responde 429 se incluye `retry_after`.
+    """
+    if not TOKEN:
+        return {"status": "error", "message": "Faltan credenciales."}
+
+    url = f"https://api.telegram.org/bot{TOKEN}/editMessageText"
+    payload = {"chat_id": target_chat_id, "message_id": message_id, "text": text}
+    if markdown:
+        payload["parse_mode"] = "Markdown"
+
+    try:
+        response = SESSION.post(url, json=payload, timeout=10)
+        if response.status_code == 429:
+            retry_after = response.json().get("parameters", {}).get("retry_after", 1)
+            return {"status": "error", "message": "Límite de ediciones alcanzado.", "retry_after": retry_after}
+        if response.status_code == 400 and "message is not modified" in response.text:
+            return {"status": "success", "message": "Sin cambios."}
+        if response.status_code == 400 and markdown:
+            # Markdown inválido: repetir como texto plano
+            return edit_message(text, target_chat_id, message_id, markdown=False)
+        response.raise_for_status()
+        return {"status": "success", "message": "Mensaje editado."}
+    except Exception as e:
+        return {"status": "error", "message": str(e)}
 
 def send_photo(file_path, target_chat_id=None, caption=""):
     """Envía una foto desde una ruta local."""
     dest_id = target_chat_id or CHAT_ID
     if not TOKEN or not dest_id:
-        print(json.dumps({"status": "error", "message": "Faltan credenciales o Chat ID destino."}))
-        sys.exit(1)
+        return {"status": "error", "message": "Faltan credenciales o Chat ID destino."}
     
     url = f"https://api.telegram.org/bot{TOKEN}/sendPhoto"
     
@@ -54,19 +89,17 @@ def send_photo(file_path, target_chat_id=None, caption=""):
         with open(file_path, 'rb') as photo_file:
             files = {'photo': photo_file}
             data = {'chat_id': dest_id, 'caption': caption}
-            response = requests.post(url, files=files, data=data, timeout=30) # Timeout aumentado para subidas
+            response = SESSION.post(url, files=files, data=data, timeout=30) # Timeout aumentado para subidas
             response.raise_for_status()
-            print(json.dumps({"status": "success", "message": "Foto enviada."}))
+            return {"status": "success", "message": "Foto enviada."}
     except Exception as e:
-        print(json.dumps({"status": "error", "message": str(e)}))
-        sys.exit(1)
+        return {"status": "error", "message": str(e)}
 
 def send_document(file_path, target_chat_id=None, caption=""):
     """Envía un documento (PDF, etc.) desde una ruta local."""
     dest_id = target_chat_id or CHAT_ID
     if not TOKEN or not dest_id:
-        print(json.dumps({"status": "error", "message": "Faltan credenciales o Chat ID destino."}))
-        sys.exit(1)
+        return {"status": "error", "message": "Faltan credenciales o Chat ID destino."}
     
     url = f"https://api.telegram.org/bot{TOKEN}/sendDocument"
     
@@ -75,19 +108,17 @@ def send_document(file_path, target_chat_id=None, caption=""):
         with open(file_path, 'rb') as doc_file:
             files = {'document': doc_file}
             data = {'chat_id': dest_id, 'caption': caption}
-            response = requests.post(url, files=files, data=data, timeout=60) # Timeout mayor para docs
+            response = SESSION.post(url, files=files, data=data, timeout=60) # Timeout mayor para docs
             response.raise_for_status()
-            print(json.dumps({"status": "success", "message": "Documento enviado."}))
+            return {"status": "success", "message": "Documento enviado."}
     except Exception as e:
-        print(json.dumps({"status": "error", "message": str(e)}))
-        sys.exit(1)
+        return {"status": "error", "message": str(e)}
 
 def send_voice(file_path, target_chat_id=None):
     """Envía una nota de voz (.ogg)."""
     dest_id = target_chat_id or CHAT_ID
     if not TOKEN or not dest_id:
-        print(json.dumps({"status": "error", "message": "Faltan credenciales o Chat ID destino."}))
-        sys.exit(1)
+        return {"status": "error", "message": "Faltan credenciales o Chat ID destino."}
     
     url = f"https://api.telegram.org/bot{TOKEN}/sendVoice"
     
@@ -95,109 +126,159 @@ def send_voice(file_path, target_chat_id=None):
         with open(file_path, 'rb') as voice_file:
             files = {'voice': voice_file}
             data = {'chat_id': dest_id}
-            response = requests.post(url, files=files, data=data, timeout=40)
+            response = SESSION.post(url, files=files, data=data, timeout=40)
             response.raise_for_status()
-            print(json.dumps({"status": "success", "message": "Nota de voz enviada."}))
+            return {"status": "success", "message": "Nota de voz enviada."}
     except Exception as e:
-        print(json.dumps({"status": "error", "message": str(e)}))
-        sys.exit(1)
+        return {"status": "error", "message": str(e)}
 
-def check_messages():
-    """Consulta nuevos mensajes (polling) manteniendo el estado del offset."""
-    if not TOKEN:
-        print(json.dumps({"status": "error", "message": "Falta TELEGRAM_BOT_TOKEN en .env"}))
-        sys.exit(1)
-        
-    offset = 0
+def load_offset():
+    """Lee el último offset confirmado desde disco (0 si no existe)."""
     if os.path.exists(OFFSET_FILE):
         with open(OFFSET_FILE, 'r') as f:
             try:
-                offset = int(f.read().strip())
+                return int(f.read().strip())
             except:
-                offset = 0
+                return 0
+    return 0
+
+def save_offset(offset):
+    """Guarda el offset de forma atómica (archivo temporal + rename)."""
+    os.makedirs(os.path.dirname(OFFSET_FILE), exist_ok=True)
+    tmp_path = OFFSET_FILE + ".tmp"
+    with open(tmp_path, 'w') as f:
+        f.write(str(offset))
+    os.replace(tmp_path, OFFSET_FILE)
+
+def parse_update(update):
+    """
+    Convierte un update de Telegram al formato "CHAT_ID|CONTENIDO" del listener.
+    Devuelve None si el remitente no está autorizado o el tipo no se procesa.
+    """
+    # Seguridad: Filtrar por CHAT_ID si está definido para ignorar extraños
+    msg_chat_id = str(update.get("message", {}).get("chat", {}).get("id", ""))
     
-    url = f"https://api.telegram.org/bot{TOKEN}/getUpdates"
-    params = {"offset": offset, "limit": 10, "timeout": 5}
+    # Si ALLOWED_USERS es "*", permite a todos. Si no, verifica la lista.
+    if ALLOWED_USERS != "*":
+        allowed_list = [u.strip() for u in ALLOWED_USERS.split(",") if u.strip()]
+        if msg_chat_id not in allowed_list:
+            print(f"⚠️ Ignorando mensaje de {msg_chat_id} (No autorizado. Permitidos: '{ALLOWED_USERS}')", file=sys.stderr)
+            return None
+        
+    message = update.get("message", {})
+    text = message.get("text", "")
+    photo = message.get("photo")
     
-    try:
-        response = requests.get(url, params=params, timeout=20)
-        response.raise_for_status()
-        data = response.json()
+    if text:
+        return f"{msg_chat_id}|{text}"
+    elif photo:
+        # Telegram envía varias resoluciones, la última es la mejor
+        file_id = photo[-1]["file_id"]
+        caption = message.get("caption", "") or ""
+        # Usamos un prefijo especial para identificar fotos en el listener
+        return f"{msg_chat_id}|__PHOTO__:{file_id}|||{caption}"
+    elif message.get("document"):
+        doc = message["document"]
+        file_id = doc["file_id"]
+        file_name = doc.get("file_name", "unknown.pdf")
+        mime_type = doc.get("mime_type", "")
+        caption = message.get("caption", "") or ""
         
-        messages = []
-        max_update_id = offset
+        # Solo procesamos PDFs por ahora
+        if "pdf" in mime_type or file_name.lower().endswith(".pdf"):
+            return f"{msg_chat_id}|__DOCUMENT__:{file_id}|||{file_name}|||{caption}"
+    elif message.get("voice"):
+        voice = message["voice"]
+        file_id = voice["file_id"]
+        return f"{msg_chat_id}|__VOICE__:{file_id}"
+    return None
+
+class UpdatePoller:
+    """
+    Poller de larga duración para getUpdates.
+
+    Reutiliza la conexión HTTP (keep-alive) y usa long polling: Telegram retiene
+    la petición hasta `timeout` segundos o hasta que llega un update, y entrega
+    hasta `limit` updates de golpe. El offset vive en memoria y se guarda en disco
+    por lotes (cada `checkpoint_every` updates o `checkpoint_interval` segundos).
+    Si el proceso cae entre dos checkpoints, Telegram reenvía esos updates.
+    """
+
+    def __init__(self, timeout=30, limit=100, checkpoint_every=20, checkpoint_interval=30):
+        self.timeout = timeout
+        self.limit = limit
+        self.checkpoint_every = checkpoint_every
+        self.checkpoint_interval = checkpoint_interval
+        self.offset = load_offset()
+        self._saved_offset = self.offset
+        self._unsaved = 0
+        self._last_checkpoint = time.time()
+
+    def poll(self):
+        """Hace una petición getUpdates y devuelve {"status", "messages"} como check_messages."""
+        if not TOKEN:
+            return {"status": "error", "message": "Falta TELEGRAM_BOT_TOKEN en .env"}
+
+        url = f"https://api.telegram.org/bot{TOKEN}/getUpdates"
+        params = {"offset": self.offset, "limit": self.limit, "timeout": self.timeout}
         
+        try:
+            # El timeout de lectura debe superar al del long polling
+            response = SESSION.get(url, params=params, timeout=(10, self.timeout + 15))
+            response.raise_for_status()
+            data = response.json()
+        except requests.exceptions.ReadTimeout:
+            # Timeout de lectura es normal en polling; devolvemos lista vacía para reintentar silenciosamente
+            return {"status": "success", "messages": []}
+        except Exception as e:
+            return {"status": "error", "message": str(e)}
+
+        messages = []
         for result in data.get("result", []):
             update_id = result["update_id"]
             # Solo procesamos mensajes nuevos
-            if update_id >= offset:
-                max_update_id = max(max_update_id, update_id + 1)
-                
-                # Seguridad: Filtrar por CHAT_ID si está definido para ignorar extraños
-                msg_chat_id = str(result.get("message", {}).get("chat", {}).get("id", ""))
-                
-                # Si ALLOWED_USERS es "*", permite a todos. Si no, verifica la lista.
-                if ALLOWED_USERS != "*":
-                    allowed_list = [u.strip() for u in ALLOWED_USERS.split(",") if u.strip()]
-                    if msg_chat_id not in allowed_list:
-                        print(f"⚠️ Ignorando mensaje de {msg_chat_id} (No autorizado. Permitidos: '{ALLOWED_USERS}')", file=sys.stderr)
-                        continue
-                    
-                message = result.get("message", {})
-                text = message.get("text", "")
-                photo = message.get("photo")
-                
-                if text:
-                    messages.append(f"{msg_chat_id}|{text}")
-                elif photo:
-                    # Telegram envía varias resoluciones, la última es la mejor
-                    file_id = photo[-1]["file_id"]
-                    caption = message.get("caption", "") or ""
-                    # Usamos un prefijo especial para identificar fotos en el listener
-                    messages.append(f"{msg_chat_id}|__PHOTO__:{file_id}|||{caption}")
-                elif message.get("document"):
-                    doc = message["document"]
-                    file_id = doc["file_id"]
-                    file_name = doc.get("file_name", "unknown.pdf")
-                    mime_type = doc.get("mime_type", "")
-                    caption = message.get("caption", "") or ""
-                    
-                    # Solo procesamos PDFs por ahora
-                    if "pdf" in mime_type or file_name.lower().endswith(".pdf"):
-                        messages.append(f"{msg_chat_id}|__DOCUMENT__:{file_id}|||{file_name}|||{caption}")
-                elif message.get("voice"):
-                    voice = message["voice"]
-                    file_id = voice["file_id"]
-                    messages.append(f"{msg_chat_id}|__VOICE__:{file_id}")
-        
-        # Guardar nuevo offset para no repetir mensajes
-        if max_update_id > offset:
-            os.makedirs(os.path.dirname(OFFSET_FILE), exist_ok=True)
-            with open(OFFSET_FILE, 'w') as f:
-                f.write(str(max_update_id))
-                
-        print(json.dumps({"status": "success", "messages": messages}))
-        
-    except requests.exceptions.ReadTimeout:
-        # Timeout de lectura es normal en polling; devolvemos lista vacía para reintentar silenciosamente
-        print(json.dumps({"status": "success", "messages": []}))
+            if update_id < self.offset:
+                continue
+            self.offset = update_id + 1
+            self._unsaved += 1
+            parsed = parse_update(result)
+            if parsed:
+                messages.append(parsed)
 
-    except Exception as e:
-        print(json.dumps({"status": "error", "message": str(e)}))
-        sys.exit(1)
+        self.maybe_checkpoint()
+        return {"status": "success", "messages": messages}
+
+    def maybe_checkpoint(self):
+        """Guarda el offset si se acumuló un lote o pasó el intervalo."""
+        if self.offset == self._saved_offset:
+            return
+        if self._unsaved >= self.checkpoint_every or time.time() - self._last_checkpoint >= self.checkpoint_interval:
+            self.checkpoint()
+
+    def checkpoint(self):
+        """Guarda el offset en memoria a disco (llamar también al detener el listener)."""
+        if self.offset != self._saved_offset:
+            save_offset(self.offset)
+            self._saved_offset = self.offset
+        self._unsaved = 0
+        self._last_checkpoint = time.time()
+
+def check_messages():
+    """Consulta nuevos mensajes (polling) manteniendo el estado del offset."""
+    # Modo CLI de una sola consulta: espera corta y el offset se guarda en cada llamada
+    return UpdatePoller(timeout=5, limit=10, checkpoint_every=1).poll()
 
 def get_chat_id():
     """Obtiene el ID del chat del último mensaje recibido para configuración."""
     if not TOKEN:
-        print(json.dumps({"status": "error", "message": "Falta TELEGRAM_BOT_TOKEN en .env"}))
-        sys.exit(1)
+        return {"status": "error", "message": "Falta TELEGRAM_BOT_TOKEN en .env"}
         
     url = f"https://api.telegram.org/bot{TOKEN}/getUpdates"
     
     # Intentar varias veces (polling) para dar tiempo al usuario
     for _ in range(5):
         try:
-            response = requests.get(url, timeout=10)
+            response = SESSION.get(url, timeout=10)
             response.raise_for_status()
             data = response.json()
             
@@ -215,81 +296,114 @@ def get_chat_id():
                 
                 user_list = [{"id": uid, "name": name} for uid, name in users.items()]
                 
-                print(json.dumps({"status": "success", "users": user_list, "message": "Copia el ID del estudiante que necesites."}))
-                return
+                return {"status": "success", "users": user_list, "message": "Copia el ID del estudiante que necesites."}
             
             time.sleep(2) # Esperar 2 segundos antes de reintentar
             
         except Exception as e:
-            print(json.dumps({"status": "error", "message": str(e)}))
-            sys.exit(1)
+            return {"status": "error", "message": str(e)}
             
-    print(json.dumps({"status": "error", "message": "No se encontraron mensajes recientes. Pide al estudiante que envíe 'Hola' a tu bot ANTES de ejecutar esto."}))
-    sys.exit(1)
+    return {"status": "error", "message": "No se encontraron mensajes recientes. Pide al estudiante que envíe 'Hola' a tu bot ANTES de ejecutar esto."}
 
 def download_file(file_id, dest_path):
     """Descarga un archivo desde los servidores de Telegram."""
     if not TOKEN:
-        print(json.dumps({"status": "error", "message": "Falta TELEGRAM_BOT_TOKEN"}))
-        sys.exit(1)
+        return {"status": "error", "message": "Falta TELEGRAM_BOT_TOKEN"}
         
     try:
         # 1. Obtener la ruta del archivo
         info_url = f"https://api.telegram.org/bot{TOKEN}/getFile"
-        res = requests.get(info_url, params={"file_id": file_id}, timeout=10)
+        res = SESSION.get(info_url, params={"file_id": file_id}, timeout=10)
         res.raise_for_status()
         file_path_remote = res.json()["result"]["file_path"]
         
         # 2. Descargar el contenido
         download_url = f"https://api.telegram.org/file/bot{TOKEN}/{file_path_remote}"
-        img_data = requests.get(download_url, timeout=20).content
+        img_data = SESSION.get(download_url, timeout=20).content
         
         with open(dest_path, 'wb') as f:
             f.write(img_data)
             
-        print(json.dumps({"status": "success", "file_path": dest_path}))
+        return {"status": "success", "file_path": dest_path}
     except Exception as e:
-        print(json.dumps({"status": "error", "message": str(e)}))
-        sys.exit(1)
+        return {"status": "error", "message": str(e)}
 
-def main():
+def set_webhook(url, secret_token=None):
+    """Registra la URL pública del webhook. Telegram dejará de aceptar getUpdates."""
+    if not TOKEN:
+        return {"status": "error", "message": "Falta TELEGRAM_BOT_TOKEN"}
+
+    payload = {"url": url, "max_connections": 40, "allowed_updates": ["message"]}
+    if secret_token:
+        payload["secret_token"] = secret_token
+    try:
+        response = SESSION.post(f"https://api.telegram.org/bot{TOKEN}/setWebhook", json=payload, timeout=10)
+        response.raise_for_status()
+        return {"status": "success", "message": f"Webhook registrado en {url}."}
+    except Exception as e:
+        return {"status": "error", "message": str(e)}
+
+def delete_webhook():
+    """Elimina el webhook para volver al modo polling (los updates pendientes se conservan)."""
+    if not TOKEN:
+        return {"status": "error", "message": "Falta TELEGRAM_BOT_TOKEN"}
+
+    try:
+        response = SESSION.post(f"https://api.telegram.org/bot{TOKEN}/deleteWebhook", timeout=10)
+        response.raise_for_status()
+        return {"status": "success", "message": "Webhook eliminado."}
+    except Exception as e:
+        return {"status": "error", "message": str(e)}
+
+def build_parser():
     parser = argparse.ArgumentParser(description="Herramienta de integración con Telegram.")
-    parser.add_argument("--action", choices=["send", "check", "get-id", "download", "send-photo", "send-document", "send-voice"], required=True, help="Acción a realizar.")
+    parser.add_argument("--action", choices=["send", "check", "get-id", "download", "send-photo", "send-document", "send-voice", "set-webhook", "delete-webhook"], required=True, help="Acción a realizar.")
     parser.add_argument("--message", help="Mensaje a enviar (requerido para --action send).")
     parser.add_argument("--chat-id", help="ID del chat destino (opcional, por defecto usa el del .env).")
     parser.add_argument("--file-id", help="ID del archivo a descargar (para --action download).")
     parser.add_argument("--dest", help="Ruta destino (para --action download).")
     parser.add_argument("--file-path", help="Ruta del archivo local a enviar (para --action send-photo).")
     parser.add_argument("--caption", help="Texto para la foto (para --action send-photo).")
-    
-    args = parser.parse_args()
-    
+    parser.add_argument("--url", help="URL pública HTTPS del webhook (para --action set-webhook).")
+    parser.add_argument("--secret-token", default=os.getenv("TELEGRAM_WEBHOOK_SECRET"), help="Token secreto que Telegram enviará en cada update (para --action set-webhook).")
+    return parser
+
+def run(args):
+    """Ejecuta la acción pedida y devuelve el resultado como diccionario (sin imprimir)."""
     if args.action == "send":
-        send_message(args.message or "Notificación vacía", args.chat_id)
+        return send_message(args.message or "Notificación vacía", args.chat_id)
     elif args.action == "send-photo":
         if not args.file_path:
-            print(json.dumps({"status": "error", "message": "Falta argumento --file-path"}))
-            sys.exit(1)
-        send_photo(args.file_path, args.chat_id, args.caption or "")
+            return {"status": "error", "message": "Falta argumento --file-path"}
+        return send_photo(args.file_path, args.chat_id, args.caption or "")
     elif args.action == "send-document":
         if not args.file_path:
-            print(json.dumps({"status": "error", "message": "Falta argumento --file-path"}))
-            sys.exit(1)
-        send_document(args.file_path, args.chat_id, args.caption or "")
+            return {"status": "error", "message": "Falta argumento --file-path"}
+        return send_document(args.file_path, args.chat_id, args.caption or "")
     elif args.action == "send-voice":
         if not args.file_path:
-            print(json.dumps({"status": "error", "message": "Falta argumento --file-path"}))
-            sys.exit(1)
-        send_voice(args.file_path, args.chat_id)
+            return {"status": "error", "message": "Falta argumento --file-path"}
+        return send_voice(args.file_path, args.chat_id)
     elif args.action == "check":
-        check_messages()
+        return check_messages()
     elif args.action == "get-id":
-        get_chat_id()
+        return get_chat_id()
     elif args.action == "download":
         if not args.file_id or not args.dest:
-            print(json.dumps({"status": "error", "message": "Faltan argumentos --file-id o --dest"}))
-            sys.exit(1)
-        download_file(args.file_id, args.dest)
+            return {"status": "error", "message": "Faltan argumentos --file-id o --dest"}
+        return download_file(args.file_id, args.dest)
+    elif args.action == "set-webhook":
+        if not args.url:
+            return {"status": "error", "message": "Falta argumento --url"}
+        return set_webhook(args.url, args.secret_token)
+    elif args.action == "delete-webhook":
+        return delete_webhook()
+
+def main():
+    result = run(build_parser().parse_args())
+    print(json.dumps(result))
+    if result.get("status") == "error":
+        sys.exit(1)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+"""
+Receptor webhook para el listener de Telegram.
+
+Servidor HTTP local que acepta los updates JSON que Telegram envía por POST y
+los entrega al mismo `ChatDispatcher` que usa el modo polling. Los mensajes
+llegan en cuanto se envían y no hay peticiones getUpdates en vacío.
+
+- Verifica la cabecera `X-Telegram-Bot-Api-Secret-Token` (403 si no coincide).
+- Descarta updates repetidos por `update_id` (Telegram reintenta si no recibe 200).
+- Contrapresión: si la cola del dispatcher está llena responde 429 y no marca el
+  update como visto, así Telegram lo reenvía más tarde.
+
+Como script sirve para reproducir updates grabados contra el servidor local:
+    python execution/telegram_webhook.py --replay updates.jsonl --secret-token XYZ
+"""
+import argparse
+import hmac
+import json
+import os
+import sys
+import threading
+import urllib.error
+import urllib.request
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Añadir el directorio actual al path para importar telegram_tool
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from telegram_tool import parse_update
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+DEFAULT_PATH = "/telegram"
+MAX_BODY_BYTES = 1024 * 1024
+
+
+class WebhookServer:
+    """
+    Servidor webhook en un hilo propio.
+
+    `submit(sender_id, content)` recibe el mensaje ya convertido por
+    `telegram_tool.parse_update` y devuelve False si no hay sitio en la cola.
+    Con `port=0` el sistema elige un puerto libre (útil en pruebas).
+    """
+
+    def __init__(self, submit, secret_token, host="127.0.0.1", port=8443, path=DEFAULT_PATH, dedupe_size=1000):
+        if not secret_token:
+            raise ValueError("El webhook necesita un secret_token para verificar el origen de los updates.")
+        self.submit = submit
+        self.secret_token = secret_token
+        self.path = path
+        self.dedupe_size = dedupe_size
+
+        self._seen = OrderedDict()
+        self._lock = threading.Lock()
+        self._thread = None
+        self.counters = {"accepted": 0, "duplicates": 0, "ignored": 0, "rejected": 0, "unauthorized": 0, "invalid": 0}
+
+        self.httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self.httpd.daemon_threads = True
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}{self.path}"
+
+    def _count(self, key):
+        with self._lock:
+            self.counters[key] += 1
+
+    def handle_update(self, update):
+        """Procesa un update y devuelve el código HTTP a responder."""
+        update_id = update.get("update_id")
+        if not isinstance(update_id, int):
+            self._count("invalid")
+            return 400
+
+        with self._lock:
+            if update_id in self._seen:
+                self.counters["duplicates"] += 1
+                return 200
+
+            parsed = parse_update(update)
+            if parsed is None:
+                # No autorizado o tipo no soportado: se confirma para que Telegram no lo reenvíe
+                self._remember(update_id)
+                self.counters["ignored"] += 1
+                return 200
+
+            sender_id, content = parsed.split("|", 1)
+            # submit() no bloquea; hacerlo bajo el lock evita encolar dos veces un reintento concurrente
+            if not self.submit(sender_id, content):
+                self.counters["rejected"] += 1
+                return 429
+
+            self._remember(update_id)
+            self.counters["accepted"] += 1
+            return 200
+
+    def _remember(self, update_id):
+        self._seen[update_id] = True
+        while len(self._seen) > self.dedupe_size:
+            self._seen.popitem(last=False)
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _reply(self, code, extra_headers=None):
+                self.send_response(code)
+                for name, value in (extra_headers or {}).items():
+                    self.send_header(name, value)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def do_POST(self):
+                if self.path != server.path:
+                    return self._reply(404)
+
+                token = self.headers.get(SECRET_HEADER, "")
+                if not hmac.compare_digest(token.encode(), server.secret_token.encode()):
+                    server._count("unauthorized")
+                    return self._reply(403)
+
+                length = int(self.headers.get("Content-Length") or 0)
+                if length <= 0 or length > MAX_BODY_BYTES:
+                    server._count("invalid")
+                    return self._reply(400)
+                try:
+                    update = json.loads(self.rfile.read(length))
+                except (ValueError, UnicodeDecodeError):
+                    server._count("invalid")
+                    return self._reply(400)
+                if not isinstance(update, dict):
+                    server._count("invalid")
+                    return self._reply(400)
+
+                code = server.handle_update(update)
+                self._reply(code, {"Retry-After": "5"} if code == 429 else None)
+
+            def log_message(self, format, *args):
+                # Sin log por petición: el listener ya informa de cada mensaje
+                pass
+
+        return Handler
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name="telegram-webhook", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        if self._thread:
+            self._thread.join()
+
+
+def post_update(url, update, secret_token, timeout=10):
+    """Envía un update grabado al webhook local y devuelve el código HTTP."""
+    request = urllib.request.Request(
+        url,
+        data=json.dumps(update).encode("utf-8"),
+        headers={"Content-Type": "application/json", SECRET_HEADER: secret_token or ""},
+        method="POST",
+    )
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Reproducir updates de Telegram grabados contra el webhook local.")
+    parser.add_argument("--replay", required=True, help="Archivo JSONL con un update de Telegram por línea.")
+    parser.add_argument("--url", default=f"http://127.0.0.1:8443{DEFAULT_PATH}", help="URL del webhook local.")
+    parser.add_argument("--secret-token", default=os.getenv("TELEGRAM_WEBHOOK_SECRET"), help="Token secreto configurado en el listener.")
+    return parser
+
+
+def run(args):
+    """Envía cada update del archivo y resume los códigos de respuesta."""
+    if not os.path.exists(args.replay):
+        return {"status": "error", "message": f"No existe el archivo: {args.replay}"}
+
+    codes = {}
+    try:
+        with open(args.replay, "r", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                code = str(post_update(args.url, json.loads(line), args.secret_token))
+                codes[code] = codes.get(code, 0) + 1
+    except (OSError, ValueError) as e:
+        return {"status": "error", "message": str(e)}
+
+    return {"status": "success", "sent": sum(codes.values()), "responses": codes}
+
+
+def main():
+    result = run(build_parser().parse_args())
+    print(json.dumps(result))
+    if result.get("status") == "error":
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
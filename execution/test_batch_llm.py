@@ -0,0 +1,96 @@
+import batch_llm
+import llm_usage
+import unittest
+import tempfile
+import threading
+import json
+import time
+import sys
+import os
+
+# Add execution dir to path to import the module
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+
+def read_jsonl(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+class TestBatchLLM(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.output = os.path.join(self.tmpdir.name, "resultados.jsonl")
+        self.items = [{"id": str(i), "prompt": f"pregunta {i}"} for i in range(8)]
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_items_run_in_parallel_with_latency_and_cost(self):
+        active, peak, lock = [0], [0], threading.Lock()
+
+        def execute(item):
+            with lock:
+                active[0] += 1
+                peak[0] = max(peak[0], active[0])
+            time.sleep(0.02)
+            llm_usage.record("openai", "gpt-4o-mini", 1000000, 0)
+            with lock:
+                active[0] -= 1
+            return {"status": "success", "content": item["prompt"].upper()}
+
+        summary = batch_llm.run_batch(self.items, self.output, concurrency=3, execute=execute)
+        self.assertEqual((summary["ok"], summary["failed"], summary["skipped"]), (8, 0, 0))
+        self.assertLessEqual(peak[0], 3)
+        self.assertGreater(peak[0], 1)
+        self.assertAlmostEqual(summary["cost_usd"], 8 * 0.15)
+
+        records = read_jsonl(self.output)
+        self.assertEqual(sorted(r["id"] for r in records), sorted(i["id"] for i in self.items))
+        self.assertEqual(records[0]["usage"]["input_tokens"], 1000000)
+        self.assertGreaterEqual(records[0]["latency_s"], 0.02)
+
+    def test_rerun_skips_finished_items_and_retries_failures(self):
+        def flaky(item):
+            if item["id"] == "3":
+                raise RuntimeError("503 Server Error")
+            return {"status": "success", "content": "ok"}
+
+        summary = batch_llm.run_batch(self.items, self.output, execute=flaky)
+        self.assertEqual(summary["status"], "error")
+        self.assertEqual(summary["failed_ids"], ["3"])
+
+        seen = []
+        summary = batch_llm.run_batch(self.items, self.output,
+                                      execute=lambda item: seen.append(item["id"]) or {"status": "success"})
+        self.assertEqual(seen, ["3"])
+        self.assertEqual((summary["ok"], summary["skipped"]), (1, 7))
+
+    def test_items_for_path_skips_tests_and_previous_translations(self):
+        for name in ("modulo.py", "test_modulo.py", "guia.md", "guia_inglés.md"):
+            open(os.path.join(self.tmpdir.name, name), 'w').close()
+        os.mkdir(os.path.join(self.tmpdir.name, "__pycache__"))
+        open(os.path.join(self.tmpdir.name, "__pycache__", "otro.py"), 'w').close()
+
+        tests = batch_llm.items_for_path("tests", self.tmpdir.name)
+        self.assertEqual([os.path.basename(i["file"]) for i in tests], ["modulo.py"])
+
+        translations = batch_llm.items_for_path("translate", self.tmpdir.name, lang="Inglés")
+        self.assertEqual([os.path.basename(i["file"]) for i in translations], ["guia.md"])
+        self.assertEqual(translations[0]["lang"], "Inglés")
+
+    def test_load_items_validates_lines(self):
+        path = os.path.join(self.tmpdir.name, "entrada.jsonl")
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write('{"prompt": "hola"}\n\n{"task": "document", "file": "a.py"}\n')
+        self.assertEqual([i["id"] for i in batch_llm.load_items(path)], ["1", "document:a.py"])
+
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write('{"task": "volar", "file": "a.py"}\n')
+        with self.assertRaises(ValueError):
+            batch_llm.load_items(path)
+
+
+if __name__ == '__main__':
+    unittest.main()
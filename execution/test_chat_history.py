@@ -0,0 +1,111 @@
+import chat_history
+import unittest
+from unittest.mock import patch
+import tempfile
+import json
+import sys
+import os
+
+# Add execution dir to path to import the module
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+
+def turn(role, words):
+    return {"role": role, "content": " ".join(["palabra"] * words)}
+
+
+class TestChatHistory(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.legacy = os.path.join(self.tmpdir.name, "chat_history.json")
+        patcher = patch.object(chat_history, "LEGACY_HISTORY_FILE", self.legacy)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def make(self, chat_id):
+        return chat_history.ChatHistory(chat_id, root=self.tmpdir.name)
+
+    def test_chats_are_isolated_and_appended(self):
+        a, b = self.make(111), self.make(222)
+        a.append({"role": "user", "content": "hola"}, {"role": "assistant", "content": "¿qué tal?"})
+        b.append({"role": "user", "content": "otro chat"})
+        self.assertEqual(a.load(), (None, [{"role": "user", "content": "hola"}, {"role": "assistant", "content": "¿qué tal?"}]))
+        self.assertEqual(len(b.load()[1]), 1)
+        with open(a.path, encoding="utf-8") as f:
+            self.assertEqual(len(f.readlines()), 2)
+        a.clear()
+        self.assertEqual(a.load(), (None, []))
+        self.assertEqual(len(b.load()[1]), 1)
+
+    def test_legacy_history_migrates_to_default_chat(self):
+        with open(self.legacy, "w", encoding="utf-8") as f:
+            json.dump([{"role": "user", "content": "viejo"}], f)
+        self.assertEqual(self.make(None).load()[1], [{"role": "user", "content": "viejo"}])
+        self.assertEqual(self.make(5).load()[1], [])
+
+    def test_window_respects_budget_and_starts_with_user(self):
+        turns = [turn("user", 40), turn("assistant", 40), turn("user", 40), turn("assistant", 40), turn("user", 10)]
+        window = chat_history.window(None, turns, 120)
+        self.assertEqual(window[0]["role"], "user")
+        self.assertEqual(window[-1], turns[-1])
+        self.assertLess(len(window), len(turns))
+        self.assertLessEqual(sum(chat_history.turn_tokens(t) for t in window), 120)
+        # El último mensaje se envía aunque supere el presupuesto
+        self.assertEqual(chat_history.window(None, [turn("user", 500)], 10), [turn("user", 500)])
+
+    def test_turn_tokens_match_the_input_limit_count(self):
+        import prompt_budget
+        text = "El P0340 del Siena 1.4 (sensor de árbol de levas) volvió tras cambiar la correa."
+        self.assertEqual(chat_history.turn_tokens({"role": "user", "content": text}), prompt_budget.count_tokens(text) + 4)
+
+    def test_summary_is_prepended_to_first_message(self):
+        window = chat_history.window("Siena 1.4, código P0300", [turn("user", 3)], 1000)
+        self.assertEqual(len(window), 1)
+        self.assertIn("Siena 1.4, código P0300", window[0]["content"])
+        self.assertTrue(window[0]["content"].endswith("palabra palabra palabra"))
+
+    def test_history_budget_per_provider(self):
+        self.assertLess(chat_history.history_budget("groq"), chat_history.history_budget("gemini"))
+        with patch.dict(os.environ, {"LLM_HISTORY_TOKENS_GROQ": "500"}):
+            self.assertEqual(chat_history.history_budget("groq"), 500)
+
+    @patch.object(chat_history, "COMPACT_AT_TOKENS", 200)
+    @patch.object(chat_history, "KEEP_RECENT_TOKENS", 300)
+    def test_compact_summarizes_old_turns_and_keeps_recent(self):
+        store = self.make(7)
+        turns = [turn("user" if i % 2 == 0 else "assistant", 60) for i in range(6)]
+        store.append(*turns)
+        seen = []
+
+        def summarize(previous, old):
+            seen.append((previous, old))
+            store.append({"role": "user", "content": "llegó durante el resumen"})
+            return "resumen"
+
+        self.assertTrue(store.compact(summarize))
+        summary, kept = store.load()
+        self.assertEqual(summary, "resumen")
+        self.assertIsNone(seen[0][0])
+        self.assertEqual(seen[0][1] + kept[:-1], turns)
+        self.assertEqual(kept[-1]["content"], "llegó durante el resumen")
+        self.assertEqual(kept[0]["role"], "user")
+
+    @patch.object(chat_history, "COMPACT_AT_TOKENS", 200)
+    def test_failed_summary_keeps_history(self):
+        store = self.make(8)
+        turns = [turn("user" if i % 2 == 0 else "assistant", 60) for i in range(6)]
+        store.append(*turns)
+
+        def summarize(previous, old):
+            raise RuntimeError("sin proveedores")
+
+        self.assertFalse(store.compact(summarize))
+        self.assertEqual(store.load(), (None, turns))
+
+
+if __name__ == '__main__':
+    unittest.main()
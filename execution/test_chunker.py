@@ -0,0 +1,51 @@
+import chunker
+import unittest
+import sys
+import os
+
+# Add execution dir to path to import the module
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+PAGE = """MOTOR 1.8
+2.1 Torques de apriete
+Culata, primera etapa ........ 25 Nm
+Culata, segunda etapa ........ 60 grados
+Bielas    35 Nm    +45 grados
+
+El apriete debe realizarse en frío. Use siempre tornillos nuevos.
+
+DTC P0340
+1. Verificar el conector del sensor de fase
+2. Medir la resistencia del sensor y"""
+
+
+class TestChunker(unittest.TestCase):
+
+    def test_blocks_detect_headings_tables_and_paragraphs(self):
+        kinds = [kind for kind, _, _ in chunker.split_blocks(PAGE)]
+        self.assertEqual(kinds, ["heading", "heading", "table", "paragraph", "heading", "paragraph"])
+
+    def test_chunks_do_not_cross_sections(self):
+        chunks, section, carry = chunker.chunk_page(PAGE)
+        self.assertEqual([c["section"] for c in chunks], ["2.1 Torques de apriete", "DTC P0340"])
+        self.assertIn("Bielas    35 Nm", chunks[0]["text"])
+        start, end = chunks[1]["char_span"]
+        self.assertTrue(PAGE[start:end].startswith("1. Verificar"))
+        # La sección y la frase abierta pasan a la página siguiente
+        self.assertEqual(section, "DTC P0340")
+        self.assertEqual(carry, "1. Verificar el conector del sensor de fase\n2. Medir la resistencia del sensor y")
+
+    def test_next_page_gets_section_and_carry(self):
+        chunks, _, _ = chunker.chunk_page("compararla con la tabla.", section="DTC P0340", carry="Medir la resistencia y")
+        self.assertEqual(chunks[0]["text"], "DTC P0340\nMedir la resistencia y\ncompararla con la tabla.")
+
+    def test_oversized_paragraph_is_split_by_token_budget(self):
+        text = " ".join(f"Frase número {i} sobre el motor." for i in range(200))
+        chunks, _, _ = chunker.chunk_page(text, max_tokens=100)
+        self.assertTrue(all(chunker.estimate_tokens(c["text"]) <= 100 for c in chunks))
+        self.assertTrue(all(c["text"].endswith(".") for c in chunks))
+        self.assertEqual(" ".join(c["text"] for c in chunks), text)
+
+
+if __name__ == '__main__':
+    unittest.main()
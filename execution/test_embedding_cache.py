@@ -0,0 +1,94 @@
+import embedding_cache
+import unittest
+import tempfile
+import sys
+import os
+
+# Add execution dir to path to import the module
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+
+class FakeEmbedding:
+    """Función de embeddings de prueba que cuenta los textos embebidos."""
+
+    def __init__(self, model="fake"):
+        self.model = model
+        self.calls = []
+
+    def name(self):
+        return self.model
+
+    def __call__(self, texts):
+        self.calls.append(list(texts))
+        return [[float(len(t)), 0.5] for t in texts]
+
+
+class TestEmbeddingCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, "embeddings.sqlite")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_repeated_texts_are_embedded_once(self):
+        cache = embedding_cache.EmbeddingCache(self.path)
+        fn = FakeEmbedding()
+        first = cache.embed(fn, ["P0340 siena", "ruido motor"])
+        second = cache.embed(fn, ["ruido motor", "P0340 siena", "nuevo"])
+        self.assertEqual(fn.calls, [["P0340 siena", "ruido motor"], ["nuevo"]])
+        self.assertEqual(second[:2], [first[1], first[0]])
+        stats = cache.stats()
+        self.assertEqual((stats["memory_hits"], stats["misses"]), (2, 3))
+
+    def test_disk_cache_survives_new_instance(self):
+        embedding_cache.EmbeddingCache(self.path).embed(FakeEmbedding(), ["mantenimiento servicio 60000 km"])
+        cache = embedding_cache.EmbeddingCache(self.path)
+        fn = FakeEmbedding()
+        self.assertEqual(cache.embed(fn, ["mantenimiento servicio 60000 km"]), [[31.0, 0.5]])
+        self.assertEqual(fn.calls, [])
+        self.assertEqual(cache.stats()["disk_hits"], 1)
+
+    def test_model_name_is_part_of_the_key(self):
+        cache = embedding_cache.EmbeddingCache(self.path)
+        cache.embed(FakeEmbedding("a"), ["hola"])
+        other = FakeEmbedding("b")
+        cache.embed(other, ["hola"])
+        self.assertEqual(other.calls, [["hola"]])
+
+    def test_memory_tier_is_bounded(self):
+        cache = embedding_cache.EmbeddingCache(self.path, max_items=2)
+        cache.embed(FakeEmbedding(), ["a", "bb", "ccc"])
+        self.assertEqual(cache.stats()["items_in_memory"], 2)
+
+
+    def test_disk_tier_drops_least_recently_used_rows(self):
+        clock = FakeClock()
+        cache = embedding_cache.EmbeddingCache(self.path, max_items=1, max_disk_items=2, clock=clock)
+        fn = FakeEmbedding()
+        cache.embed(fn, ["uno"])
+        clock.now += 1
+        cache.embed(fn, ["dos"])
+        clock.now += 1
+        cache.embed(fn, ["uno"])  # leído de disco: pasa a ser el más reciente
+        clock.now += 1
+        cache.embed(fn, ["tres"])
+        self.assertEqual(cache.stats()["evicted_from_disk"], 1)
+
+        fresh = embedding_cache.EmbeddingCache(self.path)
+        other = FakeEmbedding()
+        fresh.embed(other, ["uno", "dos", "tres"])
+        self.assertEqual(other.calls, [["dos"]])
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,118 @@
+import ingest_manual
+import memory_service
+import unittest
+from unittest.mock import patch, MagicMock
+import tempfile
+import sys
+import os
+
+# Add execution dir to path to import the module
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+
+def fake_pages(page_texts):
+    """Sustituto de pdf_extract.iter_pages que devuelve textos fijos."""
+    def iter_pages(path, start_page=1, digest=None):
+        for number, text in enumerate(page_texts, start=1):
+            if number >= start_page:
+                yield number, text
+    return MagicMock(side_effect=iter_pages)
+
+
+def fake_embed(self, texts, name=None):
+    return [[float(len(t)), 1.0] for t in texts]
+
+
+class TestIncrementalIngest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmpdir.name, "chroma_db")
+        self.pdf = os.path.join(self.tmpdir.name, "manual.pdf")
+        patcher = patch.object(memory_service.MemoryService, 'embed', fake_embed)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        memory_service._SERVICES.pop(self.db_path, None)
+        self.tmpdir.cleanup()
+
+    def ingest(self, page_texts, version, *extra):
+        with open(self.pdf, 'w') as f:
+            f.write(version)
+        args = ingest_manual.build_parser().parse_args(["--file", self.pdf, "--db-path", self.db_path, *extra])
+        with patch.object(ingest_manual, 'iter_pages', fake_pages(page_texts)) as reader:
+            result = ingest_manual.run(args)
+        return result, reader
+
+    def stored_ids(self):
+        return set(memory_service.get_collection(self.db_path).get()["ids"])
+
+    def test_reingest_same_file_is_a_no_op(self):
+        first, _ = self.ingest(["página uno", "página dos"], "v1")
+        self.assertEqual(first["chunks_added"], 2)
+        second, reader = self.ingest(["página uno", "página dos"], "v1")
+        reader.assert_not_called()
+        self.assertEqual(second["chunks_added"], 0)
+        self.assertEqual(len(self.stored_ids()), 2)
+
+    def test_new_chunking_settings_reprocess_the_same_file(self):
+        self.ingest(["página uno", "página dos"], "v1")
+        result, reader = self.ingest(["página uno", "página dos"], "v1", "--max-tokens", "50")
+        reader.assert_called_once()
+        self.assertEqual(result["pages_changed"], 2)
+        with patch.object(ingest_manual.chunker, 'VERSION', ingest_manual.chunker.VERSION + 1):
+            result, reader = self.ingest(["página uno", "página dos"], "v1", "--max-tokens", "50")
+        reader.assert_called_once()
+        self.assertEqual(result["pages_changed"], 2)
+
+    def test_only_changed_pages_are_processed_and_orphans_removed(self):
+        self.ingest(["página uno", "página dos", "página tres"], "v1")
+        before = self.stored_ids()
+        result, _ = self.ingest(["página uno", "página DOS editada"], "v2")
+        self.assertEqual((result["pages_changed"], result["pages_removed"]), (1, 1))
+        self.assertEqual((result["chunks_added"], result["chunks_deleted"]), (1, 2))
+        after = self.stored_ids()
+        self.assertEqual(len(after), 2)
+        self.assertEqual(len(before & after), 1)
+
+    def test_interrupted_ingest_resumes_from_last_batch(self):
+        collection = memory_service.get_collection(self.db_path)
+        real_upsert = collection.upsert
+        calls = []
+
+        def flaky_upsert(**kwargs):
+            calls.append(kwargs["ids"])
+            if len(calls) == 2:
+                raise RuntimeError("disco lleno")
+            return real_upsert(**kwargs)
+
+        pages = ["uno", "dos", "tres"]
+        with open(self.pdf, 'w') as f:
+            f.write("v1")
+        args = ingest_manual.build_parser().parse_args(["--file", self.pdf, "--db-path", self.db_path, "--batch-size", "1"])
+        with patch.object(collection, 'upsert', side_effect=flaky_upsert), \
+                patch.object(ingest_manual, 'iter_pages', fake_pages(pages)):
+            failed = ingest_manual.run(args)
+        self.assertEqual(failed["status"], "error")
+        self.assertEqual(len(self.stored_ids()), 1)
+
+        with patch.object(ingest_manual, 'iter_pages', fake_pages(pages)):
+            resumed = ingest_manual.run(args)
+        self.assertEqual(resumed["resumed_from_page"], 2)
+        self.assertEqual(resumed["chunks_added"], 3)
+        self.assertEqual(len(self.stored_ids()), 3)
+
+    def test_chunks_carry_section_and_span_metadata(self):
+        self.ingest(["2.1 Torques de apriete\nCulata ........ 25 Nm"], "v1")
+        metadatas = memory_service.get_collection(self.db_path).get()["metadatas"]
+        self.assertEqual(metadatas[0]["section"], "2.1 Torques de apriete")
+        self.assertEqual(metadatas[0]["char_span"], "23:44")
+
+    def test_chunk_ids_are_content_addressed(self):
+        self.assertEqual(ingest_manual.chunk_id("m.pdf", 1, "abc"), ingest_manual.chunk_id("m.pdf", 1, "abc"))
+        self.assertNotEqual(ingest_manual.chunk_id("m.pdf", 1, "abc"), ingest_manual.chunk_id("m.pdf", 2, "abc"))
+
+
+if __name__ == '__main__':
+    unittest.main()
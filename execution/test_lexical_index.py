@@ -0,0 +1,78 @@
+import lexical_index
+import unittest
+import tempfile
+import sys
+import os
+
+# Add execution dir to path to import the module
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+
+class TestLexicalIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.index = lexical_index.LexicalIndex(os.path.join(self.tmpdir.name, "index.sqlite"))
+        self.docs = {
+            "a": "Código P0340: sensor de posición del árbol de levas. Revisar el conector.",
+            "b": "Código P0335: sensor de posición del cigüeñal.",
+            "c": "Apriete de las bujías: 25 Nm. Pieza 55-1234.",
+            "d": "Cambio de aceite y filtros cada 10000 km.",
+        }
+        self.index.upsert("mem", list(self.docs), list(self.docs.values()))
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_tokenize_keeps_codes_and_folds_accents(self):
+        terms = lexical_index.tokenize("Bujías del P0340, pieza 55-1234 a 1.8")
+        self.assertIn("p0340", terms)
+        self.assertIn("bujia", terms)
+        self.assertIn("55-1234", terms)
+        self.assertIn("1234", terms)
+        self.assertIn("1.8", terms)
+        self.assertNotIn("del", terms)
+
+    def test_exact_code_ranks_first(self):
+        hits = self.index.search("mem", "qué significa el P0340")
+        self.assertEqual([doc_id for doc_id, _ in hits], ["a"])
+        self.assertEqual(self.index.search("mem", "bujia")[0][0], "c")
+        self.assertEqual(self.index.search("mem", "1234")[0][0], "c")
+
+    def test_upsert_and_delete_keep_postings_in_sync(self):
+        self.index.upsert("mem", ["a"], ["Nada que ver: limpieza del acelerador."])
+        self.assertEqual(self.index.search("mem", "P0340"), [])
+        self.index.delete("mem", ["c"])
+        self.assertEqual(self.index.search("mem", "bujías"), [])
+        self.assertEqual(self.index.count("mem"), 3)
+        self.assertEqual(self.index.count("otra"), 0)
+
+    def test_search_can_be_restricted_to_types(self):
+        self.index.upsert("mem", ["nota"], ["Hoy cambié el sensor P0340"], [{"type": "note"}])
+        self.index.upsert("mem", ["a"], [self.docs["a"]], [{"type": "manual"}])
+        self.assertEqual([i for i, _ in self.index.search("mem", "P0340", types=["manual"])], ["a"])
+        self.assertEqual([i for i, _ in self.index.search("mem", "P0340", types=["note"])], ["nota"])
+        self.assertEqual(len(self.index.search("mem", "P0340")), 2)
+
+    def test_recent_pages_with_cursor(self):
+        self.index.upsert("mem", ["n1", "n2", "n3"], ["uno", "dos", "tres"],
+                          [{"type": "note", "timestamp": f"2026-01-0{i}"} for i in (1, 2, 3)])
+        first = self.index.recent("mem", 2, types=["note"])
+        self.assertEqual([i for i, _ in first], ["n3", "n2"])
+        self.assertEqual(self.index.recent("mem", 2, types=["note"], after=first[-1]), [("n1", "2026-01-01")])
+
+    def test_match_finds_word_prefixes_including_plurals(self):
+        self.assertEqual(self.index.match("mem", "Bujías"), {"c"})
+        self.assertEqual(self.index.match("mem", "sensor de pos"), {"a", "b"})
+        self.assertEqual(self.index.match("mem", "filtro"), {"d"})
+        self.assertEqual(self.index.match("mem", "fren"), set())
+        self.assertIsNone(self.index.match("mem", "de la"))
+
+    def test_rrf_rewards_agreement_between_rankings(self):
+        fused = lexical_index.rrf_fuse([["x", "y", "z"], ["y", "w"]])
+        self.assertEqual(fused[0][0], "y")
+        self.assertEqual({doc_id for doc_id, _ in fused}, {"x", "y", "z", "w"})
+
+
+if __name__ == '__main__':
+    unittest.main()
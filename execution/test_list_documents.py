@@ -0,0 +1,67 @@
+import list_documents
+import ingest_manual
+import memory_service
+import unittest
+from unittest.mock import patch, MagicMock
+import tempfile
+import sys
+import os
+
+# Add execution dir to path to import the module
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+
+def fake_iter_pages(path, start_page=1, digest=None):
+    for number, text in enumerate(["página uno", "página dos"], start=1):
+        if number >= start_page:
+            yield number, text
+
+
+def fake_embed(self, texts, name=None):
+    return [[float(len(t)), 1.0] for t in texts]
+
+
+class TestListDocuments(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmpdir.name, "chroma_db")
+        patcher = patch.object(memory_service.MemoryService, 'embed', fake_embed)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        memory_service._SERVICES.pop(self.db_path, None)
+        self.tmpdir.cleanup()
+
+    def list(self):
+        return list_documents.run(list_documents.build_parser().parse_args(["--db-path", self.db_path]))
+
+    def test_lists_ingested_manuals_without_reading_chunk_metadata(self):
+        for name in ("siena.pdf", "palio.pdf"):
+            pdf = os.path.join(self.tmpdir.name, name)
+            with open(pdf, 'w') as f:
+                f.write(name)
+            args = ingest_manual.build_parser().parse_args(["--file", pdf, "--db-path", self.db_path])
+            with patch.object(ingest_manual, 'iter_pages', MagicMock(side_effect=fake_iter_pages)):
+                self.assertEqual(ingest_manual.run(args)["status"], "success")
+
+        with patch.object(memory_service.MemoryService, 'collection') as collection:
+            result = self.list()
+        collection.assert_not_called()
+        self.assertEqual(result["status"], "success")
+        self.assertEqual([d["name"] for d in result["documents"]], ["palio.pdf", "siena.pdf"])
+        self.assertEqual(result["documents"][0]["pages"], 2)
+        self.assertTrue(result["documents"][0]["ingested_at"])
+
+    def test_partial_ingests_are_not_listed(self):
+        manifest = ingest_manual.manifest_path(self.db_path, memory_service.COLLECTION_NAME, "a_medias.pdf")
+        ingest_manual.save_manifest(manifest[:-len(".json")] + ".partial.json", {"file_hash": "x", "pages": {}})
+        self.assertEqual(self.list(), {"status": "success", "documents": []})
+
+    def test_no_manifests_means_no_documents(self):
+        self.assertEqual(self.list(), {"status": "success", "documents": []})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+import chat_with_llm
+import llm_transport
+from mock_llm_server import MockLLMServer
+import unittest
+from unittest.mock import patch
+import sys
+import os
+
+# Add execution dir to path to import the module
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+
+class TestLLMTransport(unittest.TestCase):
+
+    def setUp(self):
+        self.server = MockLLMServer().start()
+        self.addCleanup(self.server.stop)
+        env = {
+            "OPENAI_BASE_URL": self.server.base_url,
+            "ANTHROPIC_BASE_URL": self.server.base_url,
+            "GROQ_BASE_URL": self.server.base_url,
+            "OPENAI_API_KEY": "test",
+            "ANTHROPIC_API_KEY": "test",
+            "GROQ_API_KEY": "test",
+        }
+        env_patcher = patch.dict(os.environ, env)
+        env_patcher.start()
+        self.addCleanup(env_patcher.stop)
+        # Transporte propio por prueba, sin esperas reales entre reintentos
+        self.transport = llm_transport.ProviderTransport(max_retries=2, backoff_base=0.01)
+        transport_patcher = patch.object(chat_with_llm, 'get_transport', return_value=self.transport)
+        transport_patcher.start()
+        self.addCleanup(transport_patcher.stop)
+
+    def test_providers_parse_mock_responses(self):
+        messages = [{"role": "user", "content": "hola"}]
+        self.assertEqual(chat_with_llm.chat_openai(messages), {"content": "eco: hola"})
+        self.assertEqual(chat_with_llm.chat_anthropic(messages), {"content": "eco: hola"})
+        self.assertEqual(chat_with_llm.chat_groq(messages), {"content": "eco: hola"})
+        self.assertEqual(self.server.requests[1]["path"], "/v1/messages")
+
+    def test_keep_alive_reuses_connection(self):
+        for i in range(3):
+            chat_with_llm.chat_openai([{"role": "user", "content": str(i)}])
+        self.assertEqual(self.server.connections, 1)
+
+    def test_retries_on_503_and_429(self):
+        self.server.fail_next(503)
+        self.server.fail_next(429, retry_after=0)
+        result = chat_with_llm.chat_openai([{"role": "user", "content": "hola"}])
+        self.assertEqual(result, {"content": "eco: hola"})
+        self.assertEqual(self.transport.stats["retries"], 2)
+
+    def test_gives_up_after_max_retries(self):
+        self.server.fail_next(500, count=5)
+        result = chat_with_llm.chat_groq([{"role": "user", "content": "hola"}])
+        self.assertIn("Groq API Error (500)", result["error"])
+        self.assertEqual(len(self.server.requests), 3)
+
+    def test_client_errors_are_not_retried(self):
+        self.server.fail_next(401)
+        result = chat_with_llm.chat_anthropic([{"role": "user", "content": "hola"}])
+        self.assertIn("401", result["error"])
+        self.assertEqual(self.transport.stats["retries"], 0)
+
+    def test_streaming_yields_deltas_in_order(self):
+        messages = [{"role": "user", "content": "cambia el aceite"}]
+        for chat in (chat_with_llm.chat_openai, chat_with_llm.chat_anthropic, chat_with_llm.chat_groq):
+            deltas = []
+            result = chat(messages, on_delta=deltas.append)
+            self.assertEqual(result, {"content": "eco: cambia el aceite"})
+            self.assertEqual(deltas, ["eco:", " cambia", " el", " aceite"])
+        self.assertTrue(all(r["json"]["stream"] for r in self.server.requests))
+
+
+class TestIterSSE(unittest.TestCase):
+
+    def test_parses_events_comments_and_done(self):
+        class FakeResponse:
+            def iter_lines(self, chunk_size=None):
+                return iter([b": ping", b"event: delta", b'data: {"a": 1}', b"", b"data: texto",
+                             b"", b"data: [DONE]", b"", b'data: {"tarde": true}', b""])
+        self.assertEqual(list(llm_transport.iter_sse(FakeResponse())), [("delta", {"a": 1}), (None, "texto")])
+
+
+if __name__ == '__main__':
+    unittest.main()
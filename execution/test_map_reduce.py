@@ -0,0 +1,85 @@
+import map_reduce
+import unittest
+import tempfile
+import threading
+import time
+import sys
+import os
+
+# Add execution dir to path to import the module
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+TEMPLATE = "Traduce ({index}/{total}):\n{payload}"
+
+
+def payload_of(prompt):
+    return prompt.split("\n", 1)[1]
+
+
+class TestMapReduce(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.text = "\n\n".join(f"párrafo {i} " + "palabra " * 30 for i in range(20))
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def make(self, call, **kwargs):
+        return map_reduce.MapReduce(call, cache_dir=self.tmpdir.name, **kwargs)
+
+    def test_translation_is_reassembled_in_order_with_parallel_calls(self):
+        active, peak, lock = [0], [0], threading.Lock()
+
+        def call(prompt):
+            with lock:
+                active[0] += 1
+                peak[0] = max(peak[0], active[0])
+            time.sleep(0.02)
+            with lock:
+                active[0] -= 1
+            return payload_of(prompt).upper()
+
+        engine = self.make(call, concurrency=4)
+        result = engine.translate(self.text, TEMPLATE, 100)
+        expected = "\n\n".join(c.strip().upper() for c in map_reduce.split_to_tokens(self.text, 100) if c.strip())
+        self.assertEqual(result, expected)
+        self.assertGreater(peak[0], 1)
+        self.assertLessEqual(peak[0], 4)
+        self.assertEqual(os.listdir(self.tmpdir.name), [])  # caché borrada al terminar
+
+    def test_failed_run_resumes_without_redoing_finished_chunks(self):
+        calls = []
+
+        def flaky(prompt):
+            calls.append(prompt)
+            if "(3/" in prompt:
+                raise RuntimeError("503 Server Error")
+            return payload_of(prompt)
+
+        with self.assertRaises(RuntimeError) as ctx:
+            self.make(flaky).translate(self.text, TEMPLATE, 100)
+        self.assertIn("el 3", str(ctx.exception))
+        total = len(calls)
+
+        resumed = []
+        engine = self.make(lambda prompt: resumed.append(prompt) or payload_of(prompt))
+        engine.translate(self.text, TEMPLATE, 100)
+        self.assertEqual(len(resumed), 1)
+        self.assertIn("(3/", resumed[0])
+        self.assertEqual(engine.stats["cached"], total - 1)
+
+    def test_condense_repeats_rounds_until_notes_fit(self):
+        engine = self.make(lambda prompt: "nota " * 40)
+        notes = engine.condense(self.text, target_tokens=60, chunk_tokens=200)
+        self.assertLessEqual(map_reduce.count_tokens(notes), 60)
+        self.assertGreater(engine.stats["rounds"], 1)
+
+    def test_condense_for_prompt_passes_small_documents_through(self):
+        engine = self.make(lambda prompt: self.fail("no debería llamar al LLM"))
+        text, stats = map_reduce.condense_for_prompt("Resume:\n{payload}", "documento corto", engine=engine)
+        self.assertEqual((text, stats), ("documento corto", None))
+
+
+if __name__ == '__main__':
+    unittest.main()
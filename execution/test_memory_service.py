@@ -0,0 +1,185 @@
+import memory_service
+import embedding_cache
+import unittest
+import asyncio
+from unittest.mock import patch, MagicMock
+import tempfile
+import hashlib
+import sys
+import os
+
+# Add execution dir to path to import the module
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+
+class FakeEmbedding:
+    """Embeddings deterministas sin descargar modelos (vectores sin relación semántica)."""
+
+    def __call__(self, input):
+        return [[b / 255 for b in hashlib.sha256(text.encode("utf-8")).digest()[:8]] for text in input]
+
+    @staticmethod
+    def name():
+        return "fake"
+
+
+@unittest.skipIf(memory_service.chromadb is None, "chromadb no instalado")
+class TestMemoryService(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmpdir.name, "chroma_db")
+
+    def tearDown(self):
+        memory_service._SERVICES.pop(self.db_path, None)
+        self.tmpdir.cleanup()
+
+    def test_collection_handle_is_reused(self):
+        with patch.object(memory_service.chromadb, 'PersistentClient', wraps=memory_service.chromadb.PersistentClient) as mock_client:
+            first = memory_service.get_collection(self.db_path)
+            second = memory_service.get_collection(self.db_path)
+        self.assertIs(first, second)
+        mock_client.assert_called_once()
+        self.assertEqual(memory_service.get_service(self.db_path).metrics["collections_opened"], 1)
+
+    def test_relative_and_absolute_paths_share_service(self):
+        cwd = os.getcwd()
+        os.chdir(self.tmpdir.name)
+        try:
+            relative = memory_service.get_service("chroma_db")
+        finally:
+            os.chdir(cwd)
+        self.assertIs(relative, memory_service.get_service(self.db_path))
+
+    def test_warmup_loads_embeddings_and_records_metric(self):
+        service = memory_service.get_service(self.db_path)
+        collection = MagicMock()
+        collection.count.return_value = 0
+        service._collections[memory_service.COLLECTION_NAME] = collection
+        elapsed = service.warmup()
+        collection._embedding_function.assert_called_once_with(["warmup"])
+        self.assertEqual(service.metrics["warmup_s"], round(elapsed, 4))
+
+    def _service_with_fake_embeddings(self):
+        cache = embedding_cache.EmbeddingCache(os.path.join(self.tmpdir.name, "embeddings.sqlite"))
+        patcher = patch.object(memory_service, "get_cache", return_value=cache)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        service = memory_service.get_service(self.db_path)
+        service._collections[memory_service.COLLECTION_NAME] = service.client.get_or_create_collection(
+            memory_service.COLLECTION_NAME, embedding_function=FakeEmbedding())
+        return service
+
+    def test_hybrid_query_finds_exact_codes_and_index_follows_writes(self):
+        service = self._service_with_fake_embeddings()
+        docs = [f"Procedimiento general {i} de motor y frenos" for i in range(30)]
+        docs.append("Código P0340: sensor de posición del árbol de levas.")
+        service.add(ids=[str(i) for i in range(len(docs))], documents=docs)
+
+        results, timings = service.hybrid_query("qué significa P0340", n_results=3)
+        self.assertIn("30", [r["id"] for r in results])
+        hit = next(r for r in results if r["id"] == "30")
+        self.assertGreater(hit["bm25"], 0)
+        self.assertIn("P0340", hit["document"])
+        self.assertIn("lexical_ms", timings)
+
+        service.delete(ids=["30"])
+        results, _ = service.hybrid_query("P0340", n_results=3)
+        self.assertNotIn("30", [r["id"] for r in results])
+
+    def test_lexical_index_is_rebuilt_from_existing_collection(self):
+        service = self._service_with_fake_embeddings()
+        # Escritura directa en ChromaDB, sin pasar por el servicio (base anterior al índice)
+        service.collection().add(ids=["x"], documents=["Pieza 46817592 del Siena"])
+        self.assertTrue(service.sync_lexical())
+        self.assertEqual(service.lexical.search(memory_service.COLLECTION_NAME, "46817592")[0][0], "x")
+        self.assertFalse(service.sync_lexical())
+
+
+    def test_hybrid_query_only_searches_requested_types(self):
+        service = self._service_with_fake_embeddings()
+        service.add(ids=["nota", "manual"],
+                    documents=["Cambié el sensor P0340 el martes", "P0340: sensor del árbol de levas, conector C12"],
+                    metadatas=[{"type": "note"}, {"type": "manual", "source": "siena.pdf"}])
+
+        results, _ = service.hybrid_query("P0340", n_results=3, types=["manual"])
+        self.assertEqual([r["id"] for r in results], ["manual"])
+        results, _ = service.hybrid_query("P0340", n_results=3, types=["note", "fact"])
+        self.assertEqual([r["id"] for r in results], ["nota"])
+
+    def test_legacy_memories_are_tagged_once(self):
+        service = self._service_with_fake_embeddings()
+        # Recuerdos anteriores al campo `type`, escritos directamente en ChromaDB
+        service.collection().add(ids=["a", "b"], documents=["Nota suelta", "Página del manual"],
+                                 metadatas=[{"category": "telegram_note"}, {"source": "siena.pdf", "page": 3}])
+        service.ensure_ready()
+        data = service.collection().get(ids=["a", "b"], include=["metadatas"])
+        self.assertEqual([m["type"] for m in data["metadatas"]], ["note", "manual"])
+        self.assertEqual(service.metrics["typed_legacy"], 2)
+        self.assertEqual(service.lexical.search(memory_service.COLLECTION_NAME, "manual", types=["manual"])[0][0], "b")
+        self.assertEqual(service.migrate_types(), 0)
+
+    def test_list_recent_pages_by_timestamp_and_find_text_uses_index(self):
+        service = self._service_with_fake_embeddings()
+        service.add(ids=[f"n{i}" for i in range(5)] + ["m"],
+                    documents=[f"Nota {i} sobre la cita del dentista" for i in range(5)] + ["Manual: dentista no aplica"],
+                    metadatas=[{"type": "note", "timestamp": f"2026-03-0{i + 1}T10:00:00"} for i in range(5)]
+                    + [{"type": "manual", "timestamp": "2026-03-09T10:00:00"}])
+
+        page, cursor = service.list_recent(limit=2, types=["note"])
+        self.assertEqual([m["id"] for m in page], ["n4", "n3"])
+        self.assertIn("dentista", page[0]["content"])
+        page, cursor = service.list_recent(limit=2, types=["note"], cursor=cursor)
+        self.assertEqual([m["id"] for m in page], ["n2", "n1"])
+        page, cursor = service.list_recent(limit=2, types=["note"], cursor=cursor)
+        self.assertEqual(([m["id"] for m in page], cursor), (["n0"], None))
+        with self.assertRaises(ValueError):
+            service.list_recent(cursor="no-es-un-cursor")
+
+        with patch.object(service.collection(), "get", wraps=service.collection().get) as get:
+            self.assertEqual(service.find_text("Nota 3"), ["n3"])
+        # Solo se leen de ChromaDB los candidatos del índice, no toda la colección
+        self.assertEqual(get.call_args.kwargs["ids"], ["n3"])
+        self.assertEqual(sorted(service.find_text("dentista", types=["manual"])), ["m"])
+
+    def test_concurrent_queries_share_embedding_and_chromadb_calls(self):
+        service = self._service_with_fake_embeddings()
+        service._batcher.window_s = 0.2
+        service.add(ids=["a", "b", "c"], documents=["P0300 fallo de encendido", "P0171 mezcla pobre", "Cita dentista"],
+                    metadatas=[{"type": "manual"}, {"type": "manual"}, {"type": "note"}])
+        collection = service.collection()
+
+        async def lookups():
+            return await asyncio.gather(service.ahybrid_query("P0300", types=["manual"]),
+                                        service.ahybrid_query("P0171", types=["manual"]),
+                                        service.aquery(["dentista"], n_results=1))
+
+        embedding_function = collection._embedding_function
+        with patch.object(collection, "query", wraps=collection.query) as query, \
+                patch.object(collection, "_embedding_function", wraps=embedding_function) as embed:
+            p0300, p0171, note = asyncio.run(lookups())
+        self.assertEqual(p0300[0][0]["id"], "a")
+        self.assertEqual(p0171[0][0]["id"], "b")
+        self.assertEqual(len(note["ids"]), 1)
+        # Un cálculo de embeddings para las tres consultas y un query por filtro (manual / sin filtro)
+        self.assertEqual(embed.call_count, 1)
+        self.assertEqual(query.call_count, 2)
+
+    def test_hybrid_query_many_matches_single_queries(self):
+        service = self._service_with_fake_embeddings()
+        service.add(ids=["a", "b"], documents=["P0300 fallo de encendido", "P0171 mezcla pobre"])
+        many = service.hybrid_query_many(["P0300", "P0171"], n_results=1)
+        self.assertEqual([results[0]["id"] for results, _ in many], ["a", "b"])
+        self.assertEqual(many[0][0], service.hybrid_query("P0300", n_results=1)[0])
+
+    def test_parse_types(self):
+        self.assertIsNone(memory_service.parse_types("all"))
+        self.assertEqual(memory_service.parse_types("manual, note"), ["manual", "note"])
+        self.assertEqual(memory_service.type_filter(["manual", "note"]), {"type": {"$in": ["manual", "note"]}})
+        self.assertIsNone(memory_service.type_filter(list(memory_service.MEMORY_TYPES)))
+        with self.assertRaises(ValueError):
+            memory_service.parse_types("manual,recetas")
+
+
+if __name__ == '__main__':
+    unittest.main()
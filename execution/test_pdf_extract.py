@@ -0,0 +1,68 @@
+import pdf_extract
+import unittest
+from unittest.mock import patch
+import tempfile
+import sys
+import os
+
+# Add execution dir to path to import the module
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+
+def write_pdf(path, page_texts):
+    """Genera un PDF mínimo con una línea de texto por página."""
+    from pypdf import PdfWriter
+    from pypdf.generic import DecodedStreamObject, DictionaryObject, NameObject
+
+    writer = PdfWriter()
+    font = writer._add_object(DictionaryObject({
+        NameObject("/Type"): NameObject("/Font"),
+        NameObject("/Subtype"): NameObject("/Type1"),
+        NameObject("/BaseFont"): NameObject("/Helvetica"),
+    }))
+    for text in page_texts:
+        page = writer.add_blank_page(612, 792)
+        page[NameObject("/Resources")] = DictionaryObject({
+            NameObject("/Font"): DictionaryObject({NameObject("/F1"): font})
+        })
+        stream = DecodedStreamObject()
+        stream.set_data(f"BT /F1 12 Tf 72 712 Td ({text}) Tj ET".encode("latin-1"))
+        page[NameObject("/Contents")] = writer._add_object(stream)
+    writer.write(path)
+
+
+@unittest.skipIf(pdf_extract.PdfReader is None, "pypdf no instalado")
+class TestPdfExtract(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.pdf = os.path.join(self.tmpdir.name, "manual.pdf")
+        self.texts = [f"Pagina {i}" for i in range(1, 21)]
+        write_pdf(self.pdf, self.texts)
+        patcher = patch.object(pdf_extract, 'CACHE_DIR', os.path.join(self.tmpdir.name, "cache"))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_second_extraction_comes_from_cache(self):
+        self.assertEqual(pdf_extract.extract_pages(self.pdf), self.texts)
+        with patch.object(pdf_extract, 'PdfReader') as mock_reader:
+            self.assertEqual(pdf_extract.extract_pages(self.pdf), self.texts)
+        mock_reader.assert_not_called()
+
+    def test_iter_pages_from_start_page(self):
+        self.assertEqual(list(pdf_extract.iter_pages(self.pdf, start_page=19)), [(19, "Pagina 19"), (20, "Pagina 20")])
+        # Una extracción parcial no deja caché incompleta
+        self.assertFalse(os.listdir(pdf_extract.CACHE_DIR) if os.path.exists(pdf_extract.CACHE_DIR) else [])
+
+    def test_process_pool_keeps_page_order(self):
+        with patch.object(pdf_extract.os, 'cpu_count', return_value=2), \
+                patch.object(pdf_extract, 'PARALLEL_MIN_PAGES', 2), \
+                patch.object(pdf_extract, 'PAGES_PER_TASK', 3):
+            self.assertEqual(pdf_extract.extract_text(self.pdf), "\n".join(self.texts))
+
+
+if __name__ == '__main__':
+    unittest.main()
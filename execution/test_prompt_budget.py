@@ -0,0 +1,66 @@
+import prompt_budget
+import unittest
+from unittest.mock import patch
+import sys
+import os
+
+# Add execution dir to path to import the module
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+NO_KEYS = {"GROQ_API_KEY": "", "GOOGLE_API_KEY": "", "OPENAI_API_KEY": "", "ANTHROPIC_API_KEY": ""}
+
+
+class TestPromptBudget(unittest.TestCase):
+
+    def test_groq_cap_is_tighter_than_its_context_window(self):
+        self.assertLess(prompt_budget.input_limit("groq", "llama-3.3-70b-versatile"), prompt_budget.input_limit("openai", "gpt-4o"))
+        with patch.dict(os.environ, {"LLM_MAX_INPUT_TOKENS_GROQ": "20000"}):
+            self.assertGreater(prompt_budget.input_limit("groq"), prompt_budget.input_limit("groq", reserve=4000))
+
+    def test_chain_limit_uses_smallest_configured_provider(self):
+        with patch.dict(os.environ, dict(NO_KEYS, GOOGLE_API_KEY="x")):
+            gemini_only = prompt_budget.chain_limit()
+        with patch.dict(os.environ, dict(NO_KEYS, GOOGLE_API_KEY="x", GROQ_API_KEY="y")):
+            self.assertEqual(prompt_budget.chain_limit(), prompt_budget.input_limit("groq"))
+            self.assertGreater(gemini_only, prompt_budget.chain_limit())
+
+    def test_truncate_cuts_at_line_and_marks(self):
+        text = "\n".join(f"línea {i} con algo de texto" for i in range(500))
+        cut = prompt_budget.truncate_to_tokens(text, 200)
+        self.assertLessEqual(prompt_budget.count_tokens(cut), 200)
+        self.assertTrue(cut.endswith(prompt_budget.TRUNCATION_MARK))
+        self.assertTrue(text.startswith(cut[:-len(prompt_budget.TRUNCATION_MARK)]))
+        self.assertEqual(prompt_budget.truncate_to_tokens("corto", 200), "corto")
+
+    def test_split_is_lossless_and_within_budget(self):
+        text = "\n\n".join(f"Párrafo {i}. " + "palabra " * (20 + i % 50) for i in range(80)) + "\n" + "x" * 3000
+        parts = prompt_budget.split_to_tokens(text, 150)
+        self.assertEqual("".join(parts), text)
+        self.assertGreater(len(parts), 1)
+        self.assertTrue(all(prompt_budget.count_tokens(p) <= 150 for p in parts))
+
+    def test_plan_reports_usage_and_action(self):
+        payload = "dato " * 4000
+        fitted = prompt_budget.plan("dato", "openai", "gpt-4o", system="Eres SienaExpert", memory=1000)
+        self.assertEqual(fitted["action"], "fit")
+        self.assertEqual(set(fitted["usage"]), {"system", "memory", "payload"})
+        self.assertEqual(fitted["usage"]["memory"], 1000)
+
+        truncated = prompt_budget.plan(payload, "groq", memory=1000)
+        self.assertEqual(truncated["action"], "truncate")
+        self.assertLessEqual(sum(truncated["usage"].values()), truncated["limit"])
+
+        split = prompt_budget.plan(payload, "gemini", mode="split", max_part=1000)
+        self.assertEqual(split["action"], "split")
+        self.assertEqual("".join(split["parts"]), payload)
+
+    def test_fit_prompt_fills_placeholder(self):
+        with patch.dict(os.environ, dict(NO_KEYS, GROQ_API_KEY="y")):
+            prompt, budget = prompt_budget.fit_prompt("Resume:\n{payload}\nFIN", "texto " * 10000, **prompt_budget.CHAT_OVERHEAD)
+        self.assertTrue(prompt.startswith("Resume:\n") and prompt.endswith("\nFIN"))
+        self.assertEqual(budget["action"], "truncate")
+        self.assertLessEqual(sum(budget["usage"].values()), budget["limit"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,101 @@
+import provider_health
+import unittest
+import tempfile
+import sys
+import os
+
+# Add execution dir to path to import the module
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestProviderHealth(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, "health.json")
+        self.clock = FakeClock()
+        self.health = provider_health.ProviderHealth(self.path, clock=self.clock)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_classify_error(self):
+        self.assertEqual(provider_health.classify_error("401 Client Error: Unauthorized"), "auth")
+        self.assertEqual(provider_health.classify_error("Groq API Error (429): rate limit"), "quota")
+        self.assertEqual(provider_health.classify_error("503 Server Error: Service Unavailable"), "5xx")
+        self.assertEqual(provider_health.classify_error("Read timed out. (read timeout=30)"), "timeout")
+        self.assertEqual(provider_health.classify_error("JSON inesperado"), "other")
+
+    def test_breaker_opens_and_half_open_probe_closes_it(self):
+        for _ in range(provider_health.FAILURE_THRESHOLD):
+            self.health.record_failure("groq/m", "503 Server Error")
+        self.assertFalse(self.health.allow("groq/m"))
+
+        self.clock.now += provider_health.BASE_COOLDOWN
+        self.assertTrue(self.health.allow("groq/m"))   # la prueba
+        self.assertFalse(self.health.allow("groq/m"))  # solo una a la vez
+        self.health.record("groq/m", 0.4)
+        self.assertEqual(self.health.report()["groq/m"]["state"], "closed")
+
+    def test_failed_probe_doubles_cooldown(self):
+        self.health.record_failure("openai/m", "401 Unauthorized")
+        self.assertEqual(self.health.report()["openai/m"]["state"], "open")
+        self.clock.now += provider_health.AUTH_COOLDOWN
+        self.assertTrue(self.health.allow("openai/m"))
+        self.health.record_failure("openai/m", "401 Unauthorized")
+        self.assertEqual(self.health.entries["openai/m"]["cooldown"], min(2 * provider_health.AUTH_COOLDOWN, provider_health.MAX_COOLDOWN))
+
+    def test_order_does_not_take_the_probe_slot(self):
+        self.health.record("a/m", 0.2)
+        for _ in range(provider_health.FAILURE_THRESHOLD):
+            self.health.record_failure("b/m", "503 Server Error")
+        self.clock.now += provider_health.BASE_COOLDOWN
+        self.assertEqual(sorted(self.health.order(["a/m", "b/m"])), ["a/m", "b/m"])
+        # Ordenado pero no llamado: sigue abierto y la prueba sigue libre
+        self.assertEqual(self.health.report()["b/m"]["state"], "open")
+        self.clock.now += 5
+        self.assertIn("b/m", self.health.order(["a/m", "b/m"]))
+        self.assertTrue(self.health.allow("b/m"))
+        self.assertEqual(self.health.report()["b/m"]["state"], "half_open")
+        self.assertEqual(self.health.order(["a/m", "b/m"]), ["a/m"])
+
+    def test_cancelled_probe_releases_the_slot(self):
+        for _ in range(provider_health.FAILURE_THRESHOLD):
+            self.health.record_failure("b/m", "503 Server Error")
+        self.clock.now += provider_health.BASE_COOLDOWN
+        self.assertTrue(self.health.allow("b/m"))
+        self.health.record_failure("b/m", "Cancelado: otro proveedor respondió antes.")
+        self.assertEqual(self.health.report()["b/m"]["state"], "open")
+        self.assertTrue(self.health.allow("b/m"))
+
+    def test_cancelled_attempts_do_not_count(self):
+        self.health.record_failure("gemini/m", "Cancelado: otro proveedor respondió antes.")
+        self.assertNotIn("gemini/m", self.health.entries)
+
+    def test_order_prefers_fast_healthy_providers_and_skips_open_circuits(self):
+        for _ in range(provider_health.MIN_SAMPLES):
+            self.health.record("groq/m", 6.0)
+            self.health.record("openai/m", 0.4)
+        for _ in range(provider_health.FAILURE_THRESHOLD):
+            self.health.record_failure("anthropic/m", "529 overloaded")
+        keys = ["groq/m", "gemini/m", "openai/m", "anthropic/m"]
+        self.assertEqual(self.health.order(keys), ["openai/m", "gemini/m", "groq/m"])
+
+    def test_state_persists_between_instances(self):
+        self.health.record("groq/m", 0.4)
+        self.health.record_failure("groq/m", "Read timed out")
+        reloaded = provider_health.ProviderHealth(self.path).report()["groq/m"]
+        self.assertEqual((reloaded["ok"], reloaded["fail"], reloaded["errors"]), (1, 1, {"timeout": 1}))
+        self.assertEqual(reloaded["p50_s"], 0.5)
+
+
+if __name__ == '__main__':
+    unittest.main()
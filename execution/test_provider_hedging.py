@@ -0,0 +1,142 @@
+import provider_hedging
+import unittest
+import tempfile
+import threading
+import time
+import sys
+import os
+
+# Add execution dir to path to import the module
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+
+class TestHedgedCall(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.histograms = provider_hedging.LatencyHistograms(os.path.join(self.tmpdir.name, "latency.json"))
+        for _ in range(provider_hedging.MIN_SAMPLES):
+            self.histograms.record("lento", 0.1)  # p90 = 0.25 s
+        self.started = []
+        self.cancelled = threading.Event()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def call(self, behaviours):
+        def call(provider, on_delta, cancel):
+            self.started.append(provider)
+            kind, delay = behaviours[provider]
+            if cancel.wait(delay):
+                self.cancelled.set()
+                return {"error": "cancelado"}
+            if kind == "error":
+                return {"error": f"{provider} caído"}
+            return {"content": f"respuesta de {provider}"}
+        return call
+
+    def test_slow_primary_is_hedged_and_cancelled(self):
+        call = self.call({"lento": ("ok", 5), "rapido": ("ok", 0.01)})
+        start = time.perf_counter()
+        result = provider_hedging.hedged_call(["lento", "rapido"], call, stats=self.histograms)
+        self.assertEqual(result, {"content": "respuesta de rapido", "provider": "rapido"})
+        self.assertLess(time.perf_counter() - start, 1)
+        self.assertTrue(self.cancelled.wait(1))
+        self.assertEqual(self.histograms.samples("rapido"), 1)
+
+    def test_fast_failure_starts_next_without_waiting(self):
+        call = self.call({"caido": ("error", 0), "sano": ("ok", 0)})
+        result = provider_hedging.hedged_call(["caido", "sano"], call, stats=self.histograms)
+        self.assertEqual(result["provider"], "sano")
+
+    def test_without_hedge_providers_run_sequentially(self):
+        call = self.call({"lento": ("ok", 0.5), "rapido": ("ok", 0)})
+        result = provider_hedging.hedged_call(["lento", "rapido"], call, hedge=False, stats=self.histograms)
+        self.assertEqual(result["provider"], "lento")
+        self.assertEqual(self.started, ["lento"])
+
+    def test_all_failing_returns_last_error(self):
+        call = self.call({"a": ("error", 0), "b": ("error", 0)})
+        result = provider_hedging.hedged_call(["a", "b"], call, stats=self.histograms)
+        self.assertEqual(result, {"error": "b caído"})
+
+    def test_stream_switches_to_winner_after_owner_fails(self):
+        deltas = []
+
+        def call(provider, on_delta, cancel):
+            if provider == "a":
+                on_delta("texto de a")
+                return {"error": "a se cortó"}
+            time.sleep(0.05)
+            on_delta("hola ")
+            on_delta("mundo")
+            return {"content": "hola mundo"}
+
+        result = provider_hedging.hedged_call(["a", "b"], call, on_delta=deltas.append, stats=self.histograms)
+        self.assertEqual(result["content"], "hola mundo")
+        self.assertEqual(deltas, ["texto de a", None, "hola ", "mundo"])
+
+    def test_probe_slot_is_taken_on_launch_and_released_by_losers(self):
+        import provider_health
+        clock = FakeClock()
+        health = provider_health.ProviderHealth(os.path.join(self.tmpdir.name, "health.json"), clock=clock)
+        for _ in range(provider_health.FAILURE_THRESHOLD):
+            health.record_failure("caido", "503 Server Error")
+        clock.now += provider_health.BASE_COOLDOWN
+        call = self.call({"rapido": ("ok", 0), "caido": ("ok", 5)})
+
+        # Ordenado pero no lanzado: el primero gana antes de su retraso y la prueba sigue libre
+        result = provider_hedging.hedged_call(health.order(["caido", "rapido"]), call, stats=health)
+        self.assertEqual(result["provider"], "rapido")
+        self.assertEqual(self.started, ["rapido"])
+        self.assertEqual(health.report()["caido"]["state"], "open")
+
+        # Lanzado y cancelado al perder la carrera: devuelve la plaza
+        call = self.call({"caido": ("ok", 5), "rapido": ("ok", 0.01)})
+        result = provider_hedging.hedged_call(["caido", "rapido"], call, stats=FixedDelay(health, 0.05))
+        self.assertEqual(result["provider"], "rapido")
+        self.assertEqual(health.report()["caido"]["state"], "open")
+        self.assertTrue(health.available("caido"))
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class FixedDelay:
+    """Registro de salud con un retraso de hedging fijo."""
+
+    def __init__(self, health, delay):
+        self.health = health
+        self.delay = delay
+
+    def __getattr__(self, name):
+        return getattr(self.health, name)
+
+    def hedge_delay(self, provider):
+        return self.delay
+
+
+class TestLatencyHistograms(unittest.TestCase):
+
+    def test_p90_drives_hedge_delay_and_persists(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "latency.json")
+            histograms = provider_hedging.LatencyHistograms(path)
+            self.assertEqual(histograms.hedge_delay("groq"), provider_hedging.DEFAULT_DELAY)
+            for seconds in [0.4] * 9 + [20]:
+                histograms.record("groq", seconds)
+            self.assertEqual(histograms.percentile("groq", 0.9), 0.5)
+            self.assertEqual(histograms.percentile("groq", 1.0), 21)
+
+            reloaded = provider_hedging.LatencyHistograms(path)
+            self.assertEqual(reloaded.samples("groq"), 10)
+            self.assertEqual(reloaded.hedge_delay("groq"), 0.5)
+
+
+if __name__ == '__main__':
+    unittest.main()
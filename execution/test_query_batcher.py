@@ -0,0 +1,63 @@
+import query_batcher
+import unittest
+import threading
+import sys
+import os
+
+# Add execution dir to path to import the module
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+
+class TestQueryBatcher(unittest.TestCase):
+
+    def setUp(self):
+        self.calls = []
+
+        def run_batch(items):
+            self.calls.append(list(items))
+            return [item * 10 for item in items]
+
+        self.run_batch = run_batch
+
+    def call_concurrently(self, batcher, items):
+        results, barrier = {}, threading.Barrier(len(items))
+
+        def worker(item):
+            barrier.wait()
+            results[item] = batcher.call(item)
+
+        threads = [threading.Thread(target=worker, args=(item,)) for item in items]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+        return results
+
+    def test_concurrent_calls_share_one_batch(self):
+        batcher = query_batcher.QueryBatcher(self.run_batch, window_s=0.2)
+        results = self.call_concurrently(batcher, [1, 2, 3, 4])
+        self.assertEqual(results, {1: 10, 2: 20, 3: 30, 4: 40})
+        self.assertEqual(len(self.calls), 1)
+        self.assertEqual(batcher.stats()["avg_batch"], 4)
+
+    def test_full_batch_runs_without_waiting_the_window(self):
+        batcher = query_batcher.QueryBatcher(self.run_batch, window_s=30, max_batch=3)
+        self.assertEqual(batcher.call_many([1, 2, 3, 4, 5, 6]), [10, 20, 30, 40, 50, 60])
+        self.assertEqual(self.calls, [[1, 2, 3], [4, 5, 6]])
+
+    def test_errors_reach_only_their_requests(self):
+        def run_batch(items):
+            return [ValueError("filtro inválido") if item < 0 else item for item in items]
+
+        batcher = query_batcher.QueryBatcher(run_batch, window_s=0)
+        self.assertEqual(batcher.call(5), 5)
+        with self.assertRaises(ValueError):
+            batcher.call(-1)
+
+        failing = query_batcher.QueryBatcher(lambda items: 1 / 0, window_s=0)
+        with self.assertRaises(ZeroDivisionError):
+            failing.call_many([1, 2])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+import rate_limiter
+import unittest
+import threading
+import time
+import sys
+import os
+
+# Add execution dir to path to import the module
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+
+class TestRateLimiter(unittest.TestCase):
+
+    def test_parse_reset_formats(self):
+        self.assertEqual(rate_limiter.parse_reset("6m0s"), 360)
+        self.assertAlmostEqual(rate_limiter.parse_reset("20ms"), 0.02)
+        self.assertEqual(rate_limiter.parse_reset("1.5"), 1.5)
+        self.assertEqual(rate_limiter.parse_reset("2026-01-01T00:00:30Z", now=1767225600.0), 30)
+        self.assertIsNone(rate_limiter.parse_reset("pronto"))
+
+    def test_bucket_rejects_when_wait_exceeds_limit(self):
+        limiter = rate_limiter.KeyLimiter("groq:test", rpm=2, tpm=6000, max_wait=1)
+        self.assertLess(limiter.acquire(100), 0.1)
+        self.assertLess(limiter.acquire(100), 0.1)
+        with self.assertRaises(RuntimeError) as ctx:
+            limiter.acquire(100)
+        self.assertTrue(str(ctx.exception).startswith("Limitado"))
+        self.assertEqual(limiter.report()["queued"], 0)
+
+    def test_token_budget_is_enforced(self):
+        limiter = rate_limiter.KeyLimiter("groq:test", rpm=100, tpm=1000, max_wait=1)
+        limiter.acquire(900)
+        with self.assertRaises(RuntimeError):
+            limiter.acquire(900)
+
+    def test_headers_and_429_adapt_the_bucket(self):
+        limiter = rate_limiter.KeyLimiter("openai:test", rpm=500, tpm=200000)
+        limiter.observe({"x-ratelimit-remaining-tokens": "1000", "x-ratelimit-reset-tokens": "6s"})
+        self.assertEqual(limiter.report()["tokens_left"], 1000)
+
+        limiter.observe({"Retry-After": "0.3"}, status=429)
+        start = time.monotonic()
+        limiter.acquire(10)
+        self.assertGreaterEqual(time.monotonic() - start, 0.25)
+        self.assertEqual(limiter.report()["throttled"], 1)
+
+    def test_interactive_requests_jump_the_background_queue(self):
+        limiter = rate_limiter.KeyLimiter("groq:test", rpm=600, tpm=100000)
+        limiter.levels["requests"] = 0.0
+        order = []
+
+        def worker(label, level):
+            limiter.acquire(10, level=level)
+            order.append(label)
+
+        background = threading.Thread(target=worker, args=("fondo", rate_limiter.BACKGROUND))
+        background.start()
+        time.sleep(0.02)
+        interactive = threading.Thread(target=worker, args=("chat", rate_limiter.INTERACTIVE))
+        interactive.start()
+        background.join(2)
+        interactive.join(2)
+        self.assertEqual(order, ["chat", "fondo"])
+
+    def test_priority_context_and_cancel(self):
+        limiter = rate_limiter.KeyLimiter("groq:test", rpm=1, tpm=100000)
+        limiter.acquire(10)
+        cancel = threading.Event()
+        cancel.set()
+        with self.assertRaises(RuntimeError) as ctx:
+            limiter.acquire(10, cancel=cancel)
+        self.assertTrue(str(ctx.exception).startswith("Cancelado"))
+
+        with rate_limiter.priority(rate_limiter.BACKGROUND):
+            self.assertEqual(rate_limiter.current_priority(), rate_limiter.BACKGROUND)
+        self.assertEqual(rate_limiter.current_priority(), rate_limiter.INTERACTIVE)
+
+    def test_limiter_is_shared_per_api_key(self):
+        a = rate_limiter.get_limiter("groq", "clave-1")
+        self.assertIs(a, rate_limiter.get_limiter("groq", "clave-1"))
+        self.assertIsNot(a, rate_limiter.get_limiter("groq", "clave-2"))
+        self.assertNotIn("clave-1", a.name)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+import reranker
+import prompt_budget
+import unittest
+from unittest.mock import patch, MagicMock
+import sys
+import os
+
+# Add execution dir to path to import the module
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+
+def candidate(doc_id, document, distance):
+    return {"id": doc_id, "document": document, "metadata": {}, "distance": distance, "bm25": None, "rrf": 0.01}
+
+
+class FakeService:
+    """hybrid_query_many() devuelve candidatos fijos por consulta y anota cuántos se pidieron."""
+
+    def __init__(self, results):
+        self.results = results
+        self.requested = None
+
+    def hybrid_query_many(self, queries, n_results=3, candidates=10, types=None):
+        self.requested = (n_results, candidates, types)
+        return [(self.results[:n_results], {"total_ms": 12.0, "vector_ms": 9.0, "lexical_ms": 2.0}) for _ in queries]
+
+    def collection(self):
+        return MagicMock(metadata=None)
+
+
+class TestReranker(unittest.TestCase):
+
+    def setUp(self):
+        # Sin cross-encoder: puntuador léxico
+        patcher = patch.object(reranker, "_cross_encoder", return_value=False)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_irrelevant_candidates_are_cut_and_exact_code_ranks_first(self):
+        service = FakeService([
+            candidate("receta", "Receta de la tarta de manzana de la abuela", 1.6),
+            candidate("dtc", "P0340: fallo del sensor de posición del árbol de levas", 1.2),
+            candidate("cita", "Cita con el dentista el martes a las 10", 1.7),
+            candidate("dup", "P0340: fallo del sensor de posición del árbol de levas", 1.2),
+        ])
+        items, report = reranker.retrieve(service, "qué significa el código P0340")
+
+        self.assertEqual(service.requested[:2], (reranker.CANDIDATES, reranker.CANDIDATES))
+        self.assertEqual([i["id"] for i in items], ["dtc"])
+        self.assertGreaterEqual(items[0]["score"], reranker.MIN_SCORE)
+        self.assertEqual((report["candidates"], report["below_cutoff"], report["kept"]), (3, 2, 1))
+        self.assertLess(report["context_tokens"], report["raw_tokens"])
+        self.assertGreater(report["shrink_pct"], 0)
+        self.assertEqual(set(report["timings_ms"]),
+                         {"retrieve_ms", "vector_ms", "lexical_ms", "rerank_ms", "pack_ms", "total_ms"})
+
+    def test_several_queries_keep_best_score_per_memory(self):
+        service = FakeService([
+            candidate("p0300", "P0300: fallo de encendido aleatorio", 1.2),
+            candidate("p0171", "P0171: mezcla pobre, revisar entradas de aire", 1.2),
+        ])
+        items, report = reranker.retrieve(service, ["P0300 siena", "P0171 siena"])
+        self.assertEqual(sorted(i["id"] for i in items), ["p0171", "p0300"])
+        self.assertEqual((report["queries"], report["candidates"]), (2, 2))
+
+    def test_context_respects_token_budget(self):
+        long_doc = "sensor de levas " * 400
+        service = FakeService([candidate("corto", "Sensor de levas: 5 V", 0.5), candidate("largo", long_doc, 0.6)])
+        # El largo no cabe detrás del mejor: se salta
+        items, report = reranker.retrieve(service, "sensor de levas", max_tokens=200)
+        self.assertEqual([i["id"] for i in items], ["corto"])
+
+        # Si ni el mejor cabe entero, entra truncado
+        service = FakeService([candidate("largo", long_doc, 0.5)])
+        items, report = reranker.retrieve(service, "sensor de levas", max_tokens=100)
+        self.assertTrue(items[0]["document"].endswith(prompt_budget.TRUNCATION_MARK))
+        self.assertLessEqual(report["context_tokens"], 100)
+
+    def test_cross_encoder_logits_are_mapped_to_probabilities(self):
+        model = MagicMock()
+        model.predict.return_value = [4.0, -4.0]
+        with patch.object(reranker, "_cross_encoder", return_value=model):
+            scores, scorer = reranker.score("consulta", [candidate("a", "uno", None), candidate("b", "dos", None)])
+        self.assertTrue(scorer.startswith("cross-encoder"))
+        self.assertGreater(scores[0], 0.95)
+        self.assertLess(scores[1], 0.05)
+
+    def test_similarity_handles_distance_spaces(self):
+        self.assertAlmostEqual(reranker.similarity(0.5, "l2"), 0.75)
+        self.assertAlmostEqual(reranker.similarity(0.2, "cosine"), 0.8)
+        self.assertIsNone(reranker.similarity(None))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+import response_cache
+import memory_service
+import unittest
+from unittest.mock import patch
+import tempfile
+import sys
+import os
+
+# Add execution dir to path to import the module
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+VECTORS = {
+    "orden de encendido del motor": [1.0, 0.0, 0.0],
+    "cuál es el orden de encendido del motor": [0.99, 0.1, 0.0],
+    "torque de la culata del motor": [0.0, 1.0, 0.0],
+}
+
+
+def fake_embed(self, texts, name=None):
+    return [VECTORS[t] for t in texts]
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestResponseCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.clock = FakeClock()
+        self.scope = response_cache.scope_key("Eres SienaExpert", None)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def make_cache(self, **kwargs):
+        kwargs.setdefault("semantic", False)
+        return response_cache.ResponseCache(os.path.join(self.tmpdir.name, "cache.sqlite"), clock=self.clock, **kwargs)
+
+    def test_exact_hit_within_scope(self):
+        cache = self.make_cache()
+        self.assertIsNone(cache.get("orden de encendido del motor", self.scope))
+        cache.put("orden de encendido del motor", self.scope, "1-3-4-2")
+        self.assertEqual(cache.get("orden de encendido del motor", self.scope), ("1-3-4-2", "exact"))
+        self.assertIsNone(cache.get("orden de encendido del motor", response_cache.scope_key("Eres pirata", None)))
+        self.assertIsNone(cache.get("orden de encendido del motor", response_cache.scope_key("Eres SienaExpert", "groq")))
+        self.assertEqual(cache.stats()["exact_hits"], 1)
+
+    def test_timestamp_in_system_does_not_change_scope(self):
+        a = response_cache.scope_key("Eres SienaExpert\n[Contexto Temporal: Fecha y Hora actual del servidor: 2026-01-01 10:00:00]", None)
+        b = response_cache.scope_key("Eres SienaExpert\n[Contexto Temporal: Fecha y Hora actual del servidor: 2026-01-01 10:00:07]", None)
+        self.assertEqual(a, b)
+
+    def test_chats_with_different_history_do_not_share_entries(self):
+        cache = self.make_cache()
+        prompt = "¿y cuánto cuesta cambiarlo?"
+        taller = (None, [{"role": "user", "content": "El Siena pierde agua"}, {"role": "assistant", "content": "Revisá la bomba."}])
+        otro = (None, [{"role": "user", "content": "Ruido en la caja de cambios"}, {"role": "assistant", "content": "Puede ser el embrague."}])
+        scope_a = response_cache.scope_key("Eres SienaExpert", None, taller, ["note", "fact"])
+        scope_b = response_cache.scope_key("Eres SienaExpert", None, otro, ["note", "fact"])
+        cache.put(prompt, scope_a, "Una bomba de agua cuesta...")
+        self.assertIsNone(cache.get(prompt, scope_b))
+        self.assertIsNotNone(cache.get(prompt, scope_a))
+        self.assertNotEqual(scope_a, response_cache.scope_key("Eres SienaExpert", None, taller, ["manual"]))
+        self.assertNotEqual(scope_a, response_cache.scope_key("Eres SienaExpert", None, ("Resumen", taller[1]), ["note", "fact"]))
+
+    def test_short_prompts_are_not_cached(self):
+        cache = self.make_cache()
+        cache.put("sí", self.scope, "respuesta")
+        self.assertIsNone(cache.get("sí", self.scope))
+
+    def test_ttl_and_size_bound(self):
+        cache = self.make_cache(ttl=60, max_items=2)
+        cache.put("pregunta número uno", self.scope, "1")
+        self.clock.now += 1
+        cache.put("pregunta número dos", self.scope, "2")
+        self.clock.now += 1
+        cache.get("pregunta número uno", self.scope)  # la más reciente en uso
+        cache.put("pregunta número tres", self.scope, "3")
+        self.assertIsNone(cache.get("pregunta número dos", self.scope))
+        self.assertIsNotNone(cache.get("pregunta número uno", self.scope))
+
+        self.clock.now += 61
+        self.assertIsNone(cache.get("pregunta número tres", self.scope))
+
+    def test_semantic_tier_matches_paraphrases_above_threshold(self):
+        db_path = os.path.join(self.tmpdir.name, "chroma_db")
+        service = memory_service.MemoryService(db_path)
+        with patch.object(memory_service.MemoryService, 'embed', fake_embed):
+            cache = self.make_cache(semantic=True, threshold=0.95, memory=service)
+            cache.put("orden de encendido del motor", self.scope, "1-3-4-2")
+            self.assertEqual(cache.get("cuál es el orden de encendido del motor", self.scope), ("1-3-4-2", "semantic"))
+            self.assertIsNone(cache.get("torque de la culata del motor", self.scope))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+import telegram_dispatcher
+import unittest
+import unittest.mock
+import threading
+import time
+import sys
+import os
+
+# Add execution dir to path to import the module
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+
+class TestChatDispatcher(unittest.TestCase):
+
+    def test_messages_of_one_chat_keep_order(self):
+        seen = []
+
+        def handler(chat_id, item):
+            time.sleep(0.001)
+            seen.append(item)
+
+        dispatcher = telegram_dispatcher.ChatDispatcher(handler, max_workers=4, max_per_chat=50)
+        for i in range(20):
+            self.assertTrue(dispatcher.submit("chat-a", i))
+        self.assertTrue(dispatcher.join(timeout=5))
+        dispatcher.shutdown()
+        self.assertEqual(seen, list(range(20)))
+
+    def test_slow_chat_does_not_block_other_chats(self):
+        release = threading.Event()
+        done = []
+
+        def handler(chat_id, item):
+            if chat_id == "slow":
+                release.wait(5)
+            done.append(chat_id)
+
+        dispatcher = telegram_dispatcher.ChatDispatcher(handler, max_workers=2)
+        dispatcher.submit("slow", "/py sleep")
+        dispatcher.submit("fast", "hola")
+        deadline = time.time() + 5
+        while "fast" not in done and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(done, ["fast"])
+        self.assertEqual(dispatcher.stats()["busy"], 1)
+        release.set()
+        dispatcher.shutdown()
+        self.assertEqual(sorted(done), ["fast", "slow"])
+
+    def test_bounded_queues_reject_and_count(self):
+        release = threading.Event()
+        dispatcher = telegram_dispatcher.ChatDispatcher(lambda c, i: release.wait(5), max_workers=1,
+                                                        max_per_chat=2, max_pending=3)
+        self.assertTrue(dispatcher.submit("a", 1))
+        self.assertTrue(dispatcher.submit("a", 2))
+        self.assertFalse(dispatcher.submit("a", 3))  # per-chat limit
+        self.assertTrue(dispatcher.submit("b", 1))
+        self.assertFalse(dispatcher.submit("c", 1))  # global limit
+        stats = dispatcher.stats()
+        self.assertEqual(stats["pending"], 3)
+        self.assertEqual(stats["chats_waiting"], 2)
+        self.assertEqual(stats["rejected"], 2)
+        release.set()
+        dispatcher.shutdown()
+        self.assertEqual(dispatcher.stats()["processed"], 3)
+
+    def test_handler_errors_do_not_kill_workers(self):
+        seen = []
+
+        def handler(chat_id, item):
+            if item == "boom":
+                raise RuntimeError("boom")
+            seen.append(item)
+
+        dispatcher = telegram_dispatcher.ChatDispatcher(handler, max_workers=1)
+        with unittest.mock.patch('sys.stderr'):
+            dispatcher.submit("a", "boom")
+            dispatcher.submit("a", "ok")
+            dispatcher.shutdown()
+        self.assertEqual(seen, ["ok"])
+
+
+if __name__ == '__main__':
+    unittest.main()
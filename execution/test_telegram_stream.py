@@ -0,0 +1,86 @@
+import telegram_stream
+import unittest
+from unittest.mock import patch
+import sys
+import os
+
+# Add execution dir to path to import the module
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestStreamingReply(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.edits = []
+        send = patch.object(telegram_stream.telegram_tool, 'send_message',
+                            return_value={"status": "success", "message_id": 7})
+        edit = patch.object(telegram_stream.telegram_tool, 'edit_message', side_effect=self.fake_edit)
+        self.send = send.start()
+        edit.start()
+        self.addCleanup(send.stop)
+        self.addCleanup(edit.stop)
+        self.edit_result = {"status": "success"}
+
+    def fake_edit(self, text, chat_id, message_id, markdown=True):
+        self.edits.append((text, markdown))
+        return self.edit_result
+
+    def make_reply(self, max_per_second=20):
+        budget = telegram_stream.EditBudget(max_per_second, clock=self.clock)
+        return telegram_stream.StreamingReply("42", min_interval=1.0, budget=budget, clock=self.clock).start()
+
+    def test_first_delta_is_shown_immediately_then_throttled(self):
+        reply = self.make_reply()
+        reply.feed("Revisa")
+        reply.feed(" la bujía")
+        self.clock.now += 1.0
+        reply.feed(" y el cable.")
+        self.assertEqual(self.edits, [("Revisa" + telegram_stream.CURSOR, False),
+                                      ("Revisa la bujía y el cable." + telegram_stream.CURSOR, False)])
+        self.assertEqual(reply.stats["first_text_s"], 0.0)
+
+        reply.finish("Revisa la *bujía* y el cable.")
+        self.assertEqual(self.edits[-1], ("Revisa la *bujía* y el cable.", True))
+
+    def test_global_budget_and_retry_after(self):
+        reply = self.make_reply(max_per_second=1)
+        other = self.make_reply(max_per_second=1)
+        other.budget = reply.budget
+        reply.feed("a")
+        other.feed("b")
+        self.assertEqual(len(self.edits), 1)
+        self.assertEqual(other.stats["skipped"], 1)
+
+        self.edit_result = {"status": "error", "retry_after": 5}
+        self.clock.now += 2
+        reply.feed("c")
+        self.clock.now += 2
+        reply.feed("d")
+        self.assertEqual(len(self.edits), 2)  # pausado por el 429
+
+    def test_reset_and_long_final_text(self):
+        reply = self.make_reply()
+        reply.feed("parcial")
+        reply.feed(None)
+        self.assertEqual(reply.text, "")
+        final = "línea\n" * 1000
+        reply.finish(final)
+        self.assertEqual(self.send.call_count, 2)  # provisional + segunda parte
+        self.assertLessEqual(len(self.edits[-1][0]), telegram_stream.MAX_MESSAGE_CHARS)
+
+    def test_split_message_prefers_newlines(self):
+        parts = telegram_stream.split_message("a" * 10 + "\n" + "b" * 10, limit=15)
+        self.assertEqual(parts, ["a" * 10, "b" * 10])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+import telegram_tool
+import unittest
+from unittest.mock import patch, MagicMock
+import tempfile
+import sys
+import os
+
+# Add execution dir to path to import the module
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+
+def make_update(update_id, chat_id="123", text="hola"):
+    return {"update_id": update_id, "message": {"chat": {"id": int(chat_id)}, "text": text}}
+
+
+class TestUpdatePoller(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        offset_file = os.path.join(self.tmpdir.name, "telegram_offset.txt")
+        self.patches = [
+            patch.object(telegram_tool, 'OFFSET_FILE', offset_file),
+            patch.object(telegram_tool, 'TOKEN', 'test-token'),
+            patch.object(telegram_tool, 'ALLOWED_USERS', '123'),
+        ]
+        for p in self.patches:
+            p.start()
+
+    def tearDown(self):
+        for p in self.patches:
+            p.stop()
+        self.tmpdir.cleanup()
+
+    def mock_get(self, updates):
+        response = MagicMock()
+        response.json.return_value = {"ok": True, "result": updates}
+        return patch.object(telegram_tool.SESSION, 'get', return_value=response)
+
+    def test_parse_update_formats_and_filters(self):
+        self.assertEqual(telegram_tool.parse_update(make_update(1)), "123|hola")
+        with patch('sys.stderr'):
+            self.assertIsNone(telegram_tool.parse_update(make_update(2, chat_id="999")))
+
+    def test_poll_uses_long_polling_and_in_memory_offset(self):
+        poller = telegram_tool.UpdatePoller(timeout=30, limit=100, checkpoint_every=50)
+        with self.mock_get([make_update(10), make_update(11, text="adiós")]) as mock_get:
+            result = poller.poll()
+        self.assertEqual(result["messages"], ["123|hola", "123|adiós"])
+        params = mock_get.call_args.kwargs["params"]
+        self.assertEqual((params["timeout"], params["limit"]), (30, 100))
+        self.assertEqual(poller.offset, 12)
+        # Aún no se alcanzó el lote: el offset no se escribió en disco
+        self.assertEqual(telegram_tool.load_offset(), 0)
+        poller.checkpoint()
+        self.assertEqual(telegram_tool.load_offset(), 12)
+
+    def test_checkpoint_after_batch(self):
+        poller = telegram_tool.UpdatePoller(checkpoint_every=2)
+        with self.mock_get([make_update(5), make_update(6)]):
+            poller.poll()
+        self.assertEqual(telegram_tool.load_offset(), 7)
+        self.assertEqual(telegram_tool.UpdatePoller().offset, 7)
+
+    def test_read_timeout_is_an_empty_poll(self):
+        poller = telegram_tool.UpdatePoller()
+        with patch.object(telegram_tool.SESSION, 'get', side_effect=telegram_tool.requests.exceptions.ReadTimeout()):
+            self.assertEqual(poller.poll(), {"status": "success", "messages": []})
+
+
+if __name__ == '__main__':
+    unittest.main()
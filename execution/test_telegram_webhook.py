@@ -0,0 +1,69 @@
+import telegram_webhook
+import telegram_tool
+import unittest
+from unittest.mock import patch
+import sys
+import os
+
+# Add execution dir to path to import the module
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+SECRET = "s3cr3t"
+
+
+def make_update(update_id, chat_id=123, text="hola"):
+    return {"update_id": update_id, "message": {"chat": {"id": chat_id}, "text": text}}
+
+
+class TestWebhookServer(unittest.TestCase):
+
+    def setUp(self):
+        self.accept = True
+        self.received = []
+        patcher = patch.object(telegram_tool, 'ALLOWED_USERS', '123')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.server = telegram_webhook.WebhookServer(self.submit, SECRET, port=0).start()
+        self.addCleanup(self.server.stop)
+
+    def submit(self, sender_id, content):
+        if not self.accept:
+            return False
+        self.received.append((sender_id, content))
+        return True
+
+    def post(self, update, secret=SECRET):
+        return telegram_webhook.post_update(self.server.url, update, secret)
+
+    def test_recorded_update_reaches_dispatcher(self):
+        self.assertEqual(self.post(make_update(1)), 200)
+        self.assertEqual(self.received, [("123", "hola")])
+
+    def test_wrong_secret_is_rejected(self):
+        self.assertEqual(self.post(make_update(1), secret="otro"), 403)
+        self.assertEqual(self.received, [])
+        self.assertEqual(self.server.counters["unauthorized"], 1)
+
+    def test_duplicate_update_id_is_dispatched_once(self):
+        self.assertEqual(self.post(make_update(7)), 200)
+        self.assertEqual(self.post(make_update(7)), 200)
+        self.assertEqual(len(self.received), 1)
+        self.assertEqual(self.server.counters["duplicates"], 1)
+
+    def test_full_queue_returns_429_and_allows_retry(self):
+        self.accept = False
+        self.assertEqual(self.post(make_update(9)), 429)
+        self.accept = True
+        # El reintento de Telegram no se trata como duplicado
+        self.assertEqual(self.post(make_update(9)), 200)
+        self.assertEqual(self.received, [("123", "hola")])
+
+    def test_unauthorized_chat_is_acknowledged_but_ignored(self):
+        with patch('sys.stderr'):
+            self.assertEqual(self.post(make_update(3, chat_id=999)), 200)
+        self.assertEqual(self.received, [])
+        self.assertEqual(self.server.counters["ignored"], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,44 @@
+import tool_registry
+import unittest
+from unittest.mock import patch
+import sys
+import os
+
+# Add execution dir to path to import the module
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+
+class TestToolRegistry(unittest.TestCase):
+
+    def test_in_process_returns_structured_result(self):
+        registry = tool_registry.ToolRegistry()
+        with patch.object(tool_registry, 'run_subprocess') as mock_subprocess:
+            result = registry.run("simulate_obd.py", ["--query", "rpm", "--no-delay"])
+        mock_subprocess.assert_not_called()
+        self.assertEqual(result["status"], "success")
+        self.assertIn("rpm", result["data"])
+        self.assertEqual(registry.stats["simulate_obd.py"]["mode"], "in-process")
+
+    def test_isolated_mode_matches_in_process_shape(self):
+        isolated = tool_registry.ToolRegistry(isolated=True).run("simulate_obd.py", ["--query", "temp", "--no-delay"])
+        in_process = tool_registry.ToolRegistry().run("simulate_obd.py", ["--query", "temp", "--no-delay"])
+        self.assertEqual(isolated["status"], in_process["status"])
+        self.assertEqual(set(isolated["data"]), set(in_process["data"]))
+
+    def test_invalid_arguments_return_none(self):
+        registry = tool_registry.ToolRegistry()
+        with patch('sys.stderr'):
+            self.assertIsNone(registry.run("simulate_obd.py", ["--query", "boost"]))
+
+    def test_unimportable_tool_falls_back_to_subprocess(self):
+        registry = tool_registry.ToolRegistry()
+        with patch.object(tool_registry, 'run_subprocess', return_value={"status": "success"}) as mock_subprocess, \
+                patch('sys.stderr'), \
+                patch.object(tool_registry.importlib, 'import_module', side_effect=SystemExit(10)):
+            result = registry.run("save_memory.py", ["--text", "x"])
+        mock_subprocess.assert_called_once_with("save_memory.py", ["--text", "x"])
+        self.assertEqual(result, {"status": "success"})
+
+
+if __name__ == '__main__':
+    unittest.main()
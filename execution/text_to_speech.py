@@ -6,13 +6,15 @@ import os
 from gtts import gTTS
 from pydub import AudioSegment
 
-def main():
+def build_parser():
     parser = argparse.ArgumentParser(description="Convertir texto a audio (TTS).")
     parser.add_argument("--text", required=True, help="Texto a convertir.")
     parser.add_argument("--output", required=True, help="Ruta del archivo de salida (.ogg).")
     parser.add_argument("--lang", default="es", help="Código de idioma para la voz (ej: es, en).")
-    args = parser.parse_args()
+    return parser
 
+def run(args):
+    """Genera la nota de voz .ogg y devuelve el resultado como diccionario."""
     try:
         # Limpiar un poco el texto de markdown básico para que no lea los asteriscos
         clean_text = args.text.replace("*", "").replace("_", "").replace("`", "")
@@ -30,10 +32,15 @@ def main():
         if os.path.exists(mp3_path):
             os.remove(mp3_path)
 
-        print(json.dumps({"status": "success", "file_path": args.output}))
+        return {"status": "success", "file_path": args.output}
 
     except Exception as e:
-        print(json.dumps({"status": "error", "message": str(e)}))
+        return {"status": "error", "message": str(e)}
+
+def main():
+    result = run(build_parser().parse_args())
+    print(json.dumps(result))
+    if result["status"] == "error":
         sys.exit(1)
 
 if __name__ == "__main__":
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+Registro de herramientas en proceso para el listener de Telegram.
+
+Cada llamada a una herramienta solía lanzar un intérprete nuevo que volvía a
+importar requests, dotenv, chromadb y google.generativeai y devolvía su
+resultado como JSON por stdout. El registro importa cada módulo de execution/
+una sola vez y llama directamente a su `run(args)`, que devuelve un diccionario.
+
+Los módulos registrados exponen `build_parser()` y `run(args)`; su `main()` solo
+imprime el resultado, así que la interfaz CLI (y el modo aislado) no cambia.
+"""
+import importlib
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+EXECUTION_DIR = os.path.dirname(os.path.abspath(__file__))
+if EXECUTION_DIR not in sys.path:
+    sys.path.append(EXECUTION_DIR)
+
+# Herramientas que exponen build_parser() y run(args) -> dict
+IN_PROCESS_TOOLS = {
+    "analyze_image.py",
+    "chat_with_llm.py",
+    "delete_memory.py",
+    "ingest_manual.py",
+    "list_documents.py",
+    "list_memories.py",
+    "monitor_resources.py",
+    "query_memory.py",
+    "research_topic.py",
+    "run_sandbox.py",
+    "save_memory.py",
+    "scrape_single_site.py",
+    "search_parts.py",
+    "simulate_obd.py",
+    "telegram_tool.py",
+    "text_to_speech.py",
+    "transcribe_audio.py",
+    "translate_text.py",
+}
+
+
+def run_subprocess(script, args):
+    """Ejecuta una herramienta en un intérprete aislado y devuelve su salida JSON."""
+    script_path = os.path.join(EXECUTION_DIR, script)
+    cmd = [sys.executable, script_path] + args
+    try:
+        result = subprocess.run(cmd, capture_output=True, text=True)
+
+        # Mostrar stderr para depuración (RAG, errores, etc.)
+        if result.stderr:
+            print(f"   🛠️  [LOG {script}]: {result.stderr.strip()}")
+
+        return json.loads(result.stdout)
+    except json.JSONDecodeError:
+        return None
+    except Exception as e:
+        print(f"Error ejecutando {script}: {e}")
+        return None
+
+
+class ToolRegistry:
+    """
+    Resuelve llamadas `(script, args)` importando el módulo una sola vez.
+
+    Con `isolated=True` se conserva el comportamiento original (un subproceso
+    por llamada). Las herramientas que no están registradas, o cuyo import falla
+    (dependencia ausente), también se ejecutan en subproceso.
+    """
+
+    def __init__(self, isolated=False):
+        self.isolated = isolated
+        self._modules = {}
+        self._unavailable = set()
+        self._lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.stats = {}
+
+    def _load(self, script):
+        with self._lock:
+            if script in self._modules:
+                return self._modules[script]
+            if script in self._unavailable:
+                return None
+            try:
+                module = importlib.import_module(script[:-3])
+            except (ImportError, SystemExit) as e:
+                # Varios scripts hacen sys.exit() si falta una librería al importarse
+                print(f"   ⚠️ [REGISTRY] No se pudo importar {script} ({e!r}). Se usará subproceso.", file=sys.stderr)
+                self._unavailable.add(script)
+                return None
+            self._modules[script] = module
+            return module
+
+    def _run_in_process(self, module, script, args, **kwargs):
+        try:
+            parsed = module.build_parser().parse_args(args)
+        except SystemExit:
+            # argparse ya mostró el error; equivale a una salida JSON inválida
+            return None
+        try:
+            return module.run(parsed, **kwargs)
+        except Exception as e:
+            print(f"Error ejecutando {script}: {e}")
+            return None
+
+    def _record(self, script, mode, elapsed):
+        with self._stats_lock:
+            entry = self.stats.setdefault(script, {"calls": 0, "total_s": 0.0, "mode": mode})
+            entry["calls"] += 1
+            entry["total_s"] += elapsed
+            entry["mode"] = mode
+
+    def run(self, script, args, **kwargs):
+        """
+        Ejecuta `script` con los argumentos CLI `args` y devuelve un dict (o None).
+
+        Los `kwargs` (p. ej. el callback `on_delta` de chat_with_llm) solo llegan a
+        `run()` en proceso; en subproceso se ignoran y se devuelve el resultado final.
+        """
+        start = time.perf_counter()
+        module = None
+        if not self.isolated and script in IN_PROCESS_TOOLS:
+            module = self._load(script)
+
+        if module is not None:
+            result = self._run_in_process(module, script, args, **kwargs)
+            mode = "in-process"
+        else:
+            result = run_subprocess(script, args)
+            mode = "subprocess"
+
+        self._record(script, mode, time.perf_counter() - start)
+        return result
+
+    def warmup(self, scripts=None):
+        """Importa por adelantado las herramientas y devuelve el tiempo empleado (s)."""
+        if self.isolated:
+            return 0.0
+        start = time.perf_counter()
+        for script in sorted(scripts or IN_PROCESS_TOOLS):
+            self._load(script)
+        return time.perf_counter() - start
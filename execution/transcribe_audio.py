@@ -11,15 +11,16 @@ except ImportError:
     print(json.dumps({"status": "error", "message": "Faltan librerías. Ejecuta: pip install SpeechRecognition pydub"}))
     sys.exit(1)
 
-def main():
+def build_parser():
     parser = argparse.ArgumentParser(description="Transcribir archivo de audio a texto.")
     parser.add_argument("--file", required=True, help="Ruta al archivo de audio.")
     parser.add_argument("--lang", default="es-ES", help="Código de idioma (ej: es-ES, en-US).")
-    args = parser.parse_args()
+    return parser
 
+def run(args):
+    """Transcribe el audio y devuelve el resultado como diccionario."""
     if not os.path.exists(args.file):
-        print(json.dumps({"status": "error", "message": "Archivo no encontrado"}))
-        sys.exit(1)
+        return {"status": "error", "message": "Archivo no encontrado"}
 
     # Convertir OGG (Telegram) a WAV (Requerido por SpeechRecognition)
     wav_path = args.file + ".wav"
@@ -28,8 +29,7 @@ def main():
         audio.export(wav_path, format="wav")
     except Exception as e:
         print(f"Error pydub/ffmpeg: {e}", file=sys.stderr)
-        print(json.dumps({"status": "error", "message": f"Error convirtiendo audio (¿Tienes ffmpeg instalado?): {e}"}))
-        sys.exit(1)
+        return {"status": "error", "message": f"Error convirtiendo audio (¿Tienes ffmpeg instalado?): {e}"}
 
     r = sr.Recognizer()
     try:
@@ -38,14 +38,20 @@ def main():
             audio_data = r.record(source)
             # Transcribir usando Google Web Speech API (Gratis, soporta español)
             text = r.recognize_google(audio_data, language=args.lang)
-            print(json.dumps({"status": "success", "text": text}))
+            return {"status": "success", "text": text}
     except sr.UnknownValueError:
-        print(json.dumps({"status": "error", "message": "No se pudo entender el audio."}))
+        return {"status": "error", "message": "No se pudo entender el audio."}
     except Exception as e:
-        print(json.dumps({"status": "error", "message": str(e)}))
+        return {"status": "error", "message": str(e)}
     finally:
         if os.path.exists(wav_path):
             os.remove(wav_path)
 
+def main():
+    result = run(build_parser().parse_args())
+    print(json.dumps(result))
+    if result["status"] == "error":
+        sys.exit(1)
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
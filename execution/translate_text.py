@@ -11,6 +11,10 @@ except ImportError:
 # Añadir el directorio actual al path para importar chat_with_llm
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
+from pdf_extract import extract_text
+from prompt_budget import plan, describe, output_limit
+from map_reduce import MapReduce
+
 try:
     from chat_with_llm import chat_openai, chat_anthropic, chat_gemini
 except ImportError:
@@ -18,72 +22,89 @@ except ImportError:
     sys.exit(1)
 
 
-def main():
+TRANSLATE_PROMPT = """Actúa como un Traductor Técnico experto. Traduce el siguiente contenido al idioma: {lang}.
+
+REGLAS:
+1. Mantén el formato Markdown/Texto intacto (encabezados, bloques de código, negritas).
+2. NO traduzcas nombres de variables, comandos de código o rutas de archivos.
+3. Devuelve ÚNICAMENTE el contenido traducido, sin explicaciones extra ni bloques de markdown envolventes (```).
+
+CONTENIDO A TRADUCIR:
+{content}
+"""
+
+
+def _strip_fences(text):
+    """Limpieza básica: quita el bloque ``` que algunos modelos añaden alrededor de la respuesta."""
+    text = text.strip()
+    if text.startswith("```markdown"):
+        text = text.replace("```markdown", "", 1)
+    elif text.startswith("```"):
+        text = text.replace("```", "", 1)
+    if text.endswith("```"):
+        text = text[:-3]
+    return text
+
+
+def build_parser():
     parser = argparse.ArgumentParser(description="Traducir archivos de texto usando IA.")
     parser.add_argument("--file", required=True, help="Ruta del archivo a traducir.")
     parser.add_argument("--lang", required=True, help="Idioma destino.")
-    args = parser.parse_args()
+    return parser
 
+
+def run(args):
+    """Traduce el archivo indicado y devuelve el resultado como diccionario."""
     file_path = args.file
     target_lang = args.lang
 
     if not os.path.exists(file_path):
-        print(json.dumps({"status": "error", "message": f"Archivo no encontrado: {file_path}"}))
-        sys.exit(1)
+        return {"status": "error", "message": f"Archivo no encontrado: {file_path}"}
 
     try:
         if file_path.lower().endswith(".pdf"):
             if PdfReader is None:
-                print(json.dumps({"status": "error", "message": "Librería pypdf no instalada."}))
-                sys.exit(1)
-            reader = PdfReader(file_path)
-            content = "\n".join([page.extract_text() for page in reader.pages])
+                return {"status": "error", "message": "Librería pypdf no instalada."}
+            # Extracción en paralelo y cacheada por hash (ver pdf_extract.py)
+            content = extract_text(file_path)
         else:
             with open(file_path, 'r', encoding='utf-8') as f:
                 content = f.read()
                 
     except Exception as e:
-        print(json.dumps({"status": "error", "message": f"Error leyendo archivo: {e}"}))
-        sys.exit(1)
-
-    prompt = f"""Actúa como un Traductor Técnico experto. Traduce el siguiente contenido al idioma: {target_lang}.
-
-REGLAS:
-1. Mantén el formato Markdown/Texto intacto (encabezados, bloques de código, negritas).
-2. NO traduzcas nombres de variables, comandos de código o rutas de archivos.
-3. Devuelve ÚNICAMENTE el contenido traducido, sin explicaciones extra ni bloques de markdown envolventes (```).
-
-CONTENIDO A TRADUCIR:
-{content}
-"""
-
-    messages = [{"role": "user", "content": prompt}]
+        return {"status": "error", "message": f"Error leyendo archivo: {e}"}
 
     # Priorizar Gemini como se solicitó
-    response = {}
     if os.getenv("GOOGLE_API_KEY"):
-        response = chat_gemini(messages)
+        provider, chat, model = "gemini", chat_gemini, "gemini-flash-latest"
     elif os.getenv("OPENAI_API_KEY"):
-        response = chat_openai(messages, model="gpt-4o")
+        provider, chat, model = "openai", chat_openai, "gpt-4o"
     elif os.getenv("ANTHROPIC_API_KEY"):
-        response = chat_anthropic(messages, model="claude-3-5-sonnet-20240620")
+        provider, chat, model = "anthropic", chat_anthropic, "claude-3-5-sonnet-20240620"
     else:
-        print(json.dumps({"status": "error", "message": "No se encontraron API Keys configuradas en .env"}))
-        sys.exit(1)
-
-    if "error" in response:
-        print(json.dumps({"status": "error", "message": response["error"]}))
-        sys.exit(1)
-
-    translated_content = response.get("content", "")
-
-    # Limpieza básica
-    if translated_content.startswith("```markdown"):
-        translated_content = translated_content.replace("```markdown", "", 1)
-    elif translated_content.startswith("```"):
-        translated_content = translated_content.replace("```", "", 1)
-    if translated_content.endswith("```"):
-        translated_content = translated_content[:-3]
+        return {"status": "error", "message": "No se encontraron API Keys configuradas en .env"}
+
+    # La traducción ocupa lo mismo que el original (algo más en español): cada trozo
+    # debe caber tanto en la entrada como en la salida máxima del modelo
+    template = TRANSLATE_PROMPT.format(lang=target_lang, content="{payload}")
+    max_output = output_limit(provider, model)
+    budget = plan(content, provider, model, reserve=max_output, mode="split",
+                  max_part=int(max_output / 1.3), template=template.replace("{payload}", ""))
+    if budget["action"] == "split":
+        print(f"📏 [BUDGET] {describe(budget)}", file=sys.stderr)
+
+    def call(prompt):
+        response = chat([{"role": "user", "content": prompt}], model=model)
+        if "error" in response:
+            raise RuntimeError(response["error"])
+        return _strip_fences(response.get("content", ""))
+
+    # Los trozos se traducen en paralelo; si algo falla, al repetir solo se piden los que faltan
+    engine = MapReduce(call)
+    try:
+        translated_content = engine.translate(content, template, budget["available"])
+    except RuntimeError as e:
+        return {"status": "error", "message": str(e)}
 
     # Generar nombre de archivo de salida
     base, ext = os.path.splitext(file_path)
@@ -100,12 +121,21 @@ CONTENIDO A TRADUCIR:
         with open(output_path, 'w', encoding='utf-8') as f:
             f.write(translated_content.strip())
         
-        print(json.dumps({
+        return {
             "status": "success", 
-            "file_path": output_path
-        }))
+            "file_path": output_path,
+            "chunks": engine.stats["chunks"],
+            "cached_chunks": engine.stats["cached"],
+            "seconds": engine.stats["seconds"]
+        }
     except Exception as e:
-        print(json.dumps({"status": "error", "message": f"Error escribiendo archivo: {e}"}))
+        return {"status": "error", "message": f"Error escribiendo archivo: {e}"}
+
+
+def main():
+    result = run(build_parser().parse_args())
+    print(json.dumps(result))
+    if result.get("status") == "error":
         sys.exit(1)
 
 